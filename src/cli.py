@@ -1,16 +1,84 @@
 import argparse, json, os, sys, time
-from rich import print
-from src.pipeline import timeline, detections, report, provenance, memory, hayabusa
+
+# Pipeline modules pull in memprocfs, yara, pyarrow, jinja2 and tqdm; they
+# are imported by the subcommands that need them so `version`/`selftest`
+# start in a fraction of the time (see tests/bench_startup.sh).
 
 DEFAULT_PROFILE = os.environ.get("DFIRBOX_PROFILE", "/app/profiles/windows-triage.yml")
 
 
+def _load_profile(profile):
+    import yaml
+    try:
+        with open(profile, "r") as f:
+            return yaml.safe_load(f) or {}
+    except Exception:
+        return {}
+
+
+def _stage_keys(evidence, prof):
+    """Content addresses for cacheable stages: input fingerprints, tool identity and profile subsection."""
+    from src.pipeline import detections, eventstore, memory, stagecache
+    sc = stagecache
+    ev_fp = sc.fingerprint_paths([evidence])
+    mem_cfg = sc.section(prof, "memory.memprocfs") or {}
+    hb_cfg = sc.section(prof, "timeline.hayabusa", exclude=("threads", "shards")) or {}
+    sigma_cfg = sc.section(prof, "detections.sigma", exclude=("workers", "shard_bytes", "evtx")) or {}
+    yara_cfg = sc.section(prof, "detections.yara", exclude=("workers", "cache_dir")) or {}
+
+    keys = {}
+    sigma_rules = sc.tree_digest(sigma_cfg.get("rules_dir", "/app/rules/sigma"))
+    keys["timeline"] = sc.stage_key(
+        "timeline", evidence=ev_fp,
+        tools=[sc.tool_fingerprint("log2timeline.py"), sc.tool_fingerprint("psort.py")],
+        profile=sc.section(prof, "timeline", exclude=("hayabusa", "store", "mode", "workers", "worker_memory_limit",
+                                                       "process_memory_limit", "queue_size", "stream_queue")),
+        # streaming Sigma writes its findings during the timeline stage
+        sigma=[sigma_rules, sigma_cfg] if sigma_cfg.get("stream") else None)
+    keys["eventstore"] = sc.stage_key(
+        "eventstore", timeline=keys["timeline"], tools=[getattr(eventstore.pa, "__version__", None)],
+        profile=sc.section(prof, "timeline.store"))
+    keys["sigma"] = sc.stage_key(
+        "sigma", timeline=keys["timeline"], store=keys["eventstore"] if sigma_cfg.get("source") == "store" else None,
+        rules=sigma_rules, profile=sigma_cfg)
+    keys["yara"] = sc.stage_key(
+        "yara", evidence=sc.fingerprint_paths(yara_cfg.get("paths", [evidence])),
+        rules=sc.tree_digest(yara_cfg.get("rules_dir", "/app/rules/yara")),
+        tools=[getattr(detections.yarascan.yara, "__version__", None)], profile=yara_cfg)
+    # A collection plan depends on the Sigma rules and on whether Hayabusa or Sigma on EVTX runs.
+    plan_inputs = None
+    if mem_cfg.get("collect") == "plan":
+        plan_inputs = [sc.tree_digest(sigma_cfg.get("rules_dir", "/app/rules/sigma")), bool(hb_cfg.get("enabled")),
+                       bool(sc.section(prof, "detections.sigma.evtx.enabled"))]
+    keys["memprocfs"] = sc.stage_key(
+        "memprocfs", evidence=ev_fp, device=sc.fingerprint_paths([mem_cfg.get("device")]),
+        tools=[getattr(memory.memprocfs, "__version__", None) if memory.memprocfs else None], profile=mem_cfg,
+        plan=plan_inputs)
+    keys["memyara"] = sc.stage_key(
+        "memyara", memprocfs=keys["memprocfs"], manifest=keys["yara"],
+        rules=sc.tree_digest((mem_cfg.get("yara") or {}).get("rules_dir") or yara_cfg.get("rules_dir", "/app/rules/yara")),
+        tools=[getattr(detections.yarascan.yara, "__version__", None)],
+        profile=sc.section(prof, "memory.memprocfs.yara", exclude=("workers",)))
+    evtx_cfg = sc.section(prof, "detections.sigma.evtx", exclude=("workers", "chunks_per_shard")) or {}
+    keys["sigma_evtx"] = sc.stage_key(
+        "sigma_evtx", memprocfs=keys["memprocfs"], evtx=sc.fingerprint_paths(evtx_cfg.get("dirs") or []),
+        rules=sigma_rules, profile=[sigma_cfg.get("logsource_map"), evtx_cfg])
+    keys["hayabusa"] = sc.stage_key(
+        "hayabusa", memprocfs=keys["memprocfs"], evtx=sc.fingerprint_paths(hb_cfg.get("evtx_dirs") or [evidence]),
+        tools=[sc.tool_fingerprint("hayabusa")], profile=hb_cfg)
+    return keys
+
+
 def cmd_run(args):
+    from rich import print
+    from src.pipeline import timeline, detections, eventstore, report, provenance, memory, hayabusa, metrics, scheduler, stagecache
+
     evidence = os.path.abspath(args.evidence)
     outdir   = os.path.abspath(args.out)
     profile  = os.path.abspath(args.profile or DEFAULT_PROFILE)
 
     os.makedirs(outdir, exist_ok=True)
+    prof = _load_profile(profile)
     meta = {
         "start_epoch": int(time.time()),
         "profile": profile,
@@ -18,45 +86,125 @@ def cmd_run(args):
         "params": {"plaso": True, "sigma": True, "yara": True, "volatility": False}
     }
 
-    # 1. timeline
-    plaso_path, jsonl_path = timeline.make_timeline(evidence, outdir, profile)
+    # Stage graph: timeline -> sigma (and -> eventstore, which sigma reads with
+    # detections.sigma.source: store), memprocfs -> hayabusa and sigma_evtx
+    # (built-in EVTX parser), yara -> provenance
+    # (provenance reuses the evidence manifest written by the YARA pass),
+    # memprocfs + yara -> memyara (reuses the Vmm handle and the manifest).
+    # Independent branches run concurrently; a failure only skips dependents.
+    # Keyed stages are skipped when their outputs for the same inputs, tool
+    # and profile subsection already exist; provenance always reruns.
+    use_cache = not args.no_cache and (prof.get("pipeline") or {}).get("cache", True)
+    keys = _stage_keys(evidence, prof) if use_cache else {}
+    store_cfg = (prof.get("timeline") or {}).get("store") or {}
+    sigma_cfg = (prof.get("detections") or {}).get("sigma") or {}
+    sigma_deps = ["timeline", "eventstore"] if sigma_cfg.get("source") == "store" else ["timeline"]
+    # detections.sigma.stream: Sigma evaluates events inside the timeline stage
+    # as psort/direct export writes them; the sigma stage just hands on the file.
+    stream = bool(sigma_cfg.get("stream"))
+    stages = [
+        scheduler.Stage("timeline", lambda r: timeline.make_timeline(
+            evidence, outdir, profile, sink=detections.SigmaSink(profile, outdir) if stream else None), key=keys.get("timeline")),
+        scheduler.Stage("eventstore", lambda r: eventstore.build(r["timeline"][1], outdir, store_cfg) if store_cfg.get("enabled") else None,
+                        deps=["timeline"], key=keys.get("eventstore")),
+        scheduler.Stage("sigma", lambda r: os.path.join(outdir, "sigma_findings.jsonl") if stream
+                        else detections.run_sigma(r["timeline"][1], profile, outdir), deps=sigma_deps, key=keys.get("sigma")),
+        scheduler.Stage("yara", lambda r: detections.run_yara(evidence, profile, outdir), key=keys.get("yara")),
+        scheduler.Stage("memprocfs", lambda r: memory.run_memprocfs(evidence, profile, outdir), key=keys.get("memprocfs")),
+        scheduler.Stage("memyara", lambda r: memory.run_memory_yara(evidence, profile, outdir), deps=["memprocfs", "yara"], key=keys.get("memyara")),
+        scheduler.Stage("sigma_evtx", lambda r: detections.run_sigma_evtx(evidence, profile, outdir), deps=["memprocfs"], key=keys.get("sigma_evtx")),
+        scheduler.Stage("hayabusa", lambda r: hayabusa.run_hayabusa(evidence, profile, outdir), deps=["memprocfs"], key=keys.get("hayabusa")),
+        scheduler.Stage("provenance", lambda r: provenance.generate(evidence, profile, outdir), deps=["yara"]),
+    ]
+    max_workers = args.jobs or int((prof.get("pipeline") or {}).get("max_concurrency") or 4)
+    cache = stagecache.StageCache(outdir) if use_cache else None
+    pcfg = prof.get("pipeline") or {}
+    profile_stages = args.profile_stages.split(",") if args.profile_stages else pcfg.get("profile_stages")
+    run_metrics = metrics.Metrics(profile_stages, os.path.join(outdir, "profiles"), pcfg.get("profiler", "cprofile"))
+    results = scheduler.run_stages(stages, max_workers=max_workers, meta=meta, cache=cache, metrics=run_metrics)
+    metrics_path = run_metrics.write(os.path.join(outdir, "metrics.json"))
+
+    if results.get("memprocfs"):
+        meta["memprocfs"] = results["memprocfs"]
+    if results.get("memyara"):
+        meta["memory_yara"] = results["memyara"]
+    if results.get("hayabusa"):
+        meta["hayabusa"] = results["hayabusa"]
 
-    # 2. detections
-    sigma_out = detections.run_sigma(jsonl_path, profile, outdir)
-    yara_out  = detections.run_yara(evidence, profile, outdir)
+    # report: built from whatever the stages produced
+    with run_metrics.stage("report"):
+        if meta.get("memory_yara"):
+            context = memory.hit_context(evidence, profile, outdir, meta)
+            if context:
+                meta["memory_yara"]["context"] = context
+        summary = report.build(
+            outdir=outdir,
+            jsonl_events=(results.get("timeline") or (None, os.path.join(outdir, "events.jsonl")))[1],
+            sigma_path=results.get("sigma"),
+            sigma_evtx_path=results.get("sigma_evtx"),
+            cfg=prof.get("report") or {},
+            yara_path=results.get("yara"),
+            provenance_path=results.get("provenance"),
+            meta=meta,
+            metrics_path=metrics_path,
+            hayabusa_summary_path=(results.get("hayabusa") or {}).get("summary"),
+        )
+    memory.close_handles()
+    run_metrics.write(metrics_path)
 
-    # 3. MemProcFS memory forensics (optional)
-    memproc_out = memory.run_memprocfs(evidence, profile, outdir)
-    if memproc_out:
-        meta["memprocfs"] = memproc_out
+    failed = [name for name, t in meta["stages"].items() if t.get("status") not in ("ok", "cached")]
+    if failed:
+        print(f"[yellow]Done with failed/skipped stages: {', '.join(failed)}[/yellow]. Report: {summary}")
+        return 1
+    print(f"[green]Done[/green]. Report: {summary}")
+    return 0
 
-    # 4. Hayabusa EVTX timeline (optional)
-    hayabusa_out = hayabusa.run_hayabusa(evidence, profile, outdir)
-    if hayabusa_out:
-        meta["hayabusa"] = hayabusa_out
 
-    # 5. provenance
-    prov = provenance.generate(evidence, profile, outdir)
+def _run_job(job, no_cache=False):
+    """One batch job through the normal run pipeline (called in the job's forked child)."""
+    return cmd_run(argparse.Namespace(evidence=job["evidence"], out=job["out"], profile=job["profile"],
+                                      no_cache=no_cache, profile_stages=None, jobs=job.get("max_concurrency")))
 
-    # 6. report
-    summary = report.build(
-        outdir=outdir,
-        jsonl_events=jsonl_path,
-        sigma_path=sigma_out,
-        yara_path=yara_out,
-        provenance_path=prov,
-        meta=meta,
-    )
 
-    print(f"[green]Done[/green]. Report: {summary}")
-    return 0
+def cmd_batch(args):
+    from src.pipeline import batch
+    # Heavy pipeline imports happen once here, before any job is forked.
+    from src.pipeline import timeline, detections, eventstore, report, provenance, memory, hayabusa, metrics, scheduler, stagecache
+    run_job = lambda job: _run_job(job, args.no_cache)
+    profile = os.path.abspath(args.profile or DEFAULT_PROFILE)
+    if args.spool:
+        return batch.serve_spool(args.spool, run_job, args.concurrency, profile, poll=args.poll, once=args.once, cgroup=args.cgroup)
+    if not args.jobs_file:
+        print("batch: give a jobs file or --spool DIR", file=sys.stderr)
+        return 2
+    results = batch.Batch(run_job, args.concurrency, cgroup=args.cgroup).run(batch.load_jobs(args.jobs_file, profile))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump({"jobs": results}, f, indent=2)
+    return 0 if all(r["status"] == "ok" for r in results) else 1
 
 
-def cmd_version(_):
-    print(json.dumps(provenance.tool_versions(), indent=2))
+def cmd_version(args):
+    from src.pipeline import toolversions
+    if args.write:
+        print(f"Tool versions written to {toolversions.write(args.write)}")
+        return 0
+    print(json.dumps(toolversions.versions(), indent=2))
     return 0
 
 
+def cmd_integrity(args):
+    from src.pipeline import integrity
+    if args.write:
+        sbom = integrity.write_sbom(args.sbom) if args.sbom else None
+        path = integrity.write(args.write, roots=args.root or integrity.DEFAULT_ROOTS, sbom=sbom)
+        print(f"Build manifest written to {path}" + (f" (SBOM {sbom})" if sbom else ""))
+        return 0
+    result = integrity.verify()
+    print(json.dumps(result, indent=2))
+    return 0 if result["status"] == "verified" else 1
+
+
 def cmd_selftest(args):
     # Very light smoke check
     outdir = os.path.abspath(args.out)
@@ -75,11 +223,37 @@ def main():
     prun.add_argument("--profile", "-p", default=None, help="Profile YAML")
     prun.add_argument("--evidence", "-e", required=True, help="Path to evidence (dir)")
     prun.add_argument("--out", "-o", required=True, help="Output directory")
+    prun.add_argument("--no-cache", action="store_true", help="Rerun every stage even if cached outputs match")
+    prun.add_argument("--profile-stages", default=None, help="Comma-separated stages to profile (cProfile, or pyinstrument via pipeline.profiler)")
+    prun.add_argument("--jobs", "-j", type=int, default=None, help="Max concurrent stages (default: profile pipeline.max_concurrency or 4)")
     prun.set_defaults(func=cmd_run)
 
+    pb = sub.add_parser("batch", help="Run many evidence sets with rule engines loaded once")
+    pb.add_argument("jobs_file", nargs="?", default=None,
+                    help="YAML/JSON jobs: a list of {evidence, out, profile, cpus, memory, cpu_seconds}, or {defaults, jobs}")
+    pb.add_argument("--spool", metavar="DIR", default=None, help="Worker mode: take job files from this directory")
+    pb.add_argument("--concurrency", "-c", type=int, default=2, help="Jobs running at once (default 2)")
+    pb.add_argument("--profile", "-p", default=None, help="Profile YAML for jobs that do not name one")
+    pb.add_argument("--poll", type=float, default=2.0, help="With --spool: seconds between spool scans")
+    pb.add_argument("--cgroup", metavar="DIR", default=None,
+                    help="cgroup v2 directory for per-job cgroups ('off' for rlimits only; default $DFIRBOX_CGROUP, or the own cgroup in a container)")
+    pb.add_argument("--once", action="store_true", help="With --spool: exit once the spool is empty")
+    pb.add_argument("--summary", metavar="PATH", default=None, help="Write per-job results as JSON")
+    pb.add_argument("--no-cache", action="store_true", help="Rerun every stage of every job")
+    pb.set_defaults(func=cmd_batch)
+
     pver = sub.add_parser("version", help="Show tool versions discovered")
+    pver.add_argument("--write", metavar="PATH", default=None,
+                      help="Discover tool versions and write the manifest read at runtime (image build step)")
     pver.set_defaults(func=cmd_version)
 
+    pint = sub.add_parser("integrity", help="Verify tools, rules and code against the build manifest")
+    pint.add_argument("--write", metavar="PATH", default=None,
+                      help="Record the build manifest instead of verifying (image build step)")
+    pint.add_argument("--sbom", metavar="PATH", default=None, help="With --write: generate a syft SBOM here and record its digest")
+    pint.add_argument("--root", action="append", default=None, help="With --write: tree to record (repeatable; default /app/src, /app/rules, /app/profiles)")
+    pint.set_defaults(func=cmd_integrity)
+
     pst = sub.add_parser("selftest", help="Quick smoke test")
     pst.add_argument("--out", "-o", required=True)
     pst.set_defaults(func=cmd_selftest)
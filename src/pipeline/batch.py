@@ -0,0 +1,470 @@
+import os, json, re, time, signal, resource, multiprocessing, sys, traceback
+from multiprocessing.connection import wait
+import yaml
+from rich import print
+from src.pipeline import evidence
+
+# A batch worker loads rule engines, rule digests and tool versions once (the
+# memoized loaders in detections, yarascan, stagecache and toolversions) and
+# forks each job from that warm state. Every job runs the normal pipeline into
+# its own output directory, inside its own cgroup when one can be created.
+JOB_SUFFIXES = (".json", ".yml", ".yaml")
+SPOOL_DIRS = ("running", "done", "failed")
+BUDGET_KEYS = ("cpus", "memory", "cpu_seconds", "timeout", "max_concurrency")
+CGROUP_ENV = "DFIRBOX_CGROUP"
+CPU_PERIOD = 100000
+EXIT_MEMORY = 3  # run_job died of MemoryError
+EXIT_ERROR = 4  # run_job raised; 1 means some stages failed
+
+
+def parse_size(value):
+    """Bytes from an int or a string like "512M" / "8G"."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    s = str(value).strip().upper().rstrip("B")
+    mult = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return json.load(f) if path.endswith(".json") else yaml.safe_load(f)
+
+
+def _load_profile(profile):
+    try:
+        return _read(profile) or {}
+    except Exception:
+        return {}
+
+
+def make_job(spec, defaults, default_profile, job_id):
+    """Normalized job; budgets come from the job, then the jobs-file defaults, then the profile's batch section."""
+    job = dict(defaults or {}, **(spec or {}))
+    if not job.get("evidence") or not job.get("out"):
+        raise ValueError(f"job {job_id}: evidence and out are required")
+    job["id"] = str(job.get("id") or job_id)
+    job["evidence"] = os.path.abspath(job["evidence"])
+    job["out"] = os.path.abspath(job["out"])
+    job["profile"] = os.path.abspath(job.get("profile") or default_profile)
+    bcfg = _load_profile(job["profile"]).get("batch") or {}
+    for k in BUDGET_KEYS:
+        if job.get(k) is None and bcfg.get(k) is not None:
+            job[k] = bcfg[k]
+    job["memory"] = parse_size(job.get("memory"))
+    for k in ("cpus", "cpu_seconds", "timeout", "max_concurrency"):
+        job[k] = int(job[k]) if job.get(k) else None
+    return job
+
+
+def load_jobs(path, default_profile):
+    """Jobs from a YAML/JSON file: a list of jobs, or {defaults: {...}, jobs: [...]}."""
+    data = _read(path) or []
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get("defaults") or {}
+        data = data.get("jobs") or []
+    return [make_job(spec, defaults, default_profile, f"job{i:03d}") for i, spec in enumerate(data)]
+
+
+def warm(profile):
+    """Load what a run of this profile would otherwise rebuild; cheap (a stat per rule file) when already warm."""
+    from src.pipeline import detections, stagecache, toolversions, yarascan
+
+    prof = _load_profile(profile)
+    sigma_cfg = (prof.get("detections") or {}).get("sigma") or {}
+    yara_cfg = (prof.get("detections") or {}).get("yara") or {}
+    mem_yara = ((prof.get("memory") or {}).get("memprocfs") or {}).get("yara") or {}
+    sigma_dir = sigma_cfg.get("rules_dir", "/app/rules/sigma")
+    yara_dirs = {yara_cfg.get("rules_dir", "/app/rules/yara")}
+    if mem_yara.get("enabled"):
+        yara_dirs.add(mem_yara.get("rules_dir") or yara_cfg.get("rules_dir", "/app/rules/yara"))
+
+    t0 = time.perf_counter()
+    info = {"profile": profile}
+    try:
+        info["sigma_rules"] = len(detections._load_sigma_rules(sigma_dir, sigma_cfg.get("logsource_map"), quiet=True).rules)
+    except Exception as e:
+        print(f"[yellow]Batch: could not preload Sigma rules from {sigma_dir}: {e}[/yellow]")
+    for d in sorted(yara_dirs):
+        try:
+            info.setdefault("yara_rule_files", {})[d] = yarascan.compile_rules(d)[2]
+        except Exception as e:
+            print(f"[yellow]Batch: could not precompile YARA rules from {d}: {e}[/yellow]")
+    for d in [sigma_dir] + sorted(yara_dirs):
+        stagecache.tree_digest(d)
+    toolversions.versions()
+    info["wall_s"] = round(time.perf_counter() - t0, 3)
+    return info
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(str(value))
+
+
+def _read_kv(path):
+    try:
+        with open(path, "r") as f:
+            return {k: int(v) for k, v in (line.split() for line in f if len(line.split()) == 2)}
+    except (OSError, ValueError):
+        return {}
+
+
+def cgroup_parent(path=None):
+    """
+    cgroup v2 directory to create job cgroups under, or None.
+
+    Uses path, else $DFIRBOX_CGROUP, else this process's cgroup when it is a
+    namespace root ("0::/", e.g. a container with its own cgroup namespace);
+    a host cgroup is never reorganized unasked. The cpu and memory
+    controllers are enabled for children, which cgroup v2 only allows once
+    the directory holds no processes, so this worker moves into a leaf.
+    """
+    base = path or os.environ.get(CGROUP_ENV)
+    asked = bool(base)
+    if not base:
+        own = evidence.cgroup_dir()
+        base = own if own and os.path.realpath(own) == "/sys/fs/cgroup" else None
+    if not base:
+        return None
+    try:
+        with open(os.path.join(base, "cgroup.controllers"), "r") as f:
+            if not {"cpu", "memory"} <= set(f.read().split()):
+                raise OSError("cpu/memory controllers not available")
+        with open(os.path.join(base, "cgroup.procs"), "r") as f:
+            pids = f.read().split()
+        if pids:
+            leaf = os.path.join(base, "dfirbox-worker")
+            os.makedirs(leaf, exist_ok=True)
+            for pid in pids:
+                try:
+                    _write(os.path.join(leaf, "cgroup.procs"), pid)
+                except OSError:
+                    pass  # kernel threads and exited processes stay put
+        _write(os.path.join(base, "cgroup.subtree_control"), "+cpu +memory")
+        return base
+    except OSError as e:
+        if asked:
+            print(f"[yellow]Batch: no usable cgroup v2 at {base} ({e}); budgets fall back to per-process rlimits[/yellow]")
+        return None
+
+
+def _job_cgroup(parent, job, cores):
+    d = os.path.join(parent, f"dfirbox-job-{re.sub(r'[^A-Za-z0-9_.-]', '_', job['id'])}-{os.getpid()}-{int(time.time() * 1000)}")
+    os.makedirs(d)
+    if job.get("memory"):
+        _write(os.path.join(d, "memory.max"), job["memory"])
+        for name, value in (("memory.swap.max", 0), ("memory.oom.group", 1)):
+            try:
+                _write(os.path.join(d, name), value)
+            except OSError:
+                pass
+    if cores:
+        _write(os.path.join(d, "cpu.max"), f"{len(cores) * CPU_PERIOD} {CPU_PERIOD}")
+    return d
+
+
+def _cgroup_usage(d):
+    cpu = _read_kv(os.path.join(d, "cpu.stat")).get("usage_usec")
+    events = _read_kv(os.path.join(d, "memory.events"))
+    peak = None
+    try:
+        with open(os.path.join(d, "memory.peak"), "r") as f:
+            peak = int(f.read())
+    except (OSError, ValueError):
+        pass
+    return {"cpu_s": round(cpu / 1e6, 3) if cpu is not None else None, "memory_peak": peak,
+            "oom_kills": events.get("oom_kill", 0)}
+
+
+def _kill(proc, cg):
+    if cg:
+        try:
+            _write(os.path.join(cg, "cgroup.kill"), 1)
+        except OSError:
+            pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _remove_cgroup(d):
+    for _ in range(20):
+        try:
+            os.rmdir(d)
+            return
+        except FileNotFoundError:
+            return
+        except OSError:
+            time.sleep(0.05)  # still draining killed processes
+
+
+def _vm_data():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmData:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _apply_rlimits(job):
+    # Fallback without a cgroup. rlimits are per process and inherited, so
+    # every tool the job starts (log2timeline workers, psort, Hayabusa
+    # shards) gets the full allowance again: an upper bound per process,
+    # not a budget for the job as a whole.
+    if job.get("memory"):
+        # RLIMIT_DATA rather than RLIMIT_AS: read-only evidence mmaps do not
+        # count. The allowance is on top of what the child inherits.
+        limit = _vm_data() + job["memory"]
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    if job.get("cpu_seconds"):
+        # soft limit sends SIGXCPU, which terminates the process
+        resource.setrlimit(resource.RLIMIT_CPU, (job["cpu_seconds"], job["cpu_seconds"] + 5))
+
+
+def _child(job, cores, cg, run_job):
+    os.makedirs(job["out"], exist_ok=True)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    log = os.open(os.path.join(job["out"], "dfirbox.log"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    os.close(log)
+    os.setpgid(0, 0)  # the job's tools share its process group, so a kill reaches them too
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if cg:
+        # join before doing any work; every tool started later inherits the cgroup
+        _write(os.path.join(cg, "cgroup.procs"), os.getpid())
+    else:
+        _apply_rlimits(job)
+    if cores:
+        # pools size themselves from the affinity mask (evidence.available_cpus)
+        os.sched_setaffinity(0, cores)
+    try:
+        rc = run_job(job)
+    except MemoryError:
+        print(f"[red]Batch: job {job['id']} exceeded its memory budget ({job['memory']} bytes)[/red]")
+        rc = EXIT_MEMORY
+    except Exception:
+        os.write(2, traceback.format_exc().encode())  # fd 2 is dfirbox.log
+        rc = EXIT_ERROR
+    sys.exit(rc)
+
+
+def _status(exitcode, usage):
+    if exitcode == 0:
+        return "ok"
+    if exitcode == EXIT_MEMORY or (usage or {}).get("oom_kills"):
+        return "memory_budget"
+    if exitcode == -signal.SIGXCPU:
+        return "cpu_budget"
+    if exitcode == 1:
+        return "failed_stages"
+    return "error"
+
+
+class Batch:
+    """
+    Runs jobs in forked children, at most `concurrency` at a time.
+
+    A job with `cpus: N` waits for N cores no other running job is pinned
+    to. With a cgroup (see cgroup_parent) memory, CPU share and CPU seconds
+    are enforced for the job as a whole; otherwise per process via rlimits.
+    """
+
+    def __init__(self, run_job, concurrency, on_done=None, cgroup=None):
+        self.run_job = run_job
+        self.concurrency = max(1, int(concurrency))
+        self.on_done = on_done
+        self.ctx = multiprocessing.get_context("fork")
+        self.cores = sorted(os.sched_getaffinity(0))
+        self.free = list(self.cores)
+        self.cgroup = cgroup_parent(cgroup) if cgroup != "off" else None
+        self.running = {}
+        self.results = []
+        self.warmed = {}
+        self.killed = {}
+
+    def has_slot(self):
+        return len(self.running) < self.concurrency
+
+    def can_start(self, job):
+        return self.has_slot() and len(self.free) >= min(job.get("cpus") or 0, len(self.cores))
+
+    def start(self, job):
+        # re-warm in the parent so the child inherits compiled rules
+        if job["profile"] not in self.warmed:
+            info = self.warmed[job["profile"]] = warm(job["profile"])
+            print(f"[cyan]Batch: warmed {job['profile']} ({info.get('sigma_rules', 0)} Sigma rules, "
+                  f"{sum((info.get('yara_rule_files') or {}).values())} YARA rule files) in {info['wall_s']}s[/cyan]")
+        else:
+            warm(job["profile"])
+        n = min(job.get("cpus") or 0, len(self.cores))
+        cores, self.free = self.free[:n], self.free[n:]
+        cg = None
+        if self.cgroup:
+            try:
+                cg = _job_cgroup(self.cgroup, job, cores)
+            except OSError as e:
+                print(f"[yellow]Batch: could not create a cgroup for {job['id']} ({e}); using rlimits[/yellow]")
+        proc = self.ctx.Process(target=_child, args=(job, cores or None, cg, self.run_job), name=f"dfirbox-{job['id']}")
+        proc.start()
+        self.running[proc.sentinel] = (proc, job, cores, cg, time.time())
+        print(f"[cyan]Batch: started {job['id']} (pid {proc.pid}" + (f", cores {cores}" if cores else "")
+              + (", cgroup" if cg else "") + f") -> {job['out']}[/cyan]")
+
+    def _police(self):
+        """Kill jobs over their timeout or (cgroup) CPU seconds; returns seconds until the next check."""
+        due = None
+        for proc, job, _cores, cg, started in self.running.values():
+            if proc.exitcode is not None or proc.pid in self.killed:
+                continue
+            reason = None
+            if job.get("timeout"):
+                left = started + job["timeout"] - time.time()
+                if left <= 0:
+                    reason = "timeout"
+                due = left if due is None else min(due, left)
+            if cg and job.get("cpu_seconds"):
+                used = _cgroup_usage(cg)["cpu_s"] or 0
+                if used >= job["cpu_seconds"]:
+                    reason = reason or "cpu_budget"
+                due = 1.0 if due is None else min(due, 1.0)
+            if reason:
+                print(f"[yellow]Batch: {job['id']} over its {reason.replace('_', ' ')}, killing it[/yellow]")
+                self.killed[proc.pid] = reason
+                _kill(proc, cg)
+        return max(0.05, due) if due is not None else None
+
+    def reap(self, timeout=None):
+        """Wait up to timeout for running jobs; returns results of those that finished."""
+        if not self.running:
+            return []
+        due = self._police()
+        if due is not None:
+            timeout = due if timeout is None else min(timeout, due)
+        done = []
+        for sentinel in wait(list(self.running), timeout):
+            proc, job, cores, cg, started = self.running.pop(sentinel)
+            proc.join()
+            self.free = sorted(self.free + cores)
+            usage = None
+            if cg:
+                usage = _cgroup_usage(cg)
+                _kill(proc, cg)  # stragglers the job left behind
+                _remove_cgroup(cg)
+            result = {
+                "id": job["id"],
+                "evidence": job["evidence"],
+                "out": job["out"],
+                "profile": job["profile"],
+                "status": self.killed.pop(proc.pid, None) or _status(proc.exitcode, usage),
+                "exit_code": proc.exitcode,
+                "started": int(started),
+                "wall_s": round(time.time() - started, 3),
+                "budget": {"cores": cores or None, "memory": job.get("memory"), "cpu_seconds": job.get("cpu_seconds"),
+                           "timeout": job.get("timeout"), "enforced_by": "cgroup" if cg else "rlimit"},
+                "usage": usage,
+                "provenance": os.path.join(job["out"], "provenance.json"),
+                "log": os.path.join(job["out"], "dfirbox.log"),
+            }
+            color = "green" if result["status"] == "ok" else "yellow"
+            print(f"[{color}]Batch: {job['id']} {result['status']} in {result['wall_s']}s[/{color}]")
+            if self.on_done:
+                self.on_done(job, result)
+            self.results.append(result)
+            done.append(result)
+        return done
+
+    def run(self, jobs):
+        """Run every job, in order of submission, and wait for all of them."""
+        queue = list(jobs)
+        while queue or self.running:
+            while queue and self.can_start(queue[0]):
+                self.start(queue.pop(0))
+            self.reap(None)
+        return self.results
+
+
+def _spool_entries(spool):
+    names = [n for n in os.listdir(spool) if n.endswith(JOB_SUFFIXES) and not n.startswith(".")]
+    return sorted(names, key=lambda n: (os.path.getmtime(os.path.join(spool, n)), n))
+
+
+def serve_spool(spool, run_job, concurrency, default_profile, poll=2.0, once=False, cgroup=None):
+    """
+    Take job files from a spool directory until stopped (with once: until it is empty).
+
+    A job file (<name>.json/.yml, one job) is claimed by renaming it into
+    running/, so several workers can share a spool; producers write a
+    dot-file and rename it into place. Finished jobs move to done/ or
+    failed/ next to <name>.result.json.
+    """
+    spool = os.path.abspath(spool)
+    for d in SPOOL_DIRS:
+        os.makedirs(os.path.join(spool, d), exist_ok=True)
+    stale = [n for n in os.listdir(os.path.join(spool, "running")) if n.endswith(JOB_SUFFIXES)]
+    if stale:
+        print(f"[yellow]Batch: {len(stale)} job(s) left in {spool}/running by an earlier worker; not retried[/yellow]")
+
+    def finished(job, result):
+        dest = os.path.join(spool, "done" if result["status"] == "ok" else "failed")
+        name = job["spool_file"]
+        with open(os.path.join(dest, f"{os.path.splitext(name)[0]}.result.json"), "w") as f:
+            json.dump(result, f, indent=2)
+        os.replace(os.path.join(spool, "running", name), os.path.join(dest, name))
+
+    batch = Batch(run_job, concurrency, on_done=finished, cgroup=cgroup)
+    stopping = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stopping.append(True))
+    print(f"[cyan]Batch: watching {spool} ({batch.concurrency} concurrent jobs)[/cyan]")
+
+    pending = None
+    while True:
+        if not stopping:
+            for name in ([] if pending else _spool_entries(spool)):
+                if not batch.has_slot():
+                    break
+                claimed = os.path.join(spool, "running", name)
+                try:
+                    os.rename(os.path.join(spool, name), claimed)
+                except FileNotFoundError:
+                    continue  # another worker claimed it
+                try:
+                    job = make_job(_read(claimed), {}, default_profile, os.path.splitext(name)[0])
+                except Exception as e:
+                    print(f"[yellow]Batch: rejecting {name}: {e}[/yellow]")
+                    with open(os.path.join(spool, "failed", f"{os.path.splitext(name)[0]}.result.json"), "w") as f:
+                        json.dump({"id": os.path.splitext(name)[0], "status": "invalid", "error": str(e)}, f, indent=2)
+                    os.replace(claimed, os.path.join(spool, "failed", name))
+                    continue
+                job["spool_file"] = name
+                pending = job
+                break
+            # a job waiting for cores holds its place; later files wait behind it
+            if pending and batch.can_start(pending):
+                batch.start(pending)
+                pending = None
+                continue
+        if stopping and not batch.running:
+            if pending:
+                os.replace(os.path.join(spool, "running", pending["spool_file"]), os.path.join(spool, pending["spool_file"]))
+            break
+        if once and not pending and not batch.running and not _spool_entries(spool):
+            break
+        if batch.running:
+            batch.reap(poll)
+        else:
+            time.sleep(poll)
+    failed = [r for r in batch.results if r["status"] != "ok"]
+    print(f"[green]Batch: {len(batch.results)} job(s) run, {len(failed)} not ok[/green]")
+    return 1 if failed else 0
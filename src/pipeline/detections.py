@@ -1,115 +1,459 @@
-import os, re, json, fnmatch, yaml
+import os, json, shutil, yaml
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 from rich import print
-import subprocess, shlex
+from src.pipeline import evidence, eventstore, evtx, metrics, plasostore, sigmaengine, stagecache, yarascan
+
+# Compiled engines, keyed on rule dir and logsource map and checked against
+# the rule files' size/mtime. Stages sharing a process (and every job a
+# `dfirbox batch` worker forks) reuse one engine; it is read-only once built.
+_ENGINES = {}
 
 def run_yara(evidence_dir: str, profile_path: str, outdir: str):
     with open(profile_path, "r") as f:
         profile = yaml.safe_load(f) or {}
-    rules_dir = profile.get("detections", {}).get("yara", {}).get("rules_dir", "/app/rules/yara")
-    paths = profile.get("detections", {}).get("yara", {}).get("paths", [evidence_dir])
-
-    out_json = os.path.join(outdir, "yara_hits.json")
-    results = []
-
-    rule_files = [str(p) for p in Path(rules_dir).rglob("*.yar")]
-    if not rule_files:
-        print("[yellow]No YARA rules found[/yellow]")
-        with open(out_json,"w") as f: json.dump(results, f, indent=2)
-        return out_json
-
-    for root_path in paths:
-        for p in tqdm(list(Path(root_path).rglob("*")), desc="yara-scan"):
-            if p.is_file():
-                cmd = f'yara -r {" ".join(rule_files)} "{p}"'
-                pr = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                if pr.stdout.strip():
-                    for line in pr.stdout.strip().splitlines():
-                        results.append({"match": line, "file": str(p)})
-
-    with open(out_json,"w") as f:
-        json.dump(results, f, indent=2)
-    return out_json
-
-def _load_sigma_rules(rules_dir: str):
-    files = [p for p in Path(rules_dir).rglob("*.yml")]
-    rules = []
-    for f in files:
+    ycfg = profile.get("detections", {}).get("yara", {})
+    rules_dir = ycfg.get("rules_dir", "/app/rules/yara")
+    paths = ycfg.get("paths", [evidence_dir])
+    workers = int(ycfg.get("workers") or evidence.available_cpus())
+    max_file_bytes = int(ycfg.get("max_file_bytes", yarascan.DEFAULT_MAX_FILE_BYTES))
+    timeout = int(ycfg.get("timeout", yarascan.DEFAULT_TIMEOUT))
+    cache_dir = evidence.cache_dir(outdir, ycfg.get("cache_dir"))
+
+    out_jsonl = os.path.join(outdir, "yara_hits.jsonl")
+
+    try:
+        rules, _tree_hash, rule_count = yarascan.compile_rules(rules_dir, cache_dir)
+        metrics.count("rules", rule_count)
+    except Exception as e:
+        print(f"[red]YARA: failed compiling rules in {rules_dir}: {e}[/red]")
+        rules = None
+    if rules is None:
+        print("[yellow]No YARA rules found; hashing evidence only[/yellow]")
+
+    # One read per file: the walker hashes it, hands the same buffer to YARA
+    # and records it in evidence_manifest.jsonl for provenance to reuse.
+    consumer = yarascan.file_consumer(rules, max_file_bytes, timeout) if rules is not None else None
+    def progress(it):
+        for item in tqdm(it, desc="yara-scan"):
+            metrics.count("files")
+            yield item
+    with open(out_jsonl, "w") as out:
+        hash_cache = evidence.HashCache(cache_dir)
+        for hit in evidence.walk(paths, outdir, consumer, workers=workers, progress=progress, cache=hash_cache):
+            out.write(json.dumps(hit) + "\n")
+            metrics.count("hits")
+    return out_jsonl
+
+def _load_sigma_rules(rules_dir: str, logsource_map=None, quiet=False):
+    """Compile every Sigma rule under rules_dir into an indexed SigmaEngine (memoized)."""
+    key = (os.path.abspath(rules_dir), json.dumps(logsource_map, sort_keys=True, default=str))
+    stamp = stagecache.fingerprint_paths([rules_dir])
+    hit = _ENGINES.get(key)
+    if hit and hit[0] == stamp:
+        engine = hit[1]
+    else:
+        engine = sigmaengine.load_rules(rules_dir, logsource_map, quiet=quiet)
+        _ENGINES[key] = (stamp, engine)
+    # reported on every load, since the memoized engine may have been built quietly
+    if not quiet and engine.skip_summary():
+        print(f"[yellow]Sigma: {engine.skip_summary()} under {rules_dir}[/yellow]")
+    return engine
+
+def _shard_ranges(path: str, count: int):
+    """Split a JSONL file into at most `count` byte ranges that start and end on line boundaries."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    count = max(1, min(count, size))
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, count):
+            f.seek(max(size * i // count, bounds[-1]))
+            if f.tell() > 0:
+                f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+EVENT_REFS = ("event", "offset", "line")
+
+def _finding(r, ev, event_ref: str, offset: int, lineno: int):
+    f = {"rule": r.title, "rule_id": r.id, "level": r.level, "rule_path": r.path}
+    if event_ref == "offset":
+        f["event_offset"] = offset
+    elif event_ref == "line":
+        f["event_line"] = lineno
+    else:
+        f["event"] = ev
+    return f
+
+
+def _sigma_scan_range(engine, jsonl_events: str, start: int, end: int, out, event_ref: str = "event", line_base: int = 0):
+    """
+    Evaluate every event in [start, end) and write findings to `out` as JSON lines.
+
+    Returns (findings, lines) so callers can rebase line numbers of later shards.
+    """
+    found = 0
+    lineno = line_base
+    with open(jsonl_events, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            offset = pos
+            pos += len(line)
+            lineno += 1
+            try:
+                ev = json.loads(line)
+            except Exception:
+                continue
+            if not isinstance(ev, dict):
+                continue
+            for r in engine.match(ev):
+                out.write(json.dumps(_finding(r, ev, event_ref, offset, lineno)) + "\n")
+                found += 1
+    metrics.count("events", lineno - line_base)
+    metrics.count("findings", found)
+    return found, lineno - line_base
+
+
+_WORKER_ENGINE = None
+
+def _sigma_worker_init(rules_dir: str, logsource_map):
+    global _WORKER_ENGINE
+    _WORKER_ENGINE = _load_sigma_rules(rules_dir, logsource_map, quiet=True)
+
+def _sigma_worker_shard(jsonl_events: str, start: int, end: int, shard_path: str, event_ref: str):
+    with open(shard_path, "w") as out:
+        return _sigma_scan_range(_WORKER_ENGINE, jsonl_events, start, end, out, event_ref)
+
+
+def _source_events(kind: str, path: str, shard, columns=None):
+    """
+    (offset, line, event) from the columnar store (shard = file list), Plaso
+    storage (shard = rowid range) or EVTX logs (shard = (file, chunk indices)).
+    """
+    if kind == "store":
+        return eventstore.iter_events(path, columns, files=shard)
+    if kind == "evtx":
+        return ((None, None, ev) for ev in evtx.iter_records(shard[0], chunks=shard[1]))
+    start, end = shard if shard else (None, None)
+    return ((None, None, ev) for ev in plasostore.iter_events(path, start, end))
+
+def _sigma_scan_source(engine, kind: str, path: str, shard, columns, out, event_ref: str = "event"):
+    """Evaluate events from a non-JSONL source; offsets/lines (store only) come from the source itself."""
+    found = events = 0
+    for offset, lineno, ev in _source_events(kind, path, shard, columns):
+        events += 1
+        for r in engine.match(ev):
+            out.write(json.dumps(_finding(r, ev, event_ref, offset, lineno)) + "\n")
+            found += 1
+    metrics.count("events", events)
+    metrics.count("findings", found)
+    return found, events
+
+def _sigma_worker_source(kind: str, path: str, shard, columns, shard_path: str, event_ref: str):
+    with open(shard_path, "w") as out:
+        return _sigma_scan_source(_WORKER_ENGINE, kind, path, shard, columns, out, event_ref)
+
+
+def _run_sigma_source(engine, kind: str, path: str, shards, columns, out_jsonl: str, event_ref: str,
+                      workers: int, rules_dir: str, logsource_map):
+    """Evaluate shards of a store/Plaso source on worker processes, appending findings in shard order."""
+    with open(out_jsonl, "w") as out:
+        if workers > 1 and len(shards) > 1:
+            shard_paths = [f"{out_jsonl}.shard-{i:05d}" for i in range(len(shards))]
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_sigma_worker_init,
+                                         initargs=(rules_dir, logsource_map)) as pool:
+                    futures = [pool.submit(_sigma_worker_source, kind, path, shard, columns, sp, event_ref)
+                               for shard, sp in zip(shards, shard_paths)]
+                    for fut, sp in zip(futures, shard_paths):
+                        found, events = fut.result()
+                        metrics.count("events", events)
+                        metrics.count("findings", found)
+                        _append_shard(out, sp, event_ref, 0)
+            finally:
+                for sp in shard_paths:
+                    if os.path.exists(sp):
+                        os.remove(sp)
+        else:
+            # EVTX shards span several files, so they are walked one by one.
+            for shard in (shards if kind == "evtx" else [None]):
+                _sigma_scan_source(engine, kind, path, shard, columns, out, event_ref)
+    return out_jsonl
+
+
+def _run_sigma_store(engine, store: str, out_jsonl: str, event_ref: str, workers: int,
+                     rules_dir: str, logsource_map):
+    """
+    Sigma over events.parquet: one shard per Parquet file, and only the
+    columns the rules read when they can all be answered from typed columns
+    (findings then reference events by offset/line rather than embedding them).
+    Findings come out in partition (day) order rather than events.jsonl order.
+    """
+    fields = {f for r in engine.rules for f in r.fields}
+    for extra in (logsource_map or {}).values():
+        if isinstance(extra, dict):
+            fields.update(str(k).split("|")[0] for k in extra)
+    keywords = any(r.keywords for r in engine.rules)
+    columns = eventstore.projection(sorted(fields), keywords) if event_ref != "event" else None
+    print(f"[cyan]Sigma: reading {'columns ' + ', '.join(columns) if columns else 'full events'} from {store}[/cyan]")
+    shards = [[fp] for fp in eventstore.fragments(store)]
+    return _run_sigma_source(engine, "store", store, shards, columns, out_jsonl, event_ref,
+                             workers, rules_dir, logsource_map)
+
+
+def _run_sigma_plaso(engine, plaso_file: str, out_jsonl: str, event_ref: str, workers: int,
+                     shard_events: int, rules_dir: str, logsource_map):
+    """
+    Sigma straight from timeline.plaso, without a psort JSONL export.
+
+    The event table is split into rowid ranges of about shard_events rows.
+    There is no events.jsonl to point into, so findings always embed the event.
+    """
+    if event_ref != "event":
+        print(f"[yellow]Sigma: event_ref {event_ref!r} needs events.jsonl; embedding events[/yellow]")
+    lo, hi = plasostore.event_range(plaso_file)
+    step = max(1, int(shard_events))
+    shards = [(a, min(a + step, hi + 1)) for a in range(lo, hi + 1, step)] if hi >= lo and hi else []
+    print(f"[cyan]Sigma: reading events from {plaso_file} ({len(shards)} shards)[/cyan]")
+    return _run_sigma_source(engine, "plaso", plaso_file, shards, None, out_jsonl, "event",
+                             workers, rules_dir, logsource_map)
+
+
+def run_sigma_evtx(evidence_dir: str, profile_path: str, outdir: str):
+    """
+    Sigma straight over EVTX logs with the built-in parser (detections.sigma.evtx).
+
+    Reads memprocfs_eventlogs/ (or the configured dirs) without waiting on
+    Plaso. A chunk carved into several logs is read once (evtx.unique_chunks).
+    Each log's chunks are cut into runs of chunks_per_shard that worker
+    processes parse and evaluate independently. Records are
+    {System, EventData} as in the event XML, so rules on EventData.* fields
+    match. Findings embed the record and go to sigma_evtx_findings.jsonl,
+    in file and chunk order.
+    """
+    with open(profile_path, "r") as f:
+        profile = yaml.safe_load(f) or {}
+    scfg = profile.get("detections", {}).get("sigma", {})
+    ecfg = scfg.get("evtx") or {}
+    if not ecfg.get("enabled"):
+        return None
+    rules_dir = scfg.get("rules_dir", "/app/rules/sigma")
+    logsource_map = scfg.get("logsource_map")
+    workers = max(1, int(ecfg.get("workers") or scfg.get("workers") or evidence.available_cpus()))
+    per_shard = max(1, int(ecfg.get("chunks_per_shard", 32)))
+
+    mem_cfg = (profile.get("memory") or {}).get("memprocfs") or {}
+    dirs = ecfg.get("dirs") or [mem_cfg.get("eventlog_dir") or os.path.join(outdir, "memprocfs_eventlogs")]
+    files = evtx.find_files([d for d in dirs if os.path.isdir(d)])
+    out_jsonl = os.path.join(outdir, "sigma_evtx_findings.jsonl")
+    if not files:
+        print(f"[yellow]Sigma EVTX: no EVTX files under {', '.join(dirs)}, skipping[/yellow]")
+        open(out_jsonl, "w").close()
+        return out_jsonl
+
+    engine = _load_sigma_rules(rules_dir, logsource_map)
+    metrics.count("rules", len(engine))
+    metrics.count("files", len(files))
+    if not len(engine):
+        open(out_jsonl, "w").close()
+        print("[yellow]No Sigma rules found[/yellow]")
+        return out_jsonl
+    # carved logs share chunks; each one is evaluated (and reported) once
+    chunks = evtx.unique_chunks(files)
+    total = sum(evtx.chunk_count(path) for path, _size in files)
+    kept = sum(len(idx) for _path, idx in chunks)
+    metrics.count("chunks", kept)
+    shards = [(path, idx[a:a + per_shard]) for path, idx in chunks for a in range(0, len(idx), per_shard)]
+    print(f"[cyan]Sigma EVTX: {len(files)} logs, {kept} unique chunks of {total} slots, "
+          f"{len(shards)} shards on {workers} workers[/cyan]")
+    _run_sigma_source(engine, "evtx", None, shards, None, out_jsonl, "event",
+                      workers, rules_dir, logsource_map)
+    print(f"[green]Sigma EVTX: findings written to {out_jsonl}[/green]")
+    return out_jsonl
+
+
+def _append_shard(out, shard_path: str, event_ref: str, line_base: int):
+    """Append a worker's shard file to the merged output, rebasing line numbers if needed."""
+    with open(shard_path, "r") as f:
+        if event_ref == "line" and line_base:
+            for line in f:
+                d = json.loads(line)
+                d["event_line"] += line_base
+                out.write(json.dumps(d) + "\n")
+        else:
+            shutil.copyfileobj(f, out)
+    os.remove(shard_path)
+
+
+def load_event(jsonl_events: str, finding: dict):
+    """Return the event a finding refers to, resolving event_offset/event_line references."""
+    if "event" in finding:
+        return finding["event"]
+    if "event_offset" in finding:
+        with open(jsonl_events, "rb") as f:
+            f.seek(int(finding["event_offset"]))
+            return json.loads(f.readline())
+    if "event_line" in finding:
+        with open(jsonl_events, "rb") as f:
+            for i, line in enumerate(f, 1):
+                if i == finding["event_line"]:
+                    return json.loads(line)
+    return None
+
+
+def iter_jsonl(path: str):
+    """Yield records from a findings/hits JSONL file, skipping unparsable lines."""
+    if not path or not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except Exception:
+                continue
+
+
+class SigmaSink:
+    """
+    Incremental Sigma evaluation for streaming mode (detections.sigma.stream).
+
+    timeline.make_timeline feeds (offset, line number, raw line) for each
+    event as soon as psort or the direct export writes it; findings are
+    written immediately and those at alert_levels (default high/critical)
+    are printed as they are found. The output is the same file a later
+    run_sigma pass would write, in the same order.
+    """
+
+    def __init__(self, profile_path: str, outdir: str, max_alerts: int = 20):
+        with open(profile_path, "r") as f:
+            profile = yaml.safe_load(f) or {}
+        scfg = profile.get("detections", {}).get("sigma", {})
+        self.event_ref = scfg.get("event_ref", "event")
+        if self.event_ref not in EVENT_REFS:
+            print(f"[yellow]Sigma: unknown event_ref {self.event_ref!r}; embedding events[/yellow]")
+            self.event_ref = "event"
+        self.alert_levels = set(scfg.get("alert_levels", ["high", "critical"]))
+        self.max_alerts = max_alerts
+        self.engine = _load_sigma_rules(scfg.get("rules_dir", "/app/rules/sigma"), scfg.get("logsource_map"))
+        metrics.count("rules", len(self.engine))
+        self.path = os.path.join(outdir, "sigma_findings.jsonl")
+        self.out = open(self.path, "w")
+        self.events = self.findings = self.alerts = 0
+
+    def feed(self, offset: int, lineno: int, line: bytes) -> None:
+        self.events += 1
+        if not len(self.engine):
+            return
         try:
-            data = yaml.safe_load(open(f,"r")) or {}
-            if not isinstance(data, dict): continue
-            title = data.get("title", f.name)
-            detection = data.get("detection", {})
-            condition = detection.get("condition","")
-            selections = []
-            for k,v in detection.items():
-                if k == "condition": continue
-                if isinstance(v, dict):
-                    selections.append((k, v))
-            rules.append({"title": title, "file": str(f), "detection": detection, "condition": condition, "selections": selections})
+            ev = json.loads(line)
         except Exception:
-            continue
-    return rules
-
-def _match_selection(event: dict, kv: dict) -> bool:
-    for field, expected in kv.items():
-        ev = _dig(event, field)
-        if ev is None: return False
-        if isinstance(expected, str):
-            if expected.startswith("|contains "):
-                needle = expected.split(" ",1)[1].lower()
-                return needle in str(ev).lower()
-            if "*" in expected or "?" in expected:
-                return fnmatch.fnmatch(str(ev), expected)
-            return str(ev) == str(expected)
-        if isinstance(expected, list):
-            return any(fnmatch.fnmatch(str(ev), str(item)) if ("*" in str(item) or "?" in str(item)) else str(ev)==str(item) for item in expected)
-        return str(ev) == str(expected)
-    return True
-
-def _dig(d, dotted):
-    cur = d
-    for part in dotted.split('|')[0].split('.'):
-        if isinstance(cur, dict) and part in cur:
-            cur = cur[part]
-        else:
-            return None
-    return cur
+            return
+        if not isinstance(ev, dict):
+            return
+        for r in self.engine.match(ev):
+            self.out.write(json.dumps(_finding(r, ev, self.event_ref, offset, lineno)) + "\n")
+            self.findings += 1
+            if r.level in self.alert_levels and self.alerts < self.max_alerts:
+                self.alerts += 1
+                print(f"[red]Sigma: {r.level} finding '{r.title}' at event line {lineno}[/red]")
+
+    def reset(self) -> None:
+        """Drop everything fed so far, before the events are streamed again from the start."""
+        self.out.seek(0)
+        self.out.truncate()
+        self.events = self.findings = self.alerts = 0
+
+    def close(self) -> str:
+        if not self.out.closed:
+            self.out.close()
+            metrics.count("events", self.events)
+            metrics.count("findings", self.findings)
+            print(f"[green]Sigma: {self.findings} findings over {self.events} streamed events[/green]")
+        return self.path
+
 
 def run_sigma(jsonl_events: str, profile_path: str, outdir: str):
     with open(profile_path, "r") as f:
         profile = yaml.safe_load(f) or {}
-    rules_dir = profile.get("detections", {}).get("sigma", {}).get("rules_dir", "/app/rules/sigma")
+    scfg = profile.get("detections", {}).get("sigma", {})
+    rules_dir = scfg.get("rules_dir", "/app/rules/sigma")
+    logsource_map = scfg.get("logsource_map")
+    workers = max(1, int(scfg.get("workers") or 1))
+    shard_bytes = int(scfg.get("shard_bytes", 64 * 1024 * 1024))
 
-    out_json = os.path.join(outdir, "sigma_findings.json")
-    matches = []
+    event_ref = scfg.get("event_ref", "event")
+    if event_ref not in EVENT_REFS:
+        print(f"[yellow]Sigma: unknown event_ref {event_ref!r}; embedding events[/yellow]")
+        event_ref = "event"
 
-    rules = _load_sigma_rules(rules_dir)
-    if not rules:
-        with open(out_json,"w") as f: json.dump(matches, f, indent=2)
+    out_jsonl = os.path.join(outdir, "sigma_findings.jsonl")
+
+    engine = _load_sigma_rules(rules_dir, logsource_map)
+    metrics.count("rules", len(engine))
+    if not len(engine):
+        open(out_jsonl, "w").close()
         print("[yellow]No Sigma rules found[/yellow]")
-        return out_json
+        return out_jsonl
+
+    source = scfg.get("source", "jsonl")
+    plaso_file = os.path.join(outdir, "timeline.plaso")
+    if source == "plaso" and os.path.exists(plaso_file):
+        return _run_sigma_plaso(engine, plaso_file, out_jsonl, event_ref, workers,
+                                int(scfg.get("shard_events", 250000)), rules_dir, logsource_map)
+    if source == "store":
+        if eventstore.exists(outdir):
+            return _run_sigma_store(engine, eventstore.store_path(outdir), out_jsonl, event_ref,
+                                    workers, rules_dir, logsource_map)
+        print("[yellow]Sigma: event store not available; reading events.jsonl[/yellow]")
 
     if not os.path.exists(jsonl_events):
         print("[yellow]events.jsonl missing; skipping Sigma[/yellow]")
-        with open(out_json,"w") as f: json.dump(matches, f, indent=2)
-        return out_json
+        open(out_jsonl, "w").close()
+        return out_jsonl
 
-    with open(jsonl_events, "r") as f:
-        for line in f:
+    size = os.path.getsize(jsonl_events)
+    shard_count = max(workers, -(-size // max(1, shard_bytes)))
+    shards = _shard_ranges(jsonl_events, shard_count if workers > 1 else 1)
+
+    with open(out_jsonl, "w") as out:
+        if workers > 1 and len(shards) > 1:
+            # Each worker compiles the rule set once and streams its shard to a
+            # side file; side files are appended in file order so the findings
+            # are identical to a single-process run.
+            print(f"[cyan]Sigma: evaluating {len(shards)} shards on {workers} workers[/cyan]")
+            shard_paths = [f"{out_jsonl}.shard-{i:05d}" for i in range(len(shards))]
             try:
-                ev = json.loads(line)
-            except Exception:
-                continue
-            for r in rules:
-                ok = True
-                for _,sel in r["selections"]:
-                    if not _match_selection(ev, sel):
-                        ok=False; break
-                if ok:
-                    matches.append({"rule": r["title"], "rule_path": r["file"], "event": ev})
-
-    with open(out_json,"w") as f:
-        json.dump(matches, f, indent=2)
-    return out_json
+                with ProcessPoolExecutor(max_workers=workers, initializer=_sigma_worker_init,
+                                         initargs=(rules_dir, logsource_map)) as pool:
+                    futures = [pool.submit(_sigma_worker_shard, jsonl_events, a, b, sp, event_ref)
+                               for (a, b), sp in zip(shards, shard_paths)]
+                    line_base = 0
+                    for fut, sp in zip(futures, shard_paths):
+                        found, lines = fut.result()
+                        metrics.count("events", lines)
+                        metrics.count("findings", found)
+                        _append_shard(out, sp, event_ref, line_base)
+                        line_base += lines
+            finally:
+                for sp in shard_paths:
+                    if os.path.exists(sp):
+                        os.remove(sp)
+        else:
+            for a, b in shards:
+                _sigma_scan_range(engine, jsonl_events, a, b, out, event_ref)
+    return out_jsonl
@@ -0,0 +1,280 @@
+import datetime
+import json
+import os
+import shutil
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+from rich import print
+
+from src.pipeline import metrics
+from src.pipeline.timeline import event_timestamp
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.dataset as ds  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception:
+    pa = None  # type: ignore
+    ds = None  # type: ignore
+    pq = None  # type: ignore
+
+
+STORE_NAME = "events.parquet"
+DEFAULT_BATCH_ROWS = 65536
+DEFAULT_MAX_BUFFERED_ROWS = 262144
+DEFAULT_MAX_OPEN_FILES = 64
+
+# Plaso attributes lifted into their own columns; everything else stays in
+# the raw `event` JSON column so an event can always be rebuilt in full.
+# offset/line locate the event in events.jsonl, so findings read from the
+# store reference events exactly like findings read from the JSONL.
+FIELD_COLUMNS = ("data_type", "parser", "timestamp_desc", "display_name", "filename", "message")
+DICTIONARY_COLUMNS = ("data_type", "parser", "timestamp_desc")
+LOCATION_COLUMNS = ("offset", "line")
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def store_path(outdir: str) -> str:
+    return os.path.join(outdir, STORE_NAME)
+
+
+def exists(outdir: str) -> bool:
+    return available() and os.path.isdir(store_path(outdir))
+
+
+def _schema():
+    fields = [
+        ("offset", pa.int64()),
+        ("line", pa.int64()),
+        ("timestamp", pa.int64()),
+    ]
+    for name in FIELD_COLUMNS:
+        typ = pa.dictionary(pa.int32(), pa.string()) if name in DICTIONARY_COLUMNS else pa.string()
+        fields.append((name, typ))
+    fields.append(("event", pa.string()))
+    return pa.schema(fields)
+
+
+def _partition(ts: Optional[int]) -> str:
+    if ts is None:
+        return "unknown"
+    try:
+        return datetime.datetime.fromtimestamp(ts / 1e6, datetime.timezone.utc).strftime("%Y-%m-%d")
+    except (OverflowError, OSError, ValueError):
+        return "unknown"
+
+
+class _PartitionWriter:
+    """
+    Buffers rows per day partition and flushes them as row groups.
+
+    A timeline can span thousands of days (1970 and far-future timestamps
+    included), so both limits are global: at most max_buffered rows are held
+    across all days (the largest buffer is flushed when the cap is hit) and at
+    most max_open Parquet files stay open. A day whose writer was closed
+    continues in a new part file when it gets more rows.
+    """
+
+    def __init__(self, root: str, schema, compression: str, batch_rows: int,
+                 max_buffered: int = DEFAULT_MAX_BUFFERED_ROWS, max_open: int = DEFAULT_MAX_OPEN_FILES):
+        self.root = root
+        self.schema = schema
+        self.compression = compression
+        self.batch_rows = batch_rows
+        self.max_buffered = max(batch_rows, max_buffered)
+        self.max_open = max(1, max_open)
+        self.writers: "OrderedDict[str, Any]" = OrderedDict()
+        self.parts: Dict[str, int] = {}
+        self.buffers: Dict[str, Dict[str, list]] = {}
+        self.buffered = 0
+
+    def add(self, day: str, row: Dict[str, Any]) -> None:
+        buf = self.buffers.get(day)
+        if buf is None:
+            buf = self.buffers[day] = {name: [] for name in self.schema.names}
+        for name in self.schema.names:
+            buf[name].append(row.get(name))
+        self.buffered += 1
+        if len(buf["offset"]) >= self.batch_rows:
+            self._flush(day)
+        elif self.buffered >= self.max_buffered:
+            self._flush(max(self.buffers, key=lambda d: len(self.buffers[d]["offset"])))
+
+    def _writer(self, day: str):
+        writer = self.writers.get(day)
+        if writer is not None:
+            self.writers.move_to_end(day)
+            return writer
+        if len(self.writers) >= self.max_open:
+            self.writers.popitem(last=False)[1].close()
+        part = self.parts.get(day, 0)
+        self.parts[day] = part + 1
+        part_dir = os.path.join(self.root, f"date={day}")
+        os.makedirs(part_dir, exist_ok=True)
+        writer = self.writers[day] = pq.ParquetWriter(
+            os.path.join(part_dir, f"part-{part:05d}.parquet"), self.schema, compression=self.compression)
+        return writer
+
+    def _flush(self, day: str) -> None:
+        buf = self.buffers.pop(day, None)
+        if not buf or not buf["offset"]:
+            return
+        self.buffered -= len(buf["offset"])
+        self._writer(day).write_table(pa.Table.from_pydict(buf, schema=self.schema))
+
+    def close(self) -> None:
+        for day in sorted(self.buffers):
+            self._flush(day)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+def build(jsonl_events: str, outdir: str, cfg: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Convert events.jsonl into a compressed, day-partitioned Parquet dataset.
+
+    One streaming pass; at most max_buffered_rows rows are buffered and
+    max_open_files Parquet files open at a time, however many days the
+    timeline spans.
+    Common Plaso attributes become typed columns, with data_type, parser and
+    timestamp_desc dictionary-encoded; the raw event is kept in `event`.
+    The dataset is written next to the JSONL and swapped in atomically.
+    Returns the store path, or None when pyarrow is not installed.
+    """
+    cfg = cfg or {}
+    if not available():
+        print("[yellow]Event store: pyarrow not available, skipping[/yellow]")
+        return None
+    if not os.path.exists(jsonl_events):
+        print("[yellow]Event store: events.jsonl missing, skipping[/yellow]")
+        return None
+
+    final = store_path(outdir)
+    tmp = f"{final}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    writer = _PartitionWriter(tmp, _schema(), cfg.get("compression", "zstd"),
+                              int(cfg.get("batch_rows", DEFAULT_BATCH_ROWS)),
+                              int(cfg.get("max_buffered_rows", DEFAULT_MAX_BUFFERED_ROWS)),
+                              int(cfg.get("max_open_files", DEFAULT_MAX_OPEN_FILES)))
+    rows = 0
+    try:
+        with open(jsonl_events, "rb") as f:
+            offset = 0
+            for lineno, line in enumerate(f, 1):
+                pos, offset = offset, offset + len(line)
+                try:
+                    ev = json.loads(line)
+                except Exception:
+                    continue
+                if not isinstance(ev, dict):
+                    continue
+                ts = event_timestamp(ev)
+                row = {name: _as_text(ev.get(name)) for name in FIELD_COLUMNS}
+                row.update(offset=pos, line=lineno, timestamp=ts, event=line.decode("utf-8", "replace").rstrip("\n"))
+                writer.add(_partition(ts), row)
+                rows += 1
+    finally:
+        writer.close()
+    shutil.rmtree(final, ignore_errors=True)
+    os.makedirs(tmp, exist_ok=True)
+    os.replace(tmp, final)
+    metrics.count("events", rows)
+    print(f"[green]Event store: {rows} events written to {final}[/green]")
+    return final
+
+
+def _as_text(v: Any) -> Optional[str]:
+    if v is None or isinstance(v, str):
+        return v
+    return json.dumps(v, sort_keys=True)
+
+
+def _dataset(store: str):
+    partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    return ds.dataset(store, format="parquet", partitioning=partitioning)
+
+
+def _filter(start: Optional[int], end: Optional[int], where: Optional[Dict[str, Any]],
+            partitioned: bool = True):
+    terms = []
+    if start is not None:
+        terms.append(ds.field("timestamp") >= int(start))
+        if partitioned:
+            # Partition pruning: earlier days are skipped without opening their files.
+            terms.append(ds.field("date") >= _partition(int(start)))
+    if end is not None:
+        terms.append(ds.field("timestamp") < int(end))
+        if partitioned:
+            terms.append(ds.field("date") <= _partition(int(end)))
+    for name, value in (where or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        terms.append(ds.field(name).isin(list(values)))
+    expr = None
+    for t in terms:
+        expr = t if expr is None else expr & t
+    return expr
+
+
+def fragments(store: str) -> List[str]:
+    """Parquet files of the store in partition (time) order; the unit of parallel scans."""
+    return sorted(f.path for f in _dataset(store).get_fragments())
+
+
+def count(store: str, start: Optional[int] = None, end: Optional[int] = None,
+          where: Optional[Dict[str, Any]] = None) -> int:
+    """Number of events, answered from Parquet metadata when there is no filter."""
+    return _dataset(store).count_rows(filter=_filter(start, end, where))
+
+
+def scan(store: str, columns: Optional[List[str]] = None, start: Optional[int] = None,
+         end: Optional[int] = None, where: Optional[Dict[str, Any]] = None,
+         batch_rows: int = DEFAULT_BATCH_ROWS, files: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield rows as dicts, reading only the requested columns.
+
+    start/end are microseconds since 1970 (end exclusive); where maps a
+    column to a value or list of values. files restricts the scan to some
+    of the store's fragments (see fragments()).
+    """
+    if files is None:
+        dataset, expr = _dataset(store), _filter(start, end, where)
+    else:
+        dataset, expr = ds.dataset(files, format="parquet"), _filter(start, end, where, partitioned=False)
+    for batch in dataset.to_batches(columns=columns, filter=expr, batch_size=batch_rows):
+        yield from batch.to_pylist()
+
+
+def projection(fields: List[str], keywords: bool) -> Optional[List[str]]:
+    """
+    Columns that answer every field in `fields`, or None when full events are needed.
+
+    Keyword searches and fields outside the typed columns need the raw event.
+    """
+    if keywords or any(f not in FIELD_COLUMNS and f != "timestamp" for f in fields):
+        return None
+    return list(LOCATION_COLUMNS) + sorted(set(fields))
+
+
+def iter_events(store: str, columns: Optional[List[str]] = None, files: Optional[List[str]] = None,
+                **filters: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Yield (offset, line, event) for each stored event.
+
+    With columns (see projection()) the event is built from those columns
+    alone; otherwise it is parsed from the raw `event` column.
+    """
+    cols = columns or list(LOCATION_COLUMNS) + ["event"]
+    for row in scan(store, cols, files=files, **filters):
+        if columns:
+            ev = {k: v for k, v in row.items() if k not in LOCATION_COLUMNS and v is not None}
+        else:
+            try:
+                ev = json.loads(row["event"])
+            except Exception:
+                continue
+        yield row["offset"], row["line"], ev
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+MANIFEST_NAME = "evidence_manifest.jsonl"
+MERKLE_NAME = "evidence_merkle.json"
+HASH_CACHE_NAME = "hashes.jsonl"
+MERKLE_ALGORITHM = "dfirbox-merkle-sha256-v1"
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+
+def cgroup_dir() -> Optional[str]:
+    """This process's cgroup v2 directory (a batch job's own cgroup), or None."""
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    path = os.path.join("/sys/fs/cgroup", line[3:].strip().lstrip("/"))
+                    return path if os.path.isdir(path) else None
+    except OSError:
+        pass
+    return None
+
+
+def cgroup_limit(name: str) -> Optional[str]:
+    """Tightest value of a cgroup v2 limit file (cpu.max, memory.max) along this process's cgroup path."""
+    values = []
+    d = cgroup_dir()
+    while d and d.startswith("/sys/fs/cgroup"):
+        try:
+            with open(os.path.join(d, name), "r") as f:
+                v = f.read().strip()
+            if v and not v.startswith("max"):
+                values.append(v)
+        except OSError:
+            pass
+        if d == "/sys/fs/cgroup":
+            break
+        d = os.path.dirname(d)
+    if name == "cpu.max":
+        return min(values, key=lambda v: int(v.split()[0]) / int(v.split()[1]), default=None)
+    return min(values, key=int, default=None)
+
+
+def available_cpus() -> int:
+    """Cores this process may use: its affinity mask, capped by its cgroup's cpu.max; sizes worker pools."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_limit("cpu.max")
+    if quota:
+        q, period = quota.split()[:2]
+        cpus = min(cpus, max(1, int(q) // int(period)))
+    return max(1, cpus)
+
+
+def cache_dir(outdir: str, override: Optional[str] = None) -> str:
+    """Directory for caches that should survive across runs (DFIRBOX_CACHE_DIR, else outdir/.cache)."""
+    return override or os.environ.get("DFIRBOX_CACHE_DIR") or os.path.join(outdir, ".cache")
+
+
+class HashCache:
+    """
+    Persistent sha256 cache keyed by (path, size, mtime_ns, inode).
+
+    A file whose stat key is unchanged since it was last hashed is not read
+    again; any change to size, mtime or inode forces a rehash.
+    """
+
+    def __init__(self, directory: Optional[str]):
+        self.path = os.path.join(directory, HASH_CACHE_NAME) if directory else None
+        self._entries: Dict[Tuple[str, int, int, int], str] = {}
+        self._dirty = False
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        d = json.loads(line)
+                        self._entries[(d["path"], d["size"], d["mtime_ns"], d["inode"])] = d["sha256"]
+                    except Exception:
+                        continue
+
+    @staticmethod
+    def key(path: str, st: os.stat_result) -> Tuple[str, int, int, int]:
+        return (path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def get(self, path: str, st: os.stat_result) -> Optional[str]:
+        return self._entries.get(self.key(path, st))
+
+    def put(self, path: str, st: os.stat_result, sha256: str) -> None:
+        k = self.key(path, st)
+        if self._entries.get(k) != sha256:
+            self._entries[k] = sha256
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            for (path, size, mtime_ns, inode), sha in sorted(self._entries.items()):
+                f.write(json.dumps({"path": path, "size": size, "mtime_ns": mtime_ns,
+                                    "inode": inode, "sha256": sha}) + "\n")
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[tuple]:
+    """Walk each root lazily in a stable order, yielding (root, path) for regular files."""
+    for root_path in paths:
+        root_path = os.path.abspath(root_path)
+        if os.path.isfile(root_path):
+            yield root_path, root_path
+            continue
+        for root, dirs, files in os.walk(root_path):
+            dirs.sort()
+            for name in sorted(files):
+                p = os.path.join(root, name)
+                if os.path.isfile(p) and not os.path.islink(p):
+                    yield root_path, p
+
+
+def bounded_map(fn, items: Iterable[Any], workers: int, window: Optional[int] = None) -> Iterator[Any]:
+    """Like Executor.map, but keeps at most `window` tasks in flight and yields in input order."""
+    workers = max(1, int(workers))
+    window = window or workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+@contextmanager
+def open_buffer(path: str, size: int):
+    """Expose a file's contents as one buffer: mmap for large files, a single read otherwise."""
+    with open(path, "rb") as f:
+        if size >= MMAP_THRESHOLD:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mm
+            finally:
+                mm.close()
+        else:
+            yield f.read()
+
+
+# A consumer receives (path, size, buffer) and returns a list of records.
+Consumer = Callable[[str, int, Any], List[Dict[str, Any]]]
+
+
+def read_once(root: str, path: str, consumer: Optional[Consumer] = None,
+              cache: Optional[HashCache] = None):
+    """
+    Read a file once, hash it and hand the same bytes to the consumer.
+
+    Without a consumer, a cache hit skips reading the file altogether.
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        return {"root": root, "path": path, "error": str(e)}, []
+    entry: Dict[str, Any] = {"root": root, "path": path, "size": st.st_size,
+                             "mtime": st.st_mtime, "inode": st.st_ino}
+    records: List[Dict[str, Any]] = []
+    cached = cache.get(path, st) if cache is not None else None
+    if cached and consumer is None:
+        entry["sha256"] = cached
+        return entry, records
+    try:
+        with open_buffer(path, st.st_size) as buf:
+            entry["sha256"] = hashlib.sha256(buf).hexdigest()
+            if consumer is not None:
+                records = consumer(path, st.st_size, buf)
+    except OSError as e:
+        entry["error"] = str(e)
+    if cache is not None and entry.get("sha256"):
+        cache.put(path, st, entry["sha256"])
+    for r in records:
+        r.setdefault("sha256", entry.get("sha256"))
+    return entry, records
+
+
+def walk(paths: Iterable[str], outdir: str, consumer: Optional[Consumer] = None,
+         workers: int = 4, progress=None, cache: Optional[HashCache] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Single pass over the evidence: every file is read once, hashed, passed to
+    the consumer, and recorded in outdir/evidence_manifest.jsonl.
+
+    Yields the consumer's records in walk order.
+    """
+    files = iter_files(paths)
+    if progress is not None:
+        files = progress(files)
+    manifest = os.path.join(outdir, MANIFEST_NAME)
+    with open(manifest, "w") as mf:
+        for entry, records in bounded_map(lambda item: read_once(item[0], item[1], consumer, cache), files, workers):
+            mf.write(json.dumps(entry) + "\n")
+            yield from records
+    if cache is not None:
+        cache.save()
+
+
+def hash_tree(root: str, workers: int = 4, cache: Optional[HashCache] = None) -> List[Dict[str, Any]]:
+    """Hash every file under root on a thread pool (hashlib releases the GIL); returns manifest entries."""
+    entries = [e for e, _ in bounded_map(lambda item: read_once(item[0], item[1], None, cache),
+                                         iter_files([root]), workers)]
+    if cache is not None:
+        cache.save()
+    return entries
+
+
+def merkle(entries: Iterable[Dict[str, Any]], root: str) -> Tuple[str, Dict[str, str], int]:
+    """
+    Fold file digests into a Merkle tree over the directory structure.
+
+    Each directory digest is sha256 over its sorted children's
+    "<kind> <digest> <name>" lines, so any subdirectory can be re-verified by
+    hashing just that subtree. Returns (root digest, {relative dir: digest}, file count).
+    """
+    root = os.path.abspath(root)
+    children: Dict[str, List[Tuple[str, str, str]]] = {"": []}
+    count = 0
+    for e in entries:
+        if not e.get("sha256"):
+            continue
+        rel = os.path.relpath(e["path"], root) if e["path"] != root else os.path.basename(root)
+        parts = rel.split(os.sep)
+        for i in range(len(parts) - 1):
+            parent, name = "/".join(parts[:i]), parts[i]
+            d = "/".join(parts[:i + 1])
+            if d not in children:
+                children[d] = []
+                children.setdefault(parent, []).append(("d", "", name))
+        children.setdefault("/".join(parts[:-1]), []).append(("f", e["sha256"], parts[-1]))
+        count += 1
+
+    digests: Dict[str, str] = {}
+    for d in sorted(children, key=lambda x: (x.count("/") if x else -1), reverse=True):
+        m = hashlib.sha256()
+        for kind, digest, name in sorted(children[d], key=lambda c: c[2]):
+            if kind == "d":
+                digest = digests[f"{d}/{name}" if d else name]
+            m.update(f"{kind} {digest} {name}\n".encode())
+        digests[d] = m.hexdigest()
+    return digests[""], digests, count
+
+
+def load_manifest(outdir: str) -> Iterator[Dict[str, Any]]:
+    path = os.path.join(outdir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except Exception:
+                continue
+
+
+def manifest_entries(outdir: str, root: str) -> Optional[List[Dict[str, Any]]]:
+    """Entries of a manifest written earlier in the run for root, or None if root is not covered."""
+    root = os.path.abspath(root)
+    entries = [e for e in load_manifest(outdir) if e.get("root") == root]
+    return entries or None
@@ -0,0 +1,401 @@
+import datetime
+import os
+import struct
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+# Windows XML Event Log (EVTX) layout: a 4 KiB file header followed by
+# independent 64 KiB chunks. Each chunk carries its own string and template
+# tables, so chunks can be parsed in any order and on any worker.
+FILE_MAGIC = b"ElfFile\x00"
+CHUNK_MAGIC = b"ElfChnk\x00"
+RECORD_MAGIC = b"\x2a\x2a\x00\x00"
+FILE_HEADER_SIZE = 4096
+CHUNK_SIZE = 65536
+CHUNK_HEADER_SIZE = 512
+
+_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+_FIXED = {
+    0x03: "<b", 0x04: "<B", 0x05: "<h", 0x06: "<H", 0x07: "<i", 0x08: "<I",
+    0x09: "<q", 0x0a: "<Q", 0x0b: "<f", 0x0c: "<d",
+}
+_EPOCH = datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def find_files(dirs: List[str]) -> List[Tuple[str, int]]:
+    """(path, size) of every .evtx under dirs, recursively, each real file once."""
+    seen = set()
+    files: List[Tuple[str, int]] = []
+    for d in dirs:
+        for root, subdirs, names in os.walk(d):
+            subdirs.sort()
+            for name in sorted(names):
+                if not name.lower().endswith(".evtx"):
+                    continue
+                real = os.path.realpath(os.path.join(root, name))
+                if real in seen or not os.path.isfile(real):
+                    continue
+                seen.add(real)
+                files.append((real, os.path.getsize(real)))
+    return files
+
+
+def chunk_count(path: str) -> int:
+    """
+    Number of 64 KiB chunk slots in the file (slots without chunk magic are skipped when read).
+
+    The file header is not checked: logs carved from memory often have a
+    zero-filled header page in front of intact chunks.
+    """
+    return max(0, (os.path.getsize(path) - FILE_HEADER_SIZE) // CHUNK_SIZE)
+
+
+def unique_chunks(files: List[Tuple[str, int]]) -> List[Tuple[str, List[int]]]:
+    """
+    (path, chunk indices) per file with every chunk kept once across all files.
+
+    Logs carved from memory often hold copies of chunks from other logs.
+    Copies share their header (record numbers, offsets, checksums); of those
+    the one with the most record headers (fewest zero-filled holes) is kept.
+    """
+    best: Dict[bytes, Tuple[int, int, int]] = {}
+    for n, (path, _size) in enumerate(files):
+        with open(path, "rb") as f:
+            for i in range(chunk_count(path)):
+                f.seek(FILE_HEADER_SIZE + i * CHUNK_SIZE)
+                data = f.read(CHUNK_SIZE)
+                if data[:len(CHUNK_MAGIC)] != CHUNK_MAGIC:
+                    continue
+                key = data[8:128]
+                records = data.count(RECORD_MAGIC)
+                if key not in best or records > best[key][0]:
+                    best[key] = (records, n, i)
+    chunks: List[List[int]] = [[] for _ in files]
+    for _records, n, i in best.values():
+        chunks[n].append(i)
+    return [(path, sorted(idx)) for (path, _size), idx in zip(files, chunks) if idx]
+
+
+def _filetime(v: int) -> Optional[str]:
+    if not v:
+        return None
+    try:
+        return (_EPOCH + datetime.timedelta(microseconds=v // 10)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    except OverflowError:
+        return None
+
+
+def _systemtime(b: bytes) -> Optional[str]:
+    year, month, _dow, day, hour, minute, sec, ms = struct.unpack_from("<8H", b)
+    if not year:
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{sec:02d}.{ms:03d}000Z"
+
+
+def _sid(b: bytes) -> str:
+    rev, count = b[0], b[1]
+    auth = int.from_bytes(b[2:8], "big")
+    subs = struct.unpack_from(f"<{count}I", b, 8)
+    return "S-" + "-".join(str(x) for x in (rev, auth) + subs)
+
+
+class _Chunk:
+    """
+    Binary XML decoder for one chunk.
+
+    Templates and element names are defined once per chunk and referenced
+    by offset afterwards, so both are parsed on first use and cached for
+    the rest of the chunk. Parsed fragments are lists of nodes:
+    ("e", name, attrs, children) elements, ("t", value) text,
+    ("s", index, optional) substitutions and ("i", template, values)
+    template instances.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.names: Dict[int, str] = {}
+        self.templates: Dict[int, list] = {}
+
+    def name(self, off: int) -> str:
+        try:
+            return self.names[off]
+        except KeyError:
+            n = struct.unpack_from("<H", self.data, off + 6)[0]
+            s = self.names[off] = self.data[off + 8:off + 8 + 2 * n].decode("utf-16-le", "replace")
+            return s
+
+    def _name_at(self, pos: int) -> Tuple[str, int]:
+        """Name referenced at pos; returns (name, position after the reference and any inline definition)."""
+        off = struct.unpack_from("<I", self.data, pos)[0]
+        pos += 4
+        if off == pos:
+            pos += 10 + 2 * struct.unpack_from("<H", self.data, pos + 6)[0]
+        return self.name(off), pos
+
+    def template(self, off: int) -> list:
+        tmpl = self.templates.get(off)
+        if tmpl is None:
+            # next template offset (4), GUID (16), data size (4), body
+            tmpl = self.templates[off] = self.fragment(off + 24)[0]
+        return tmpl
+
+    def fragment(self, pos: int) -> Tuple[list, int]:
+        """Parse a Binary XML fragment up to its end-of-stream token; returns (nodes, end position)."""
+        d = self.data
+        end = len(d)
+        nodes: list = []
+        stack = [nodes]
+        elem = None
+        attr = None
+        while pos < end:
+            tok = d[pos]
+            base = tok & 0x0f
+            if tok == 0x00:
+                pos += 1
+                break
+            if base == 0x0f:  # fragment header: token, major, minor, flags
+                pos += 4
+            elif base == 0x01:  # open start element: dependency id, data size, name
+                name, pos = self._name_at(pos + 7)
+                if tok & 0x40:
+                    pos += 4  # attribute list size
+                elem = ("e", name, [], [])
+                stack[-1].append(elem)
+                attr = None
+            elif base == 0x06:  # attribute
+                name, pos = self._name_at(pos + 1)
+                attr = []
+                elem[2].append((name, attr))
+            elif base == 0x02:  # close start element
+                stack.append(elem[3])
+                elem = attr = None
+                pos += 1
+            elif base == 0x03:  # close empty element
+                elem = attr = None
+                pos += 1
+            elif base == 0x04:  # end element
+                if len(stack) > 1:
+                    stack.pop()
+                pos += 1
+            elif base in (0x05, 0x07):  # value text (string type) / CDATA
+                off = pos + 2 if base == 0x05 else pos + 1
+                n = struct.unpack_from("<H", d, off)[0]
+                text = d[off + 2:off + 2 + 2 * n].decode("utf-16-le", "replace")
+                (stack[-1] if attr is None else attr).append(("t", text))
+                pos = off + 2 + 2 * n
+            elif base == 0x08:  # character reference
+                (stack[-1] if attr is None else attr).append(("t", chr(struct.unpack_from("<H", d, pos + 1)[0])))
+                pos += 3
+            elif base == 0x09:  # entity reference
+                name, pos = self._name_at(pos + 1)
+                (stack[-1] if attr is None else attr).append(("t", _ENTITIES.get(name, f"&{name};")))
+            elif base == 0x0a:  # processing instruction target
+                _name, pos = self._name_at(pos + 1)
+            elif base == 0x0b:  # processing instruction data
+                pos += 3 + 2 * struct.unpack_from("<H", d, pos + 1)[0]
+            elif tok == 0x0c:  # template instance
+                def_off = struct.unpack_from("<I", d, pos + 6)[0]
+                pos += 10
+                tmpl = self.template(def_off)
+                if def_off == pos:  # definition inline: skip over it
+                    pos += 24 + struct.unpack_from("<I", d, pos + 20)[0]
+                count = struct.unpack_from("<I", d, pos)[0]
+                pos += 4
+                descs = [struct.unpack_from("<HB", d, pos + 4 * i) for i in range(count)]
+                pos += 4 * count
+                values = []
+                for size, typ in descs:
+                    values.append(self.value(typ, pos, size))
+                    pos += size
+                stack[-1].append(("i", tmpl, values))
+            elif tok in (0x0d, 0x0e):  # normal / optional substitution
+                idx = struct.unpack_from("<H", d, pos + 1)[0]
+                (stack[-1] if attr is None else attr).append(("s", idx, tok == 0x0e))
+                pos += 4
+            else:
+                raise ValueError(f"unknown binary XML token 0x{tok:02x} at chunk offset {pos}")
+        return nodes, pos
+
+    def value(self, typ: int, pos: int, size: int) -> Any:
+        b = self.data[pos:pos + size]
+        if typ == 0x00 or not size and typ != 0x01:
+            return None
+        if typ == 0x01:
+            return b.decode("utf-16-le", "replace").rstrip("\x00")
+        if typ == 0x02:
+            return b.decode("latin-1").rstrip("\x00")
+        if typ in _FIXED:
+            return struct.unpack_from(_FIXED[typ], b)[0]
+        if typ == 0x0d:
+            return int.from_bytes(b[:4], "little") != 0
+        if typ == 0x0e:
+            return b.hex().upper()
+        if typ == 0x0f:
+            return "{" + str(uuid.UUID(bytes_le=b[:16])).upper() + "}"
+        if typ in (0x10, 0x14, 0x15):  # size_t, hex32, hex64
+            return f"0x{int.from_bytes(b, 'little'):0{2 * size}x}"
+        if typ == 0x11:
+            return _filetime(struct.unpack_from("<Q", b)[0])
+        if typ == 0x12:
+            return _systemtime(b)
+        if typ == 0x13:
+            return _sid(b)
+        if typ == 0x21:  # embedded Binary XML (EventData/UserData of some providers)
+            return ("x", self.fragment(pos)[0])
+        if typ == 0x81:
+            return [s for s in b.decode("utf-16-le", "replace").split("\x00") if s]
+        if typ & 0x80 and (typ & 0x7f) in _FIXED:
+            fmt = _FIXED[typ & 0x7f]
+            step = struct.calcsize(fmt)
+            return [struct.unpack_from(fmt, b, i)[0] for i in range(0, size - size % step, step)]
+        return b.hex().upper()
+
+
+def _render(nodes: list, values: list) -> list:
+    """Resolve substitutions: returns elements as {"name", "attrs", "children"} dicts and scalar text."""
+    out: list = []
+    for node in nodes:
+        kind = node[0]
+        if kind == "e":
+            attrs: Dict[str, Any] = {}
+            for name, content in node[2]:
+                v = _join(_render(content, values))
+                if v is not None and v != "":
+                    attrs[name] = v
+            out.append({"name": node[1], "attrs": attrs, "children": _render(node[3], values)})
+        elif kind == "t":
+            out.append(node[1])
+        elif kind == "s":
+            v = values[node[1]] if node[1] < len(values) else None
+            if isinstance(v, tuple):
+                out.extend(_render(v[1], []))
+            elif v is not None:
+                out.append(v)
+        else:
+            out.extend(_render(node[1], node[2]))
+    return out
+
+
+def _join(items: list) -> Any:
+    scalars = [x for x in items if not isinstance(x, dict)]
+    if not scalars:
+        return None
+    if len(scalars) == 1:
+        return scalars[0]
+    return "".join(str(x) for x in scalars)
+
+
+def _value(el: Dict[str, Any]) -> Any:
+    """Element -> text, a dict of child elements, or its attributes when it has neither."""
+    children = [c for c in el["children"] if isinstance(c, dict)]
+    if children:
+        return _fields(children)
+    text = _join(el["children"])
+    if text is not None:
+        return text
+    return dict(el["attrs"]) or None
+
+
+def _fields(children: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Child elements as a dict; <Data Name="X">v</Data> becomes X: v, unnamed Data a list."""
+    out: Dict[str, Any] = {}
+    for c in children:
+        name = c["name"]
+        if name == "Data" and "Name" in c["attrs"]:
+            name = str(c["attrs"]["Name"])
+            v = _join(c["children"])
+        else:
+            v = _value(c)
+        if name in out:
+            prev = out[name]
+            out[name] = (prev if isinstance(prev, list) and name == "Data" else [prev]) + [v]
+        else:
+            out[name] = [v] if name == "Data" else v
+    return out
+
+
+def _normalize(items: list) -> Dict[str, Any]:
+    root = next((x for x in items if isinstance(x, dict)), None)
+    if root is None:
+        return {}
+    rec: Dict[str, Any] = {}
+    for section in root["children"]:
+        if not isinstance(section, dict):
+            continue
+        if section["name"] == "System":
+            system: Dict[str, Any] = {}
+            for c in section["children"]:
+                if isinstance(c, dict):
+                    system[c["name"]] = _value(c)
+            rec["System"] = system
+        else:
+            v = _value(section)
+            rec[section["name"]] = v if v is not None else {}
+    rec.setdefault("EventData", {})
+    return rec
+
+
+def _record_at(data: bytes, pos: int, limit: int) -> int:
+    """Size of the record at pos, or 0 when there is no intact record header (magic + matching size copy)."""
+    if data[pos:pos + 4] != RECORD_MAGIC:
+        return 0
+    size = struct.unpack_from("<I", data, pos + 4)[0]
+    if size < 28 or pos + size > limit or struct.unpack_from("<I", data, pos + size - 4)[0] != size:
+        return 0
+    return size
+
+
+def iter_chunk(data: bytes) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    (record id, {System, EventData}) for each record of one chunk.
+
+    Logs carved from memory have zero-filled holes where pages were not
+    resident; after a hole or an unparsable record the scan resumes at the
+    next intact record header (records whose template sat in the hole are
+    dropped).
+    """
+    if data[:len(CHUNK_MAGIC)] != CHUNK_MAGIC:
+        return
+    free = min(struct.unpack_from("<I", data, 48)[0] or len(data), len(data))
+    chunk = _Chunk(data)
+    pos = CHUNK_HEADER_SIZE
+    while pos + 28 <= free:
+        size = _record_at(data, pos, free)
+        if not size:
+            pos = data.find(RECORD_MAGIC, pos + 8, free)
+            if pos < 0:
+                break
+            continue
+        record_id = struct.unpack_from("<Q", data, pos + 8)[0]
+        try:
+            nodes, _end = chunk.fragment(pos + 24)
+            rec = _normalize(_render(nodes, []))
+        except (ValueError, IndexError, KeyError, TypeError, RecursionError, struct.error):
+            rec = None
+        if rec:
+            yield record_id, rec
+        pos += size
+
+
+def iter_records(path: str, first_chunk: int = 0, end_chunk: Optional[int] = None,
+                 chunks: Optional[List[int]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Normalized records of chunks [first_chunk, end_chunk) of an EVTX file, or of the given chunk indices.
+
+    Each record is {"System": {...}, "EventData": {...}} (plus UserData and
+    the like when present): System children map to their text, or to their
+    attributes for Provider/TimeCreated/Execution/...; EventData Data
+    elements map Name -> value. The source file is kept in evtx_file.
+    """
+    if chunks is None:
+        chunks = range(first_chunk, chunk_count(path) if end_chunk is None else end_chunk)
+    with open(path, "rb") as f:
+        for i in chunks:
+            f.seek(FILE_HEADER_SIZE + i * CHUNK_SIZE)
+            data = f.read(CHUNK_SIZE)
+            if len(data) < CHUNK_HEADER_SIZE:
+                break
+            for _record_id, rec in iter_chunk(data):
+                rec["evtx_file"] = path
+                yield rec
@@ -1,12 +1,17 @@
+import heapq
 import json
 import os
 import shlex
-import subprocess
-from typing import Dict, Optional
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import yaml
 from rich import print
 
+from src.pipeline import evidence, evtx, metrics
+
 
 def _run(cmd_list, *, cwd: Optional[str] = None) -> str:
     """Run a command list with logging, return combined stdout/stderr text."""
@@ -16,18 +21,11 @@ def _run(cmd_list, *, cwd: Optional[str] = None) -> str:
     else:
         print(f"[cyan]Hayabusa: running {cmd_str}[/cyan]")
 
-    proc = subprocess.run(
-        cmd_list,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        check=False,
-        cwd=cwd,
-    )
-    output = proc.stdout or ""
+    returncode, output = metrics.run_process(cmd_list, cwd=cwd)
+    output = output or ""
 
-    if proc.returncode != 0:
-        print(f"[yellow]Hayabusa: command exited with code {proc.returncode}[/yellow]")
+    if returncode != 0:
+        print(f"[yellow]Hayabusa: command exited with code {returncode}[/yellow]")
 
     if output.strip():
         # Show only the first few lines so we don't spam the console
@@ -39,13 +37,111 @@ def _run(cmd_list, *, cwd: Optional[str] = None) -> str:
     return output
 
 
+def _balance(files: List[Tuple[str, int]], shards: int) -> List[List[Tuple[str, int]]]:
+    """Largest-first greedy split into at most `shards` groups of similar total size."""
+    bins: List[List[Tuple[str, int]]] = [[] for _ in range(max(1, min(shards, len(files))))]
+    loads = [0] * len(bins)
+    for path, size in sorted(files, key=lambda f: (-f[1], f[0])):
+        i = loads.index(min(loads))
+        bins[i].append((path, size))
+        loads[i] += size
+    return [b for b in bins if b]
+
+
+def _link_shard(shard_dir: str, files: List[Tuple[str, int]]) -> None:
+    """Populate a directory with symlinks to one shard's EVTX files (hayabusa takes one -d per run)."""
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    for i, (path, _size) in enumerate(files):
+        os.symlink(path, os.path.join(shard_dir, f"{i:05d}-{os.path.basename(path)}"))
+
+
+# Hayabusa abbreviates levels in its timelines; most severe first.
+LEVEL_ORDER = ("emergency", "crit", "critical", "high", "med", "medium", "low", "info", "informational")
+DEFAULT_SUMMARY_TOP = 50
+
+
+class _Summary:
+    """Per-level/rule/computer/hour hit counts, accumulated one record at a time."""
+
+    def __init__(self):
+        self.total = 0
+        self.levels: Dict[str, int] = {}
+        self.rules: Dict[str, int] = {}
+        self.computers: Dict[str, int] = {}
+        self.hours: Dict[str, int] = {}
+
+    @staticmethod
+    def _bump(counts: Dict[str, int], key: str) -> None:
+        counts[key] = counts.get(key, 0) + 1
+
+    def add(self, rec: Dict) -> None:
+        self.total += 1
+        self._bump(self.levels, str(rec.get("Level") or rec.get("level") or "unknown").lower())
+        self._bump(self.rules, str(rec.get("RuleTitle") or "unknown"))
+        self._bump(self.computers, str(rec.get("Computer") or "unknown"))
+        # "YYYY-MM-DD HH:MM:SS.fff +00:00" -> "YYYY-MM-DD HH"
+        ts = str(rec.get("Timestamp") or "")
+        self._bump(self.hours, ts[:13] if len(ts) >= 13 else "unknown")
+
+    def to_dict(self, top: int) -> Dict:
+        def ranked(counts: Dict[str, int]) -> List[Dict]:
+            items = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+            return [{"name": k, "count": v} for k, v in items[:top]]
+
+        rank = {lvl: i for i, lvl in enumerate(LEVEL_ORDER)}
+        return {
+            "total_events": self.total,
+            "hits_by_level": {k: self.levels[k] for k in sorted(self.levels, key=lambda k: (rank.get(k, len(rank)), k))},
+            "top_rules": ranked(self.rules),
+            "top_computers": ranked(self.computers),
+            "distinct_rules": len(self.rules),
+            "distinct_computers": len(self.computers),
+            "hits_by_hour": {k: self.hours[k] for k in sorted(self.hours)},
+        }
+
+
+def _merge_timelines(paths: List[str], out_path: str, summary: Optional[_Summary] = None) -> int:
+    """
+    k-way merge of per-shard hayabusa JSONL timelines (each already in time
+    order) into one time-ordered file; ties keep shard order. Streams line by
+    line, so memory is one pending line per shard. Each record is parsed
+    once, for its merge key and for `summary`.
+    """
+    def lines(idx: int, path: str):
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except Exception:
+                        rec = None
+                    if not isinstance(rec, dict):
+                        rec = {}
+                    if summary is not None:
+                        summary.add(rec)
+                    yield str(rec.get("Timestamp") or ""), idx, line if line.endswith("\n") else line + "\n"
+        except FileNotFoundError:
+            return
+
+    n = 0
+    with open(out_path, "w") as out:
+        for _key, _idx, line in heapq.merge(*(lines(i, p) for i, p in enumerate(paths))):
+            out.write(line)
+            n += 1
+    return n
+
+
 def run_hayabusa(evidence_dir: str, profile_path: str, outdir: str) -> Optional[Dict[str, str]]:
     """
     Run Hayabusa json-timeline.
 
     Prefers EVTX extracted from MemProcFS (memprocfs_eventlogs) if present,
-    otherwise falls back to the EVTX directories configured in the profile
-    or the evidence directory.
+    otherwise uses every EVTX directory configured in the profile (or the
+    evidence directory). The files are split into size-balanced shards run
+    concurrently, and the per-shard timelines are merged in time order.
     """
     with open(profile_path, "r") as f:
         profile = yaml.safe_load(f) or {}
@@ -59,47 +155,57 @@ def run_hayabusa(evidence_dir: str, profile_path: str, outdir: str) -> Optional[
     # Prefer MemProcFS-extracted EVTX if MemProcFS ran.
     mem_cfg = (profile.get("memory") or {}).get("memprocfs") or {}
     mem_evtx_dir = mem_cfg.get("eventlog_dir") or os.path.join(outdir, "memprocfs_eventlogs")
-
-    target_dir: Optional[str] = None
-
-    if os.path.isdir(mem_evtx_dir):
-        evtx_files = [
-            name
-            for name in os.listdir(mem_evtx_dir)
-            if name.lower().endswith(".evtx")
-        ]
-        if evtx_files:
-            print(f"[cyan]Hayabusa: using MemProcFS-extracted EVTX at {mem_evtx_dir}[/cyan]")
-            target_dir = mem_evtx_dir
-
-    # Fallback to configured EVTX dirs or evidence dir.
-    if target_dir is None:
-        evtx_dirs = cfg.get("evtx_dirs") or [evidence_dir]
-        existing_dirs = [d for d in evtx_dirs if os.path.isdir(d)]
-        if not existing_dirs:
-            print("[yellow]Hayabusa: no EVTX directories found, skipping[/yellow]")
-            return None
-        target_dir = existing_dirs[0]
-        print(f"[cyan]Hayabusa: using EVTX directory {target_dir}[/cyan]")
+    source_dirs = [mem_evtx_dir] if os.path.isdir(mem_evtx_dir) else []
+    files = evtx.find_files(source_dirs)
+    if files:
+        print(f"[cyan]Hayabusa: using MemProcFS-extracted EVTX at {mem_evtx_dir}[/cyan]")
+    else:
+        # Fallback to all configured EVTX dirs or the evidence dir.
+        source_dirs = [d for d in (cfg.get("evtx_dirs") or [evidence_dir]) if os.path.isdir(d)]
+        files = evtx.find_files(source_dirs)
+    if not files:
+        print("[yellow]Hayabusa: no EVTX files found, skipping[/yellow]")
+        return None
+    print(f"[cyan]Hayabusa: {len(files)} EVTX files from {', '.join(source_dirs)}[/cyan]")
 
     hayabusa_outdir = os.path.join(outdir, "hayabusa_out")
     os.makedirs(hayabusa_outdir, exist_ok=True)
     timeline_path = os.path.join(hayabusa_outdir, "hayabusa_timeline.jsonl")
 
-    cmd = ["hayabusa", "json-timeline", "-w", "-L", "-o", timeline_path, "-d", target_dir]
-    min_level = cfg.get("min_level")
-    if min_level:
-        cmd += ["--min-level", str(min_level)]
-    for extra in (cfg.get("extra_args") or []):
-        cmd.append(str(extra))
+    # Shards balanced by bytes so one large log (Security.evtx on a DC) gets
+    # its own run; the thread budget is split across concurrent runs.
+    thread_budget = int(cfg.get("threads") or evidence.available_cpus())
+    shards = _balance(files, int(cfg.get("shards") or max(1, min(thread_budget, 4))))
+    per_shard_threads = max(1, thread_budget // len(shards))
 
     # IMPORTANT FIX:
     # Run Hayabusa from its own directory so it can find its rules/config
     # (encoded_rules.yml / rules_config_files.txt or rules/config/*).
     hayabusa_home = os.environ.get("HAYABUSA_HOME", "/opt/hayabusa")
 
-    try:
+    def run_shard(item):
+        i, shard = item
+        shard_dir = os.path.join(hayabusa_outdir, "shards", f"shard-{i:03d}")
+        shard_out = os.path.join(hayabusa_outdir, "shards", f"shard-{i:03d}.jsonl")
+        _link_shard(shard_dir, shard)
+        cmd = ["hayabusa", "json-timeline", "-w", "-L", "-o", shard_out, "-d", shard_dir]
+        if len(shards) > 1 or cfg.get("threads"):
+            cmd += ["-t", str(per_shard_threads)]
+        min_level = cfg.get("min_level")
+        if min_level:
+            cmd += ["--min-level", str(min_level)]
+        for extra in (cfg.get("extra_args") or []):
+            cmd.append(str(extra))
+        if os.path.exists(shard_out):
+            os.remove(shard_out)
+        t0 = time.perf_counter()
         _run(cmd, cwd=hayabusa_home)
+        return {"shard": i, "files": len(shard), "bytes": sum(sz for _p, sz in shard),
+                "wall_s": round(time.perf_counter() - t0, 3), "output": shard_out}
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            shard_stats = list(pool.map(metrics.wrap(run_shard), enumerate(shards)))
     except FileNotFoundError:
         print("[yellow]Hayabusa: 'hayabusa' binary not found in PATH, skipping[/yellow]")
         return None
@@ -107,36 +213,24 @@ def run_hayabusa(evidence_dir: str, profile_path: str, outdir: str) -> Optional[
         print(f"[yellow]Hayabusa: failed to run, skipping. Error: {e}[/yellow]")
         return None
 
-    # Summarize the JSONL timeline.
-    total_events = 0
-    levels: Dict[str, int] = {}
+    # Counting happens during the merge: the timeline is never read back.
+    summary = _Summary()
     try:
-        with open(timeline_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                total_events += 1
-                try:
-                    ev = json.loads(line)
-                except Exception:
-                    continue
-                level = ev.get("level") or ev.get("lvl") or "unknown"
-                levels[level] = levels.get(level, 0) + 1
-    except FileNotFoundError:
-        print(f"[yellow]Hayabusa: timeline file not found at {timeline_path}[/yellow]")
+        _merge_timelines([s["output"] for s in shard_stats], timeline_path, summary)
     except Exception as e:
-        print(f"[yellow]Hayabusa: failed summarizing JSONL: {e}[/yellow]")
+        print(f"[yellow]Hayabusa: failed merging shard timelines: {e}[/yellow]")
+    shutil.rmtree(os.path.join(hayabusa_outdir, "shards"), ignore_errors=True)
+    for st in shard_stats:
+        del st["output"]
+
+    metrics.count("events", summary.total)
 
     summary_path = os.path.join(hayabusa_outdir, "hayabusa_summary.json")
     try:
         with open(summary_path, "w") as f:
             json.dump(
-                {
-                    "total_events": total_events,
-                    "hits_by_level": levels,
-                    "source_dir": target_dir,
-                },
+                dict(summary.to_dict(int(cfg.get("summary_top") or DEFAULT_SUMMARY_TOP)),
+                     source_dirs=source_dirs, shards=shard_stats),
                 f,
                 indent=2,
             )
@@ -144,4 +238,4 @@ def run_hayabusa(evidence_dir: str, profile_path: str, outdir: str) -> Optional[
         print(f"[yellow]Hayabusa: failed writing summary JSON: {e}[/yellow]")
 
     print(f"[green]Hayabusa: wrote[/green] {timeline_path} and {summary_path}")
-    return {"timeline": timeline_path, "summary": summary_path, "source_dir": target_dir}
+    return {"timeline": timeline_path, "summary": summary_path, "source_dirs": source_dirs, "shards": shard_stats}
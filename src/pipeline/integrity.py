@@ -0,0 +1,133 @@
+import os, sys, json, time, shlex, hashlib, subprocess
+from src.pipeline import evidence, toolversions
+
+# Written once at image build (see Dockerfile): sha256 of every tool binary,
+# rule pack and pipeline file, plus the digest of the prebuilt SBOM. Each
+# run re-hashes those files against it instead of scanning the filesystem.
+MANIFEST_ENV = "DFIRBOX_BUILD_MANIFEST"
+DEFAULT_MANIFEST = "/app/build_manifest.json"
+DEFAULT_ROOTS = ("/app/src", "/app/rules", "/app/profiles")
+SCHEMA = "dfirbox-build-manifest-0.1"
+# Tools identified by executable name, on top of toolversions.TOOLS.
+EXTRA_TOOLS = ("hayabusa",)
+SBOM_EXCLUDES = ("/evidence", "/out", "/proc", "/sys", "/dev")
+
+
+def manifest_path():
+    return os.environ.get(MANIFEST_ENV, DEFAULT_MANIFEST)
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _tool_paths():
+    paths = []
+    for exe in [t[0] for t in toolversions.TOOLS.values()] + list(EXTRA_TOOLS):
+        fp = toolversions.fingerprint(exe)
+        if fp:
+            paths.append(fp.split(":", 1)[0])
+    paths.append(os.path.realpath(sys.executable))
+    return paths
+
+
+def _targets(roots):
+    """(root, path) of the tool binaries, the tool-version manifest and every file under roots."""
+    targets = [(p, p) for p in _tool_paths()]
+    if os.path.exists(toolversions.manifest_path()):
+        targets.append((toolversions.manifest_path(), toolversions.manifest_path()))
+    targets.extend(evidence.iter_files([r for r in roots if os.path.exists(r)]))
+    seen, out = set(), []
+    for root, path in targets:
+        if path not in seen:
+            seen.add(path)
+            out.append((root, path))
+    return out
+
+
+def _hash_all(targets, workers):
+    # read_once hashes large files through mmap; no hash cache here, since a
+    # cache keyed on size/mtime would trust exactly what is being checked.
+    return list(evidence.bounded_map(lambda t: evidence.read_once(t[0], t[1])[0], targets, workers))
+
+
+def write_sbom(path):
+    """SBOM of the image filesystem with syft, if it is installed; returns the path or None."""
+    if not toolversions.fingerprint("syft"):
+        return None
+    cmd = "syft dir:/ -o json " + " ".join(f"--exclude {d}" for d in SBOM_EXCLUDES)
+    with open(path, "w") as f:
+        rc = subprocess.run(shlex.split(cmd), stdout=f, stderr=subprocess.DEVNULL).returncode
+    if rc != 0:
+        os.remove(path)
+        return None
+    return path
+
+
+def write(path=None, roots=DEFAULT_ROOTS, sbom=None, workers=None):
+    """Record digests of the toolchain, rule packs and pipeline code, and of the SBOM if given."""
+    path = path or manifest_path()
+    files = {e["path"]: e.get("sha256") for e in _hash_all(_targets(roots), workers or evidence.available_cpus())}
+    manifest = {
+        "schema": SCHEMA,
+        "generated": int(time.time()),
+        "roots": list(roots),
+        "sbom": {"path": sbom, "sha256": _sha256(sbom), "format": "syft-json"} if sbom and os.path.exists(sbom) else None,
+        "files": files,
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+    return path
+
+
+def verify(path=None, workers=None, roots=()):
+    """
+    Re-hash the files in the build manifest; status is verified, mismatch or unavailable.
+
+    Files added since the build are not flagged. Files under roots are hashed
+    in the same pass and returned as manifest entries under "entries".
+    """
+    path = path or manifest_path()
+    t0 = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        manifest = json.loads(raw)
+    except Exception as e:
+        return {"status": "unavailable", "manifest": path, "error": str(e)}
+    recorded = manifest.get("files") or {}
+    sbom = manifest.get("sbom")
+    targets = [(p, p) for p in recorded]
+    if sbom and sbom.get("path"):
+        targets.append((sbom["path"], sbom["path"]))
+        recorded = dict(recorded, **{sbom["path"]: sbom.get("sha256")})
+    extra = [t for t in evidence.iter_files([r for r in roots if os.path.exists(r)]) if t[1] not in recorded]
+    under = tuple(os.path.join(os.path.abspath(r), "") for r in roots)
+    changed, missing, entries = [], [], []
+    for e in _hash_all(targets + extra, workers or evidence.available_cpus()):
+        if e["path"].startswith(under):
+            entries.append(e)
+        if e["path"] not in recorded:
+            continue
+        if e.get("error") or not e.get("sha256"):
+            missing.append(e["path"])
+        elif e["sha256"] != recorded.get(e["path"]):
+            changed.append(e["path"])
+    return {
+        "status": "mismatch" if changed or missing else "verified",
+        "manifest": path,
+        "manifest_sha256": hashlib.sha256(raw).hexdigest(),
+        "generated": manifest.get("generated"),
+        "sbom": sbom,
+        "files": len(targets),
+        "changed": sorted(changed),
+        "missing": sorted(missing),
+        "wall_s": round(time.perf_counter() - t0, 3),
+        **({"entries": entries} if roots else {}),
+    }
@@ -1,17 +1,26 @@
 import os
 import json
 import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
 
 import yaml
 from rich import print
 
+from src.pipeline import evidence, metrics, yarascan
+
 try:
     import memprocfs  # type: ignore
 except Exception:
     memprocfs = None  # type: ignore
 
+# Memory YARA reads regions in windows of this size (overlapping by the rule
+# set's string reach) instead of whole regions of up to max_region_bytes.
+DEFAULT_YARA_WINDOW = 16 * 1024 * 1024
+
 
 def _safe_getattr(obj: Any, name: str, default: Any = None) -> Any:
     try:
@@ -116,15 +125,33 @@ def _write_json(path: Path, obj: Any) -> None:
         json.dump(obj, f, indent=2)
 
 
-def _write_jsonl(path: Path, items) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        for item in items:
-            f.write(json.dumps(item) + "\n")
+_PROCESS_SECTIONS = {
+    "modules": "memprocfs_modules.jsonl",
+    "handles": "memprocfs_handles.jsonl",
+    "threads": "memprocfs_threads.jsonl",
+    "unloaded_modules": "memprocfs_unloaded_modules.jsonl",
+}
+
+
+def _section_records(pid: Any, items: Any):
+    """One JSONL record per module/handle/thread, tagged with its owning pid."""
+    for item in items or []:
+        if isinstance(item, dict):
+            yield dict(item, pid=pid)
+        else:
+            yield {"pid": pid, "value": item}
 
 
 def _collect_process_data(vmm: Any, outdir: Path, cfg: Dict[str, Any]) -> Dict[str, str]:
-    """Collect detailed per-process data (modules, handles, threads, etc.)."""
+    """
+    Collect detailed per-process data (modules, handles, threads, etc.).
+
+    Processes are serialized on a thread pool (MemProcFS handles concurrent
+    reads) and written one at a time in process-list order, so memory holds
+    only the processes in flight. Modules, handles, threads and unloaded
+    modules go to their own JSONL files with a pid on every record;
+    memprocfs_processes.jsonl keeps the process fields plus section counts.
+    """
     include_modules = cfg.get("include_modules", True)
     include_handles = cfg.get("include_handles", True)
     include_threads = cfg.get("include_threads", True)
@@ -132,19 +159,19 @@ def _collect_process_data(vmm: Any, outdir: Path, cfg: Dict[str, Any]) -> Dict[s
 
     max_handles = int(cfg.get("max_handles_per_process", 2000))
     max_threads = int(cfg.get("max_threads_per_process", 2000))
+    workers = int(cfg.get("workers", 4))
 
     proc_jsonl = outdir / "memprocfs_processes.jsonl"
     summary_json = outdir / "memprocfs_summary.json"
 
-    processes_serialized = []
     try:
         processes = vmm.process_list()
     except Exception as e:
         print(f"[red]MemProcFS: failed to enumerate process list: {e}[/red]")
         return {}
 
-    for p in processes:
-        proc_info = _serialize_process(
+    def serialize(p):
+        return _serialize_process(
             p,
             include_modules=include_modules,
             include_handles=include_handles,
@@ -153,99 +180,230 @@ def _collect_process_data(vmm: Any, outdir: Path, cfg: Dict[str, Any]) -> Dict[s
             max_handles=max_handles,
             max_threads=max_threads,
         )
-        processes_serialized.append(proc_info)
 
-    _write_jsonl(proc_jsonl, processes_serialized)
+    outdir.mkdir(parents=True, exist_ok=True)
+    section_files = {k: (outdir / name).open("w", encoding="utf-8") for k, name in _PROCESS_SECTIONS.items()}
+    written_sections = set()
+    pids = []
+    count = 0
+    try:
+        with proc_jsonl.open("w", encoding="utf-8") as pf:
+            for proc_info in evidence.bounded_map(metrics.wrap(serialize), processes, workers):
+                pid = proc_info.get("pid")
+                for key, fh in section_files.items():
+                    if key not in proc_info:
+                        continue
+                    items = proc_info.pop(key)
+                    proc_info[f"{key}_count"] = len(items) if isinstance(items, list) else None
+                    for rec in _section_records(pid, items):
+                        fh.write(json.dumps(rec) + "\n")
+                    written_sections.add(key)
+                pf.write(json.dumps(proc_info) + "\n")
+                if pid is not None:
+                    pids.append(pid)
+                count += 1
+    finally:
+        for fh in section_files.values():
+            fh.close()
+    for key, name in _PROCESS_SECTIONS.items():
+        if key not in written_sections:
+            (outdir / name).unlink(missing_ok=True)
+    metrics.count("processes", count)
 
     summary = {
-        "process_count": len(processes_serialized),
-        "pids": sorted(
-            [p.get("pid") for p in processes_serialized if p.get("pid") is not None]
-        ),
+        "process_count": count,
+        "pids": sorted(pids),
         "created_at_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
     }
     _write_json(summary_json, summary)
 
-    return {
+    paths = {
         "processes_jsonl": str(proc_jsonl),
         "processes_summary": str(summary_json),
     }
+    for key in sorted(written_sections):
+        paths[f"{key}_jsonl"] = str(outdir / _PROCESS_SECTIONS[key])
+    return paths
+
+
+# profile maps key -> (vmm.maps method, output file, collected by default)
+_GLOBAL_MAPS = {
+    "net": ("net", "memprocfs_net.json", True),
+    "kdriver": ("kdriver", "memprocfs_kdriver.json", True),
+    "kdevice": ("kdevice", "memprocfs_kdevice.json", False),
+    "kobject": ("kobject", "memprocfs_kobject.json", False),
+    "services": ("service", "memprocfs_services.json", True),
+    "users": ("user", "memprocfs_users.json", True),
+}
+
+
+def _collect_map(vmm: Any, outdir: Path, key: str) -> Optional[str]:
+    method, filename, _default = _GLOBAL_MAPS[key]
+    try:
+        info = getattr(vmm.maps, method)()
+        path = outdir / filename
+        _write_json(path, info)
+        return str(path)
+    except Exception as e:
+        print(f"[yellow]MemProcFS: failed to collect {method}() info: {e}[/yellow]")
+        return None
 
 
 def _collect_global_maps(vmm: Any, outdir: Path, cfg: Dict[str, Any]) -> Dict[str, str]:
     """Collect system-wide maps (net, drivers, services, users, etc.)."""
     maps_cfg = cfg.get("maps", {})
-    collect_net = maps_cfg.get("net", True)
-    collect_kdriver = maps_cfg.get("kdriver", True)
-    collect_kdevice = maps_cfg.get("kdevice", False)
-    collect_kobject = maps_cfg.get("kobject", False)
-    collect_services = maps_cfg.get("services", True)
-    collect_users = maps_cfg.get("users", True)
-
     paths: Dict[str, str] = {}
+    for key, (_method, _filename, default) in _GLOBAL_MAPS.items():
+        if maps_cfg.get(key, default):
+            path = _collect_map(vmm, outdir, key)
+            if path:
+                paths[key] = path
+    return paths
 
-    if collect_net:
-        try:
-            net_info = vmm.maps.net()
-            path = outdir / "memprocfs_net.json"
-            _write_json(path, net_info)
-            paths["net"] = str(path)
-        except Exception as e:
-            print(f"[yellow]MemProcFS: failed to collect net() info: {e}[/yellow]")
-
-    if collect_kdriver:
-        try:
-            kdriver_info = vmm.maps.kdriver()
-            path = outdir / "memprocfs_kdriver.json"
-            _write_json(path, kdriver_info)
-            paths["kdriver"] = str(path)
-        except Exception as e:
-            print(f"[yellow]MemProcFS: failed to collect kdriver() info: {e}[/yellow]")
 
-    if collect_kdevice:
-        try:
-            kdevice_info = vmm.maps.kdevice()
-            path = outdir / "memprocfs_kdevice.json"
-            _write_json(path, kdevice_info)
-            paths["kdevice"] = str(path)
-        except Exception as e:
-            print(f"[yellow]MemProcFS: failed to collect kdevice() info: {e}[/yellow]")
+# What each MemProcFS artifact can answer, by Sigma logsource category and by
+# field name (last dotted component, so EventData.Image counts as Image).
+# "processes" is the per-process core record; modules/handles/threads are its
+# optional sections.
+_PLAN_CATEGORIES = {
+    "process_creation": ("processes",),
+    "image_load": ("processes", "modules"),
+    "create_remote_thread": ("processes", "threads"),
+    "process_access": ("processes", "handles"),
+    "network_connection": ("net",),
+    "driver_load": ("kdriver",),
+}
+_PLAN_FIELDS = {
+    "Image": ("processes",),
+    "CommandLine": ("processes",),
+    "ParentImage": ("processes",),
+    "ParentCommandLine": ("processes",),
+    "ProcessId": ("processes",),
+    "ParentProcessId": ("processes",),
+    "IntegrityLevel": ("processes",),
+    "ImageLoaded": ("processes", "modules"),
+    "StartAddress": ("processes", "threads"),
+    "StartModule": ("processes", "threads"),
+    "TargetImage": ("processes", "handles"),
+    "GrantedAccess": ("processes", "handles"),
+    "DestinationIp": ("net",),
+    "DestinationPort": ("net",),
+    "SourceIp": ("net",),
+    "SourcePort": ("net",),
+    "ServiceName": ("services",),
+    "ServiceFileName": ("services",),
+    "ImagePath": ("services",),
+    "TargetUserName": ("users",),
+    "TargetUserSid": ("users",),
+}
+
+
+def collection_plan(profile: Dict[str, Any], mem_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Decide which MemProcFS artifacts are worth collecting.
 
-    if collect_kobject:
-        try:
-            kobject_info = vmm.maps.kobject()
-            path = outdir / "memprocfs_kobject.json"
-            _write_json(path, kobject_info)
-            paths["kobject"] = str(path)
-        except Exception as e:
-            print(f"[yellow]MemProcFS: failed to collect kobject() info: {e}[/yellow]")
+    Artifacts are needed when a loaded Sigma rule's logsource category or
+    fields map onto them, when a downstream stage reads them (Hayabusa and
+    Sigma on EVTX read the extracted event logs), or when listed in memprocfs.collect_always.
+    Returns {"needs": [...], "reasons": {artifact: [why, ...]}}.
+    """
+    reasons: Dict[str, list] = {}
 
-    if collect_services:
-        try:
-            services_info = vmm.maps.service()
-            path = outdir / "memprocfs_services.json"
-            _write_json(path, services_info)
-            paths["services"] = str(path)
-        except Exception as e:
-            print(f"[yellow]MemProcFS: failed to collect service() info: {e}[/yellow]")
+    def need(items, why):
+        for item in items:
+            reasons.setdefault(item, [])
+            if why not in reasons[item]:
+                reasons[item].append(why)
 
-    if collect_users:
+    sigma_cfg = (profile.get("detections") or {}).get("sigma") or {}
+    rules_dir = sigma_cfg.get("rules_dir", "/app/rules/sigma")
+    try:
+        from src.pipeline import sigmaengine
+        engine = sigmaengine.load_rules(rules_dir, quiet=True) if os.path.isdir(rules_dir) else None
+    except Exception as e:
+        print(f"[yellow]MemProcFS: could not load Sigma rules for the collection plan: {e}[/yellow]")
+        engine = None
+    for rule in (engine.rules if engine else []):
+        category = rule.logsource.get("category")
+        if category in _PLAN_CATEGORIES:
+            need(_PLAN_CATEGORIES[category], f"sigma:{rule.title}")
+        for field in rule.fields:
+            need(_PLAN_FIELDS.get(field.split(".")[-1], ()), f"sigma:{rule.title}")
+
+    hb_cfg = (profile.get("timeline") or {}).get("hayabusa") or {}
+    if hb_cfg.get("enabled"):
+        need(["eventlogs"], "hayabusa")
+    if (sigma_cfg.get("evtx") or {}).get("enabled"):
+        need(["eventlogs"], "sigma_evtx")
+
+    need(mem_cfg.get("collect_always") or [], "profile")
+    return {"needs": sorted(reasons), "reasons": reasons}
+
+
+def _apply_plan(mem_cfg: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Narrow the profile's memprocfs settings to what the plan needs; never enables anything the profile disabled."""
+    needs = set(plan["needs"])
+    cfg = dict(mem_cfg)
+    proc_cfg = dict(cfg.get("processes") or {})
+    for section in _PROCESS_SECTIONS:
+        flag = f"include_{section}"
+        proc_cfg[flag] = proc_cfg.get(flag, True) and section in needs
+    cfg["processes"] = proc_cfg
+    maps_cfg = dict(cfg.get("maps") or {})
+    for key, (_method, _filename, default) in _GLOBAL_MAPS.items():
+        maps_cfg[key] = maps_cfg.get(key, default) and key in needs
+    cfg["maps"] = maps_cfg
+    return cfg
+
+
+# Vmm handles kept open by run_memprocfs for the memory YARA stage and
+# hit_context(), keyed by device path. Closed by close_handles().
+_handles: Dict[str, Any] = {}
+_handles_lock = threading.Lock()
+
+
+def close_handles() -> None:
+    with _handles_lock:
+        handles = list(_handles.values())
+        _handles.clear()
+    for vmm in handles:
         try:
-            users_info = vmm.maps.user()
-            path = outdir / "memprocfs_users.json"
-            _write_json(path, users_info)
-            paths["users"] = str(path)
-        except Exception as e:
-            print(f"[yellow]MemProcFS: failed to collect user() info: {e}[/yellow]")
-
-    return paths
-
-
-def _copy_eventlogs(vmm: Any, dest_root: Path, max_bytes: int = 64 * 1024 * 1024) -> None:
+            vmm.close()
+        except Exception:
+            pass
+
+
+def _extract_eventlog(vmm: Any, vpath: str, out_path: Path, size: int, chunk_bytes: int) -> Dict[str, Any]:
+    """Copy one VFS file to disk in fixed-size offset reads, hashing as it is written."""
+    h = hashlib.sha256()
+    written = 0
+    tmp_path = out_path.with_name(out_path.name + ".part")
+    with tmp_path.open("wb") as f:
+        while written < size:
+            data = vmm.vfs.read(vpath, min(chunk_bytes, size - written), written)
+            if not data:
+                break
+            f.write(data)
+            h.update(data)
+            written += len(data)
+    os.replace(tmp_path, out_path)
+    return {"size": written, "sha256": h.hexdigest(), "truncated": written < size}
+
+
+def _copy_eventlogs(
+    vmm: Any,
+    dest_root: Path,
+    max_bytes: Optional[int] = None,
+    chunk_bytes: int = 4 * 1024 * 1024,
+    workers: int = 4,
+) -> Dict[str, Dict[str, Any]]:
     """
     Copy EVTX event logs from the MemProcFS VFS to dest_root.
 
-    Uses the /misc/eventlog directory created by MemProcFS.
+    Uses the /misc/eventlog directory created by MemProcFS. Each log is
+    streamed in chunk_bytes offset reads, so memory stays constant regardless
+    of log size; logs are extracted concurrently on a small thread pool.
+    Returns {name: {"size", "sha256", "truncated"}} for every copied log.
     """
     dest_root.mkdir(parents=True, exist_ok=True)
     try:
@@ -254,38 +412,44 @@ def _copy_eventlogs(vmm: Any, dest_root: Path, max_bytes: int = 64 * 1024 * 1024
         print(
             f"[yellow]MemProcFS: no /misc/eventlog tree or failed to list it: {e}[/yellow]"
         )
-        return
+        return {}
 
-    copied = 0
-    for name, meta in entries.items():
+    todo = []
+    for name, meta in sorted(entries.items()):
         if meta.get("f_isdir"):
             continue
         size = int(meta.get("size", 0))
         if size <= 0:
             continue
-        if size > max_bytes:
+        if max_bytes and size > max_bytes:
             print(
                 f"[yellow]MemProcFS: skipping eventlog {name} (size {size} > {max_bytes})[/yellow]"
             )
             continue
+        todo.append((name, size))
 
+    def copy_one(item):
+        name, size = item
         vpath = f"/misc/eventlog/{name}"
         try:
-            data = vmm.vfs.read(vpath, size)
+            return name, _extract_eventlog(vmm, vpath, dest_root / name, size, chunk_bytes)
         except Exception as e:
             print(f"[yellow]MemProcFS: failed to read eventlog {vpath}: {e}[/yellow]")
-            continue
+            return name, None
 
-        out_path = dest_root / name
-        out_path.write_bytes(data)
-        copied += 1
+    copied: Dict[str, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for name, info in pool.map(metrics.wrap(copy_one), todo):
+            if info is not None:
+                copied[name] = info
 
     if copied:
         print(
-            f"[green]MemProcFS: copied {copied} EVTX files from /misc/eventlog to {dest_root}[/green]"
+            f"[green]MemProcFS: copied {len(copied)} EVTX files from /misc/eventlog to {dest_root}[/green]"
         )
     else:
         print("[yellow]MemProcFS: no EVTX files were copied from /misc/eventlog[/yellow]")
+    return copied
 
 
 def _auto_discover_device(evidence_dir: str):
@@ -298,43 +462,36 @@ def _auto_discover_device(evidence_dir: str):
     return None
 
 
-def run_memprocfs(evidence_dir: str, profile_path: str, outdir: str):
-    """
-    Run MemProcFS memory triage.
-
-    Returns a metadata dict with paths to the generated JSONs and the eventlog
-    directory, or None if MemProcFS is not enabled / not available.
-    """
-    outdir_path = Path(outdir)
-    outdir_path.mkdir(parents=True, exist_ok=True)
-
+def _load_profile(profile_path: str) -> Dict[str, Any]:
     try:
         with open(profile_path, "r", encoding="utf-8") as f:
-            profile = yaml.safe_load(f) or {}
+            return yaml.safe_load(f) or {}
     except FileNotFoundError:
         print(
             f"[yellow]MemProcFS: profile {profile_path} not found; using defaults[/yellow]"
         )
-        profile = {}
     except Exception as e:
         print(
             f"[yellow]MemProcFS: failed to load profile {profile_path}: {e}[/yellow]"
         )
-        profile = {}
+    return {}
 
-    mem_cfg = (profile.get("memory") or {}).get("memprocfs") or {}
-    if not mem_cfg.get("enabled"):
-        print("[yellow]MemProcFS: disabled in profile, skipping[/yellow]")
-        return None
 
+def _open_vmm(evidence_dir: str, mem_cfg: Dict[str, Any]):
+    """Return (vmm, device) for the configured memory image, reusing a kept-open handle; vmm is None on failure."""
     if memprocfs is None:
         print("[yellow]MemProcFS: memprocfs Python package not available, skipping[/yellow]")
-        return None
+        return None, None
 
     device = mem_cfg.get("device") or _auto_discover_device(evidence_dir)
     if not device or not os.path.exists(device):
         print(f"MemProcFS: no memory image found (device={device!r}), skipping")
-        return None
+        return None, device
+
+    with _handles_lock:
+        vmm = _handles.get(device)
+    if vmm is not None:
+        return vmm, device
 
     args = ["-device", device]
     if mem_cfg.get("forensic", True):
@@ -348,17 +505,47 @@ def run_memprocfs(evidence_dir: str, profile_path: str, outdir: str):
 
     print(f"[cyan]MemProcFS: analyzing memory image {device}[/cyan]")
     try:
-        vmm = memprocfs.Vmm(args)
+        return memprocfs.Vmm(args), device
     except Exception as e:
         print(f"[yellow]MemProcFS: failed to initialize Vmm: {e}[/yellow]")
+        return None, device
+
+
+def run_memprocfs(evidence_dir: str, profile_path: str, outdir: str):
+    """
+    Run MemProcFS memory triage.
+
+    Returns a metadata dict with paths to the generated JSONs and the eventlog
+    directory, or None if MemProcFS is not enabled / not available.
+    """
+    outdir_path = Path(outdir)
+    outdir_path.mkdir(parents=True, exist_ok=True)
+
+    profile = _load_profile(profile_path)
+    mem_cfg = (profile.get("memory") or {}).get("memprocfs") or {}
+    if not mem_cfg.get("enabled"):
+        print("[yellow]MemProcFS: disabled in profile, skipping[/yellow]")
         return None
 
-    meta: Dict[str, str] = {"device": device}
+    vmm, device = _open_vmm(evidence_dir, mem_cfg)
+    if vmm is None:
+        return None
+
+    meta: Dict[str, Any] = {"device": device}
+
+    # "plan" collects only what the loaded rules and downstream stages use.
+    plan = None
+    if mem_cfg.get("collect", "all") == "plan":
+        plan = collection_plan(profile, mem_cfg)
+        mem_cfg = _apply_plan(mem_cfg, plan)
+        meta["collection_plan"] = plan
+        print(f"[cyan]MemProcFS: collection plan: {', '.join(plan['needs']) or 'nothing'}[/cyan]")
 
     # Per-process data
     try:
-        proc_paths = _collect_process_data(vmm, outdir_path, mem_cfg.get("processes", {}))
-        meta.update(proc_paths)
+        if plan is None or "processes" in plan["needs"]:
+            proc_paths = _collect_process_data(vmm, outdir_path, mem_cfg.get("processes", {}))
+            meta.update(proc_paths)
     except Exception as e:
         print(f"[yellow]MemProcFS: error while collecting per-process data: {e}[/yellow]")
 
@@ -370,15 +557,337 @@ def run_memprocfs(evidence_dir: str, profile_path: str, outdir: str):
         print(f"[yellow]MemProcFS: error while collecting global map data: {e}[/yellow]")
 
     # EVTX extraction to a directory Hayabusa can consume.
+    if plan is None or "eventlogs" in plan["needs"]:
+        try:
+            max_bytes = mem_cfg.get("max_eventlog_bytes")
+            evtx_dir_cfg = mem_cfg.get(
+                "eventlog_dir", str(outdir_path / "memprocfs_eventlogs")
+            )
+            evtx_dir = Path(evtx_dir_cfg)
+            copied = _copy_eventlogs(
+                vmm,
+                evtx_dir,
+                max_bytes=int(max_bytes) if max_bytes else None,
+                chunk_bytes=int(mem_cfg.get("eventlog_chunk_bytes", 4 * 1024 * 1024)),
+                workers=int(mem_cfg.get("eventlog_workers", 4)),
+            )
+            meta["eventlogs_dir"] = str(evtx_dir)
+            meta["eventlogs"] = copied
+            metrics.count("eventlogs", len(copied))
+        except Exception as e:
+            print(f"[yellow]MemProcFS: error while copying EVTX files: {e}[/yellow]")
+
+    # Keep the handle for the memory YARA stage and the report's hit context.
+    if mem_cfg.get("keep_open", bool((mem_cfg.get("yara") or {}).get("enabled"))):
+        with _handles_lock:
+            _handles[device] = vmm
+    else:
+        try:
+            vmm.close()
+        except Exception:
+            pass
+
+    return meta
+
+
+def _vad_value(vad: Dict[str, Any], *names: str, default: Any = None) -> Any:
+    """First present key among names; VAD dict keys differ between MemProcFS releases."""
+    for name in names:
+        if name in vad:
+            return vad[name]
+    return default
+
+
+def _norm_image_path(path: str) -> str:
+    r"""Lowercase, forward-slash path without drive letter or \Device\HarddiskVolumeN prefix."""
+    p = str(path or "").replace("\\", "/").lower()
+    if len(p) > 1 and p[1] == ":":
+        p = p[2:]
+    if p.startswith("/device/") and p.count("/") >= 3:
+        p = "/" + p.split("/", 3)[3]
+    return p
+
+
+def _known_images(outdir: str, file_cfg: Dict[str, Any], ycfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    sha256 of files whose content is already accounted for, and the evidence files they can back.
+
+    hashes: files the file YARA stage scanned (within its max_file_bytes)
+    plus any listed in memprocfs.yara.known_hashes files (one sha256 per
+    line, e.g. an NSRL export). files: evidence files by lowercase
+    basename, as (normalized path, sha256), for resolving a module's path.
+    """
+    max_bytes = int(file_cfg.get("max_file_bytes", yarascan.DEFAULT_MAX_FILE_BYTES))
+    hashes, files = set(), {}
+    for e in evidence.load_manifest(outdir):
+        if not e.get("sha256"):
+            continue
+        p = _norm_image_path(e["path"])
+        files.setdefault(p.rsplit("/", 1)[-1], []).append((p, e["sha256"]))
+        if not max_bytes or int(e.get("size") or 0) <= max_bytes:
+            hashes.add(e["sha256"])
+    for path in ycfg.get("known_hashes") or []:
+        try:
+            with open(path, "r") as f:
+                hashes.update(w.lower() for w in (line.strip().split(",")[0] for line in f) if len(w) == 64)
+        except OSError as e:
+            print(f"[yellow]MemProcFS: could not read known hashes {path}: {e}[/yellow]")
+    return {"hashes": hashes, "files": files}
+
+
+def _backing_sha256(image_path: str, known: Dict[str, Any]) -> Optional[str]:
+    """sha256 of the on-disk file backing an image region, or None when it cannot be pinned to one file."""
+    p = _norm_image_path(image_path)
+    if "/" not in p.strip("/"):
+        # A bare module name is too weak to identify the on-disk file.
+        return None
+    shas = {sha for k, sha in known["files"].get(p.rsplit("/", 1)[-1], ()) if k.endswith(p)}
+    return shas.pop() if len(shas) == 1 else None
+
+
+def _scan_region(process: Any, rules: Any, start: int, size: int, window: int, overlap: int,
+                 read_flags: int, timeout: int, label: str) -> Tuple[list, int]:
+    """
+    Scan one region in windows of `window` bytes overlapping by `overlap`.
+
+    Hits of the same rule across windows are merged into one, string
+    offsets made region-relative and de-duplicated. Returns (hits, bytes read).
+    """
+    merged: Dict[tuple, Dict[str, Any]] = {}
+    read = 0
+    step = max(1, window - overlap)
+    pos = 0
+    while pos < size:
+        n = min(window, size - pos)
+        data = process.memory.read(start + pos, n, read_flags)
+        read += len(data)
+        for h in yarascan.scan_data(rules, data, timeout, label):
+            hit = merged.setdefault((h["namespace"], h["rule"]), dict(h, strings={}))
+            for st in h["strings"]:
+                cur = hit["strings"].setdefault(st["identifier"], {"identifier": st["identifier"], "offsets": set(), "count": 0})
+                cur["offsets"].update(pos + o for o in st["offsets"])
+                cur["count"] += st["count"] - len(st["offsets"])  # instances beyond the recorded offsets
+        if pos + n >= size:
+            break
+        pos += step
+    hits = []
+    for hit in merged.values():
+        strings = []
+        for st in hit["strings"].values():
+            offsets = sorted(st["offsets"])
+            strings.append({"identifier": st["identifier"], "offsets": offsets[:yarascan.MAX_OFFSETS_PER_STRING],
+                            "count": len(offsets) + st["count"]})
+        hits.append(dict(hit, strings=strings))
+    return hits, read
+
+
+def _scan_process(process: Any, rules: Any, known: Dict[str, Any], max_region_bytes: int,
+                  timeout: int, window: int, overlap: int) -> Tuple[list, Dict[str, int]]:
+    """
+    YARA-scan the committed VAD regions of one process.
+
+    Image-backed regions whose on-disk file hashes to a known sha256 are
+    skipped. Regions are read in windows, so memory per worker stays at
+    one window. Offsets are reported as virtual addresses alongside the
+    region and module.
+    """
+    pid = _safe_getattr(process, "pid")
+    name = _safe_getattr(process, "name")
+    stats = {"regions": 0, "bytes": 0, "skipped_known": 0, "skipped_large": 0}
+    hits = []
     try:
-        max_bytes = int(mem_cfg.get("max_eventlog_bytes", 64 * 1024 * 1024))
-        evtx_dir_cfg = mem_cfg.get(
-            "eventlog_dir", str(outdir_path / "memprocfs_eventlogs")
-        )
-        evtx_dir = Path(evtx_dir_cfg)
-        _copy_eventlogs(vmm, evtx_dir, max_bytes=max_bytes)
-        meta["eventlogs_dir"] = str(evtx_dir)
+        vads = process.maps.vad()
     except Exception as e:
-        print(f"[yellow]MemProcFS: error while copying EVTX files: {e}[/yellow]")
+        print(f"[yellow]MemProcFS: failed to enumerate VADs for PID {pid}: {e}[/yellow]")
+        return hits, stats
+
+    read_flags = getattr(memprocfs, "FLAG_ZEROPAD_ON_FAIL", 0)
+    for vad in vads or []:
+        start = int(_vad_value(vad, "start", default=0))
+        end = int(_vad_value(vad, "end", default=start))
+        size = end - start + 1 if end >= start else 0
+        if size <= 0 or not _vad_value(vad, "mem_commit", "commit", default=True):
+            continue
+        image = bool(_vad_value(vad, "image", "fimage", default=False)) or \
+            str(_vad_value(vad, "type", default="")).strip().lower() == "image"
+        backing = _vad_value(vad, "text", "info", default="") if image else ""
+        if image and known["hashes"] and _backing_sha256(backing, known) in known["hashes"]:
+            stats["skipped_known"] += 1
+            continue
+        if max_region_bytes and size > max_region_bytes:
+            stats["skipped_large"] += 1
+            continue
+        try:
+            region_hits, read = _scan_region(process, rules, start, size, window, overlap,
+                                             read_flags, timeout, f"pid {pid} {start:#x}")
+        except Exception as e:
+            print(f"[yellow]MemProcFS: failed to read PID {pid} VA {start:#x}: {e}[/yellow]")
+            continue
+        stats["regions"] += 1
+        stats["bytes"] += read
+        for h in region_hits:
+            for st in h["strings"]:
+                st["addresses"] = [f"{start + o:#x}" for o in st["offsets"]]
+            hits.append(dict(
+                h,
+                pid=pid,
+                process=name,
+                module=backing or None,
+                region={"start": f"{start:#x}", "end": f"{end:#x}",
+                        "protection": _vad_value(vad, "protection"), "type": _vad_value(vad, "type")},
+            ))
+    return hits, stats
+
+
+def run_memory_yara(evidence_dir: str, profile_path: str, outdir: str) -> Optional[Dict[str, Any]]:
+    """
+    YARA-scan every process's address space through MemProcFS.
+
+    Reuses the compiled rule set (and its cache) from the file YARA stage,
+    the Vmm handle left open by run_memprocfs, and the evidence manifest to
+    skip image-backed regions whose on-disk file has a known sha256.
+    Processes are scanned concurrently, each region in overlapping windows
+    of memprocfs.yara.window_bytes; hits go to memprocfs_yara_hits.jsonl in
+    process-list order.
+    """
+    profile = _load_profile(profile_path)
+    mem_cfg = (profile.get("memory") or {}).get("memprocfs") or {}
+    ycfg = mem_cfg.get("yara") or {}
+    if not mem_cfg.get("enabled") or not ycfg.get("enabled"):
+        print("[yellow]MemProcFS: memory YARA disabled in profile, skipping[/yellow]")
+        return None
 
-    return meta
+    file_cfg = (profile.get("detections") or {}).get("yara") or {}
+    rules_dir = ycfg.get("rules_dir") or file_cfg.get("rules_dir", "/app/rules/yara")
+    cache_dir = evidence.cache_dir(outdir, file_cfg.get("cache_dir"))
+    rules, _tree_hash, rule_count = yarascan.compile_rules(rules_dir, cache_dir)
+    if rules is None:
+        print("[yellow]MemProcFS: no YARA rules for memory scanning, skipping[/yellow]")
+        return None
+    metrics.count("rules", rule_count)
+
+    vmm, device = _open_vmm(evidence_dir, mem_cfg)
+    if vmm is None:
+        return None
+    # A handle opened here (memprocfs stage cached, or keep_open off) is
+    # closed here; a kept one is left for close_handles().
+    with _handles_lock:
+        owned = _handles.get(device) is not vmm
+    try:
+        return _memory_yara(vmm, device, rules, rules_dir, outdir, file_cfg, ycfg)
+    finally:
+        if owned:
+            try:
+                vmm.close()
+            except Exception:
+                pass
+
+
+def _memory_yara(vmm: Any, device: str, rules: Any, rules_dir: str, outdir: str,
+                 file_cfg: Dict[str, Any], ycfg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    known = _known_images(outdir, file_cfg, ycfg) if ycfg.get("skip_known_images", True) else {"hashes": set(), "files": {}}
+    max_region_bytes = int(ycfg.get("max_region_bytes", yarascan.DEFAULT_MAX_FILE_BYTES))
+    timeout = int(ycfg.get("timeout", yarascan.DEFAULT_TIMEOUT))
+    overlap = int(ycfg.get("window_overlap") or yarascan.string_reach(rules_dir))
+    window = max(int(ycfg.get("window_bytes", DEFAULT_YARA_WINDOW)), 2 * overlap)
+    workers = int(ycfg.get("workers") or evidence.available_cpus())
+    pids = ycfg.get("pids")
+
+    try:
+        processes = vmm.process_list()
+    except Exception as e:
+        print(f"[red]MemProcFS: failed to enumerate process list: {e}[/red]")
+        return None
+    if pids:
+        processes = [p for p in processes if _safe_getattr(p, "pid") in set(pids)]
+
+    def scan(p):
+        return _scan_process(p, rules, known, max_region_bytes, timeout, window, overlap)
+
+    out_jsonl = Path(outdir) / "memprocfs_yara_hits.jsonl"
+    totals = {"processes": 0, "regions": 0, "bytes": 0, "skipped_known": 0, "skipped_large": 0, "hits": 0}
+    with out_jsonl.open("w", encoding="utf-8") as out:
+        for hits, stats in evidence.bounded_map(metrics.wrap(scan), processes, workers):
+            totals["processes"] += 1
+            for k, v in stats.items():
+                totals[k] += v
+            for h in hits:
+                out.write(json.dumps(h) + "\n")
+            totals["hits"] += len(hits)
+    for k in ("processes", "regions", "hits"):
+        metrics.count(k, totals[k])
+
+    print(
+        f"[green]MemProcFS: YARA scanned {totals['regions']} regions in {totals['processes']} processes "
+        f"({totals['skipped_known']} known images skipped), {totals['hits']} hits[/green]"
+    )
+    return {"device": device, "hits_jsonl": str(out_jsonl), "stats": totals}
+
+
+def hit_context(evidence_dir: str, profile_path: str, outdir: str, meta: Dict[str, Any]) -> Optional[str]:
+    """
+    Fetch the per-process sections a collection plan skipped, for processes with memory YARA hits.
+
+    Queried on demand from the handle kept by run_memprocfs (or a fresh one
+    when that stage was cached) while the report is built, and written to
+    memprocfs_hit_context.json as {pid: process record}. Returns its path,
+    or None when the plan skipped nothing or nothing hit.
+    """
+    plan = (meta.get("memprocfs") or {}).get("collection_plan")
+    hits_path = (meta.get("memory_yara") or {}).get("hits_jsonl")
+    if not plan or not hits_path or not os.path.exists(hits_path):
+        return None
+
+    profile = _load_profile(profile_path)
+    mem_cfg = (profile.get("memory") or {}).get("memprocfs") or {}
+    proc_cfg = mem_cfg.get("processes") or {}
+    skipped = [s for s in _PROCESS_SECTIONS if s not in plan["needs"] and proc_cfg.get(f"include_{s}", True)]
+    max_pids = int(mem_cfg.get("hit_context_pids", 50))
+    if not skipped or max_pids <= 0:
+        return None
+
+    pids: list = []
+    with open(hits_path, encoding="utf-8") as f:
+        for line in f:
+            pid = json.loads(line).get("pid")
+            if pid is not None and pid not in pids:
+                pids.append(pid)
+    if not pids:
+        return None
+    pids = pids[:max_pids]
+
+    # Hits unchanged since the last run: the context is too (a fresh Vmm costs minutes).
+    out_path = Path(outdir) / "memprocfs_hit_context.json"
+    if out_path.exists() and out_path.stat().st_mtime >= os.path.getmtime(hits_path):
+        return str(out_path)
+
+    vmm, device = _open_vmm(evidence_dir, mem_cfg)
+    if vmm is None:
+        return None
+    with _handles_lock:
+        owned = _handles.get(device) is not vmm
+    flags = {f"include_{s}": s in skipped for s in _PROCESS_SECTIONS}
+    context: Dict[str, Any] = {}
+    try:
+        for pid in pids:
+            try:
+                process = vmm.process(pid)
+            except Exception as e:
+                print(f"[yellow]MemProcFS: failed to open PID {pid} for hit context: {e}[/yellow]")
+                continue
+            context[str(pid)] = _serialize_process(
+                process,
+                max_handles=int(proc_cfg.get("max_handles_per_process", 2000)),
+                max_threads=int(proc_cfg.get("max_threads_per_process", 2000)),
+                **flags,
+            )
+    finally:
+        if owned:
+            try:
+                vmm.close()
+            except Exception:
+                pass
+    metrics.count("processes", len(context))
+    _write_json(out_path, context)
+    print(f"[green]MemProcFS: {', '.join(skipped)} queried for {len(context)} processes with memory YARA hits[/green]")
+    return str(out_path)
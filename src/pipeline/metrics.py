@@ -0,0 +1,193 @@
+import cProfile
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import pyinstrument  # type: ignore
+except Exception:
+    pyinstrument = None  # type: ignore
+
+
+_local = threading.local()
+
+
+def _proc_io(path: str = "/proc/self/io") -> Dict[str, int]:
+    """read_bytes/write_bytes (storage-level I/O) of this process or one of its threads."""
+    out: Dict[str, int] = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                k, _, v = line.partition(":")
+                if k in ("read_bytes", "write_bytes"):
+                    out[k] = int(v)
+    except OSError:
+        pass
+    return out
+
+
+def _cpu_self() -> float:
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+
+class Metrics:
+    """
+    Per-run resource accounting.
+
+    Stages run concurrently in threads, so each stage records its own thread
+    CPU time and the exact rusage of every external process it launched via
+    run_process(); process-wide CPU/I/O deltas over the stage window are also
+    kept but overlap with whatever else was running at the time.
+    """
+
+    def __init__(self, profile_stages: Optional[List[str]] = None, profile_dir: Optional[str] = None,
+                 profiler: str = "cprofile"):
+        self.started = time.time()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.profile_stages = set(profile_stages or [])
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        rec: Dict[str, Any] = {"items": {}, "subprocesses": []}
+        with self._lock:
+            self.stages[name] = rec
+        prev = getattr(_local, "ctx", None)
+        _local.ctx = (self, name)
+
+        io0, cpu0 = _proc_io(), _cpu_self()
+        tcpu0, t0 = time.thread_time(), time.perf_counter()
+        prof = self._start_profiler(name)
+        try:
+            yield rec
+        finally:
+            self._stop_profiler(name, prof)
+            io1 = _proc_io()
+            rec["wall_s"] = round(time.perf_counter() - t0, 3)
+            rec["thread_cpu_s"] = round(time.thread_time() - tcpu0, 3)
+            rec["process_window"] = {
+                "cpu_s": round(_cpu_self() - cpu0, 3),
+                "read_bytes": io1.get("read_bytes", 0) - io0.get("read_bytes", 0) if io0 else None,
+                "write_bytes": io1.get("write_bytes", 0) - io0.get("write_bytes", 0) if io0 else None,
+            }
+            _local.ctx = prev
+
+    def _start_profiler(self, name: str):
+        if name not in self.profile_stages or not self.profile_dir:
+            return None
+        if self.profiler == "pyinstrument" and pyinstrument is not None:
+            prof = pyinstrument.Profiler()
+            prof.start()
+        else:
+            prof = cProfile.Profile()
+            prof.enable()
+        return prof
+
+    def _stop_profiler(self, name: str, prof) -> None:
+        if prof is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if isinstance(prof, cProfile.Profile):
+            prof.disable()
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            prof.dump_stats(path)
+        else:
+            prof.stop()
+            path = os.path.join(self.profile_dir, f"{name}.html")
+            with open(path, "w") as f:
+                f.write(prof.output_html())
+        with self._lock:
+            self.stages[name]["profile"] = path
+
+    def summary(self) -> Dict[str, Any]:
+        self_ru = resource.getrusage(resource.RUSAGE_SELF)
+        child_ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = _proc_io()
+        return {
+            "stages": self.stages,
+            "totals": {
+                "wall_s": round(time.time() - self.started, 3),
+                "cpu_self_s": round(self_ru.ru_utime + self_ru.ru_stime, 3),
+                "cpu_children_s": round(child_ru.ru_utime + child_ru.ru_stime, 3),
+                "max_rss_self_kb": self_ru.ru_maxrss,
+                "max_rss_children_kb": child_ru.ru_maxrss,
+                "read_bytes": io.get("read_bytes"),
+                "write_bytes": io.get("write_bytes"),
+            },
+        }
+
+    def write(self, path: str) -> str:
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+        return path
+
+
+def current():
+    """The (Metrics, stage name) bound to this thread, if any."""
+    return getattr(_local, "ctx", None)
+
+
+def wrap(fn):
+    """Bind the caller's stage context to fn so work submitted to pool threads is attributed."""
+    ctx = current()
+
+    def bound(*args, **kwargs):
+        prev = getattr(_local, "ctx", None)
+        _local.ctx = ctx
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.ctx = prev
+    return bound
+
+
+def count(item: str, n: int = 1) -> None:
+    """Add n to an item counter (events, files, rules, processes, ...) of the current stage."""
+    ctx = current()
+    if ctx is None:
+        return
+    m, name = ctx
+    with m._lock:
+        items = m.stages[name]["items"]
+        items[item] = items.get(item, 0) + n
+
+
+def run_process(cmd_list: List[str], cwd: Optional[str] = None, env=None):
+    """
+    subprocess.run(..., stdout=PIPE, stderr=STDOUT, text=True) that also
+    records the child's wall time, CPU time, peak RSS and block I/O via wait4.
+
+    Returns (returncode, output).
+    """
+    t0 = time.perf_counter()
+    p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=cwd, env=env)
+    try:
+        output = p.stdout.read() if p.stdout else ""
+    finally:
+        if p.stdout:
+            p.stdout.close()
+    _pid, status, ru = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+
+    ctx = current()
+    if ctx is not None:
+        m, name = ctx
+        with m._lock:
+            m.stages[name]["subprocesses"].append({
+                "cmd": cmd_list[0],
+                "returncode": p.returncode,
+                "wall_s": round(time.perf_counter() - t0, 3),
+                "cpu_s": round(ru.ru_utime + ru.ru_stime, 3),
+                "max_rss_kb": ru.ru_maxrss,
+                "read_bytes": ru.ru_inblock * 512,
+                "write_bytes": ru.ru_oublock * 512,
+            })
+    return p.returncode, output
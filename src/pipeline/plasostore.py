@@ -0,0 +1,197 @@
+import json
+import re
+import sqlite3
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+# Plaso's SQLite storage (acstore) keeps one table per attribute container
+# type. Depending on the storage format version a container is either a
+# serialized JSON blob in a `_data` column (optionally zlib-compressed) or
+# spread over one column per attribute; both layouts are handled.
+EVENT_TABLE = "event"
+EVENT_DATA_TABLE = "event_data"
+EVENT_DATA_STREAM_TABLE = "event_data_stream"
+_ROW_ID = re.compile(r"(\d+)$")
+_EVENT_DATA_REFS = ("_event_data_row_identifier", "_event_data_identifier", "event_data_row_identifier")
+_STREAM_REFS = ("_event_data_stream_row_identifier", "_event_data_stream_identifier")
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _compression(conn: sqlite3.Connection) -> Optional[str]:
+    try:
+        row = conn.execute("SELECT value FROM metadata WHERE key = 'compression_format'").fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def _decode_value(v: Any) -> Any:
+    """Unwrap serialized attribute values (nested containers, date/time values)."""
+    if isinstance(v, dict):
+        if v.get("__type__") == "bytes":
+            return v.get("stream")
+        return {k: _decode_value(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_decode_value(x) for x in v]
+    return v
+
+
+def _decode_row(cols: List[str], row: Tuple, zlib_blobs: bool) -> Dict[str, Any]:
+    values = dict(zip(cols, row))
+    data = values.pop("_data", None)
+    if data is not None:
+        if isinstance(data, bytes):
+            if zlib_blobs:
+                data = zlib.decompress(data)
+            data = data.decode("utf-8")
+        try:
+            values.update(json.loads(data))
+        except ValueError:
+            pass
+    out: Dict[str, Any] = {}
+    for k, v in values.items():
+        if k.startswith("__") or v is None:
+            continue
+        if isinstance(v, str) and v[:1] in "{[":
+            # column layout stores compound attributes (date_time, ...) as JSON text
+            try:
+                v = json.loads(v)
+            except ValueError:
+                pass
+        out[k] = _decode_value(v)
+    return out
+
+
+def _row_id(ref: Any) -> Optional[int]:
+    """Row id from an event's event data reference ("event_data.7", 7, or a serialized identifier)."""
+    if isinstance(ref, dict):
+        ref = ref.get("sequence_number", ref.get("row_identifier"))
+    if isinstance(ref, int):
+        return ref
+    m = _ROW_ID.search(str(ref or ""))
+    return int(m.group(1)) if m else None
+
+
+def _ref(values: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[int]:
+    for key in keys:
+        if key in values:
+            return _row_id(values.pop(key))
+    return None
+
+
+def _path_fields(path_spec: Any) -> Dict[str, Any]:
+    """filename, display_name and inode of a serialized path spec, formatted the way psort does."""
+    if not isinstance(path_spec, dict):
+        return {}
+    out: Dict[str, Any] = {"pathspec": path_spec}
+    # e.g. a gzip stream has no location of its own; psort names it after its parent file
+    location = path_spec.get("location") or (path_spec.get("parent") or {}).get("location")
+    kind = path_spec.get("type_indicator", "")
+    if location:
+        out["filename"] = location
+        out["display_name"] = f"{kind}:{location}"
+    elif kind:
+        out["display_name"] = kind
+    if path_spec.get("inode") is not None:
+        out["inode"] = path_spec["inode"]
+    return out
+
+
+def event_range(path: str) -> Tuple[int, int]:
+    """(min, max) row id of the event table, for splitting a scan into shards."""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        lo, hi = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {EVENT_TABLE}").fetchone()
+    return int(lo or 0), int(hi or 0)
+
+
+def count(path: str) -> int:
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        return int(conn.execute(f"SELECT COUNT(*) FROM {EVENT_TABLE}").fetchone()[0])
+
+
+def iter_events(path: str, start: Optional[int] = None, end: Optional[int] = None,
+                order: str = "rowid", cache_size: int = 4096) -> Iterator[Dict[str, Any]]:
+    """
+    Stream events straight out of a .plaso storage file, psort json_line style.
+
+    Each event's attributes are merged with its event data (data_type,
+    parser and the parser-specific fields) and the event data stream it
+    came from (filename, display_name, hashes). Rows are read in storage order,
+    or timestamp order with order="timestamp"; start/end restrict the scan
+    to a rowid range [start, end). Event data rows are shared by several
+    events (one per timestamp), so recent ones are kept in a small LRU.
+    Formatted `message`/`display_name` strings are psort output and are not
+    produced here.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        zlib_blobs = _compression(conn) == "zlib"
+        ev_cols = _columns(conn, EVENT_TABLE)
+        ed_cols = _columns(conn, EVENT_DATA_TABLE)
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        ds_cols = _columns(conn, EVENT_DATA_STREAM_TABLE) if EVENT_DATA_STREAM_TABLE in tables else []
+        where, params = [], []
+        if start is not None:
+            where.append("rowid >= ?")
+            params.append(int(start))
+        if end is not None:
+            where.append("rowid < ?")
+            params.append(int(end))
+        sql = f"SELECT {', '.join(ev_cols)} FROM {EVENT_TABLE}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # Plaso adds a _timestamp column to the event table for sorting.
+        ts_col = next((c for c in ("_timestamp", "timestamp") if c in ev_cols), None)
+        sql += f" ORDER BY {ts_col}, rowid" if order == "timestamp" and ts_col else " ORDER BY rowid"
+
+        cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        streams: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        lookup = f"SELECT {', '.join(ed_cols)} FROM {EVENT_DATA_TABLE} WHERE rowid = ?"
+        stream_lookup = f"SELECT {', '.join(ds_cols)} FROM {EVENT_DATA_STREAM_TABLE} WHERE rowid = ?"
+        reader = conn.cursor()
+
+        def cached(lru: "OrderedDict[int, Dict[str, Any]]", ref: int, load) -> Dict[str, Any]:
+            hit = lru.get(ref)
+            if hit is not None:
+                lru.move_to_end(ref)
+                return hit
+            hit = lru[ref] = load(ref)
+            if len(lru) > cache_size:
+                lru.popitem(last=False)
+            return hit
+
+        def load_stream(ref: int) -> Dict[str, Any]:
+            row = reader.execute(stream_lookup, (ref,)).fetchone() if ds_cols else None
+            if not row:
+                return {}
+            stream = _decode_row(ds_cols, row, zlib_blobs)
+            out = _path_fields(stream.pop("path_spec", None))
+            out.update((k, v) for k, v in stream.items() if not k.startswith("_"))
+            return out
+
+        def load_data(ref: int) -> Dict[str, Any]:
+            row = reader.execute(lookup, (ref,)).fetchone()
+            if not row:
+                return {}
+            data = _decode_row(ed_cols, row, zlib_blobs)
+            stream_ref = _ref(data, _STREAM_REFS)
+            out = dict(cached(streams, stream_ref, load_stream)) if stream_ref is not None else {}
+            if "_parser_chain" in data:
+                out["parser"] = data["_parser_chain"]
+            out.update((k, v) for k, v in data.items() if not k.startswith("_"))
+            return out
+
+        for row in conn.execute(sql, params):
+            event = _decode_row(ev_cols, row, zlib_blobs)
+            ref = _ref(event, _EVENT_DATA_REFS)
+            out = dict(cached(cache, ref, load_data)) if ref is not None else {}
+            out.update((k, v) for k, v in event.items() if not k.startswith("_"))
+            out["__container_type__"] = "event"
+            yield out
+    finally:
+        conn.close()
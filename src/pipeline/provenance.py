@@ -1,13 +1,17 @@
-import os, json, subprocess, shlex, hashlib, time
-from pathlib import Path
+import os, json, shlex, hashlib, time
 from rich import print
 import yaml
+from src.pipeline import evidence as evidence_manifest
+from src.pipeline import integrity, metrics, timeline, toolversions
 
 def _run(cmd):
-    p = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    if p.returncode != 0:
+    try:
+        rc, out = metrics.run_process(shlex.split(cmd))
+    except FileNotFoundError:
+        return None
+    if rc != 0:
         return None
-    return p.stdout.strip()
+    return out.strip()
 
 def _hash_file(p):
     h=hashlib.sha256()
@@ -16,59 +20,81 @@ def _hash_file(p):
             h.update(chunk)
     return h.hexdigest()
 
-def _hash_tree(root):
-    root=Path(root)
-    digests=[]
-    for p in root.rglob("*"):
-        if p.is_file():
-            try:
-                digests.append(_hash_file(p))
-            except Exception:
-                continue
-    m=hashlib.sha256()
-    for d in sorted(digests):
-        m.update(d.encode())
-    return m.hexdigest(), len(digests)
+def _hash_tree(root, workers=None, cache=None):
+    """Merkle digest of a tree, hashed in parallel with cached digests for unchanged files."""
+    entries = evidence_manifest.hash_tree(str(root), workers or evidence_manifest.available_cpus(), cache)
+    digest, dirs, count = evidence_manifest.merkle(entries, str(root))
+    return digest, count, dirs
 
 def tool_versions():
-    vers = {
-        "plaso": _run("log2timeline.py --version"),
-        "psort": _run("psort.py --version"),
-        "yara": _run("yara --version"),
-        "python": _run("python3 --version"),
-        "syft": _run("syft version") if shutil_which("syft") else None,
-    }
-    try:
-        import yara as _y
-        vers["yara_python"] = getattr(_y, "__version__", "unknown")
-    except Exception:
-        vers["yara_python"] = None
-    return vers
+    """Tool versions from the build-time manifest (toolversions), rediscovering only changed tools."""
+    return toolversions.versions()
 
 def shutil_which(cmd):
     from shutil import which
     return which(cmd) is not None
 
 def generate(evidence, profile, outdir):
-    ev_hash, ev_files = _hash_tree(evidence)
-    # hash rules and profile
+    try:
+        with open(profile, "r") as f:
+            profile_data = yaml.safe_load(f) or {}
+    except Exception:
+        profile_data = {}
+    pcfg = profile_data.get("provenance") or {}
+    workers = int(pcfg.get("hash_workers") or evidence_manifest.available_cpus())
+    cache = evidence_manifest.HashCache(evidence_manifest.cache_dir(outdir, pcfg.get("cache_dir")))
+
+    # The YARA stage's single evidence pass already hashed every file.
+    entries = evidence_manifest.manifest_entries(outdir, evidence)
+    if entries:
+        print(f"[cyan]Provenance: reused evidence manifest for {evidence}[/cyan]")
+        ev_hash, ev_dirs, ev_files = evidence_manifest.merkle(entries, evidence)
+    else:
+        ev_hash, ev_files, ev_dirs = _hash_tree(evidence, workers, cache)
+    merkle_path = os.path.join(outdir, evidence_manifest.MERKLE_NAME)
+    with open(merkle_path, "w") as f:
+        json.dump({"root": evidence, "algorithm": evidence_manifest.MERKLE_ALGORITHM, "directories": ev_dirs}, f, indent=2, sort_keys=True)
+
     prof_hash = _hash_file(profile) if os.path.isfile(profile) else None
     rules_dir = "/app/rules"
-    rules_hash, rules_files = _hash_tree(rules_dir)
+
+    # The image's SBOM and toolchain digests were recorded at build time;
+    # check the installed tools, rules and code still match them. The same
+    # pass hashes the rule pack, so its digest comes from those entries.
+    build = integrity.verify(workers=workers, roots=[rules_dir])
+    if build.get("entries") is not None:
+        rules_hash, _, rules_files = evidence_manifest.merkle(build.pop("entries"), rules_dir)
+    else:
+        rules_hash, rules_files, _ = _hash_tree(rules_dir, workers, cache)
+    if build["status"] == "mismatch":
+        print(f"[yellow]Provenance: {len(build['changed'])} changed and {len(build['missing'])} missing files "
+              f"since the image build (see provenance.json build.integrity)[/yellow]")
+    elif build["status"] == "verified":
+        print(f"[cyan]Provenance: {build['files']} toolchain files match the build manifest ({build['wall_s']}s)[/cyan]")
 
     prov = {
-        "schema": "dfirbox-provenance-0.1",
+        "schema": "dfirbox-provenance-0.2",
         "timestamp": int(time.time()),
         "host": {"container": True},
-        "inputs": {"evidence_path": evidence, "evidence_tree_sha256": ev_hash, "file_count": ev_files, "profile": profile, "profile_sha256": prof_hash},
+        "inputs": {"evidence_path": evidence, "evidence_tree_sha256": ev_hash, "evidence_tree_algorithm": evidence_manifest.MERKLE_ALGORITHM, "file_count": ev_files, "profile": profile, "profile_sha256": prof_hash},
         "environment": {"user": os.getenv("USER","runner")},
         "tool_versions": tool_versions(),
+        "build": {
+            "manifest": build.get("manifest"),
+            "manifest_sha256": build.get("manifest_sha256"),
+            "sbom": build.get("sbom"),
+            "integrity": {k: build.get(k) for k in ("status", "files", "changed", "missing", "error", "wall_s") if k in build},
+        },
+        # Performance-only settings: they change wall-clock time, not results.
+        "performance": {"timeline": timeline.extraction_settings(profile_data.get("timeline") or {})},
         "rules": {"dir": rules_dir, "sha256_tree": rules_hash, "file_count": rules_files},
         "outputs": {
             "plaso": "timeline.plaso",
             "events_jsonl": "events.jsonl",
-            "sigma_findings": "sigma_findings.json",
-            "yara_hits": "yara_hits.json",
+            "sigma_findings": "sigma_findings.jsonl",
+            "yara_hits": "yara_hits.jsonl",
+            "evidence_manifest": "evidence_manifest.jsonl",
+            "evidence_merkle": evidence_manifest.MERKLE_NAME,
         }
     }
 
@@ -76,13 +102,9 @@ def generate(evidence, profile, outdir):
     with open(out_json,"w") as f:
         json.dump(prov, f, indent=2)
 
-    # Optional SBOM of runtime filesystem, if syft exists
-    if shutil_which("syft"):
-        sbom_path = os.path.join(outdir, "sbom.syft.json")
-        # Use filesystem mode for container root
-        cmd = f"syft dir:/ -o json --exclude /evidence --exclude /out --exclude /proc --exclude /sys --exclude /dev"
-        out = _run(cmd)
-        if out:
-            with open(sbom_path,"w") as f: f.write(out)
+    # Optional per-run SBOM (slow: scans the whole filesystem); the image's
+    # build-time SBOM is referenced above instead.
+    if pcfg.get("runtime_sbom") and shutil_which("syft"):
+        integrity.write_sbom(os.path.join(outdir, "sbom.syft.json"))
 
     return out_json
@@ -1,5 +1,8 @@
 import os, json, datetime
 from jinja2 import Template
+from rich import print
+from src.pipeline import eventstore, plasostore, reportpages, timeline
+from src.pipeline.detections import iter_jsonl, load_event
 
 TEMPLATE = """<!doctype html>
 <html><head><meta charset="utf-8"><title>DFIRBox Report</title>
@@ -15,28 +18,76 @@ table{border-collapse:collapse;width:100%} th,td{border:1px solid #ddd;padding:6
 <div class="meta">Generated: {{ now }} | Profile: {{ meta.profile }} | Evidence: {{ meta.evidence }}</div>
 
 <section><h2>Summary</h2>
+{% if viewer %}<p>All findings: <a href="{{ viewer }}">findings viewer</a> (paged, with facets and search).</p>{% endif %}
 <ul>
 <li>Total events (JSONL): {{ summary.events }}</li>
 <li>Sigma matches: {{ summary.sigma }}</li>
+{% if summary.sigma_evtx is not none %}<li>Sigma matches (EVTX): {{ summary.sigma_evtx }}</li>{% endif %}
 <li>YARA hits: {{ summary.yara }}</li>
+{% if meta.memory_yara and meta.memory_yara.context %}<li>Memory YARA hits: {{ meta.memory_yara.stats.hits }} (<a href="memprocfs_hit_context.json">process context</a>)</li>{% endif %}
+{% if hayabusa %}<li>Hayabusa detections: {{ hayabusa.total_events }}</li>{% endif %}
 </ul></section>
 
+{% if timing %}
+<section><h2>Timing</h2>
+<table>
+<tr><th>Stage</th><th>Status</th><th>Wall (s)</th><th>Thread CPU (s)</th><th>Subprocess CPU (s)</th><th>Peak RSS (MiB)</th><th>Read (MiB)</th><th>Written (MiB)</th><th>Items</th></tr>
+{% for row in timing %}
+<tr><td>{{ row.name }}</td><td>{{ row.status }}</td><td>{{ row.wall_s }}</td><td>{{ row.thread_cpu_s }}</td><td>{{ row.sub_cpu_s }}</td><td>{{ row.max_rss_mib }}</td><td>{{ row.read_mib }}</td><td>{{ row.write_mib }}</td><td class="small">{{ row.counts }}</td></tr>
+{% endfor %}
+</table>
+<div class="small">Read/written are process-wide deltas over each stage window plus its subprocesses; concurrent stages overlap. See <a href="metrics.json">metrics.json</a>.</div>
+</section>
+{% endif %}
+
 <section><h2>Provenance</h2>
 <pre class="small">{{ provenance | tojson(indent=2) }}</pre>
 </section>
 
+{% if hayabusa %}
+<section><h2>Hayabusa</h2>
+<table>
+<tr><th>Level</th><th>Detections</th></tr>
+{% for level, n in hayabusa.hits_by_level.items() %}<tr><td>{{ level }}</td><td>{{ n }}</td></tr>{% endfor %}
+</table>
+<h3>Top rules ({{ hayabusa.distinct_rules }} distinct)</h3>
+<table>
+<tr><th>Rule</th><th>Detections</th></tr>
+{% for row in hayabusa.top_rules %}<tr><td>{{ row.name }}</td><td>{{ row.count }}</td></tr>{% endfor %}
+</table>
+<h3>Top computers ({{ hayabusa.distinct_computers }} distinct)</h3>
+<table>
+<tr><th>Computer</th><th>Detections</th></tr>
+{% for row in hayabusa.top_computers %}<tr><td>{{ row.name }}</td><td>{{ row.count }}</td></tr>{% endfor %}
+</table>
+<h3>Detections per hour</h3>
+<table>
+<tr><th>Hour</th><th>Detections</th></tr>
+{% for hour, n in hayabusa.hits_by_hour.items() %}<tr><td>{{ hour }}</td><td>{{ n }}</td></tr>{% endfor %}
+</table>
+<div class="small">See <a href="hayabusa_out/hayabusa_timeline.jsonl">hayabusa_timeline.jsonl</a>.</div>
+</section>
+{% endif %}
+
 <section><h2>Sigma Matches (top 20)</h2>
 <pre class="small">{{ sigma_preview }}</pre></section>
 
+{% if sigma_evtx_preview %}
+<section><h2>Sigma Matches on EVTX (top 20)</h2>
+<pre class="small">{{ sigma_evtx_preview }}</pre></section>
+{% endif %}
+
 <section><h2>YARA Hits (top 50)</h2>
 <pre class="small">{{ yara_preview }}</pre></section>
 
 <section><h2>Artifacts</h2>
 <ul>
 <li><a href="events.jsonl">events.jsonl</a></li>
-<li><a href="sigma_findings.json">sigma_findings.json</a></li>
-<li><a href="yara_hits.json">yara_hits.json</a></li>
+<li><a href="sigma_findings.jsonl">sigma_findings.jsonl</a></li>
+<li><a href="yara_hits.jsonl">yara_hits.jsonl</a></li>
+{% if summary.sigma_evtx is not none %}<li><a href="sigma_evtx_findings.jsonl">sigma_evtx_findings.jsonl</a></li>{% endif %}
 <li><a href="provenance.json">provenance.json</a></li>
+<li><a href="metrics.json">metrics.json</a></li>
 <li><a href="timeline.plaso">timeline.plaso</a></li>
 <li><a href="plaso.log">plaso.log</a></li>
 </ul></section>
@@ -49,23 +100,123 @@ def _safe_load_json(path, default):
     except Exception:
         return default
 
-def build(outdir, jsonl_events, sigma_path, yara_path, provenance_path, meta):
+def _count_lines(path):
+    n = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            n += chunk.count(b"\n")
+    return n
+
+def _stream_summary(path, preview, sink=None):
+    """Count records in a JSONL findings file while keeping only the first `preview` (and feeding `sink`)."""
+    head, count = [], 0
+    for rec in iter_jsonl(path):
+        if count < preview:
+            head.append(rec)
+        count += 1
+        if sink is not None:
+            sink(rec)
+    return count, head
+
+def _mib(n):
+    return round(n / (1024 * 1024), 1) if n is not None else None
+
+def _timing_rows(metrics, stage_meta):
+    """Flatten metrics.json stages (joined with scheduler status) into table rows."""
+    rows = []
+    for name, m in (metrics.get("stages") or {}).items():
+        subs = m.get("subprocesses") or []
+        window = m.get("process_window") or {}
+        read = (window.get("read_bytes") or 0) + sum(p.get("read_bytes", 0) for p in subs)
+        written = (window.get("write_bytes") or 0) + sum(p.get("write_bytes", 0) for p in subs)
+        rows.append({
+            "name": name,
+            "status": (stage_meta.get(name) or {}).get("status", "ok"),
+            "wall_s": m.get("wall_s"),
+            "thread_cpu_s": m.get("thread_cpu_s"),
+            "sub_cpu_s": round(sum(p.get("cpu_s", 0) for p in subs), 3),
+            "max_rss_mib": _mib(max(p.get("max_rss_kb", 0) for p in subs) * 1024) if subs else "",
+            "read_mib": _mib(read),
+            "write_mib": _mib(written),
+            "counts": ", ".join(f"{k}={v}" for k, v in sorted((m.get("items") or {}).items())),
+        })
+    return rows
+
+def _index_count(outdir):
+    """Event count from a fresh timeline.index (per-block counts), else None."""
+    index = timeline.load_index(os.path.join(outdir, timeline.INDEX_NAME))
+    if not index:
+        return None
+    return sum(b[2] for b in index["blocks"])
+
+def build(outdir, jsonl_events, sigma_path, yara_path, provenance_path, meta, metrics_path=None,
+          hayabusa_summary_path=None, sigma_evtx_path=None, cfg=None):
+    """
+    Write dfirbox_report.html/.json. With report.mode: paged, the same pass
+    over each findings file also pages every finding (plus the Hayabusa
+    timeline and memory YARA hits) into report_data/ for dfirbox_viewer.html.
+    """
+    cfg = cfg or {}
+    pager = reportpages.Pager(outdir, cfg, jsonl_events) if cfg.get("mode") == "paged" else None
+    sink = pager.sink if pager is not None else (lambda kind: None)
+
     events_count = 0
-    if os.path.exists(jsonl_events):
-        with open(jsonl_events,"r") as f:
-            events_count = sum(1 for _ in f)
+    index_count = _index_count(outdir) if os.path.exists(jsonl_events) else None
+    if index_count is not None:
+        events_count = index_count
+    elif eventstore.exists(outdir):
+        # Row counts live in the Parquet footers: no pass over the events.
+        try:
+            events_count = eventstore.count(eventstore.store_path(outdir))
+        except Exception as e:
+            print(f"[yellow]Report: could not count events in the event store: {e}[/yellow]")
+            events_count = _count_lines(jsonl_events) if os.path.exists(jsonl_events) else 0
+    elif os.path.exists(jsonl_events) and os.path.getsize(jsonl_events):
+        events_count = _count_lines(jsonl_events)
+    elif os.path.exists(os.path.join(outdir, "timeline.plaso")):
+        # timeline.export: none leaves events in the Plaso storage file only.
+        try:
+            events_count = plasostore.count(os.path.join(outdir, "timeline.plaso"))
+        except Exception as e:
+            print(f"[yellow]Report: could not count events in timeline.plaso: {e}[/yellow]")
+
+    sigma_count, sigma_head = _stream_summary(sigma_path, 20, sink("sigma"))
+    yara_count, yara_head = _stream_summary(yara_path, 50, sink("yara"))
+    sigma_evtx_count, sigma_evtx_head = _stream_summary(sigma_evtx_path, 20, sink("sigma_evtx")) if sigma_evtx_path else (None, [])
+    viewer = None
+    if pager is not None:
+        extra = [("memory_yara", (meta.get("memory_yara") or {}).get("hits_jsonl"))]
+        if hayabusa_summary_path:
+            extra.append(("hayabusa", os.path.join(os.path.dirname(hayabusa_summary_path), "hayabusa_timeline.jsonl")))
+        for kind, path in extra:
+            if path and os.path.exists(path):
+                _stream_summary(path, 0, sink(kind))
+        viewer = os.path.basename(pager.close())
 
-    sigma = _safe_load_json(sigma_path, [])
-    yara  = _safe_load_json(yara_path, [])
     prov  = _safe_load_json(provenance_path, {})
+    metrics = _safe_load_json(metrics_path, {}) if metrics_path else {}
+    # Counted while the Hayabusa shards were merged; the timeline is not re-read.
+    hayabusa = _safe_load_json(hayabusa_summary_path, None) if hayabusa_summary_path else None
+
+    # Offset references are a single seek, so resolve them for the preview.
+    for finding in sigma_head:
+        if "event_offset" in finding and os.path.exists(jsonl_events):
+            try:
+                finding["event"] = load_event(jsonl_events, finding)
+            except Exception:
+                pass
 
     html = Template(TEMPLATE).render(
         now=str(datetime.datetime.utcnow()),
         meta=meta,
-        summary={"events": events_count, "sigma": len(sigma), "yara": len(yara)},
+        summary={"events": events_count, "sigma": sigma_count, "sigma_evtx": sigma_evtx_count, "yara": yara_count},
         provenance=prov,
-        sigma_preview=json.dumps(sigma[:20], indent=2),
-        yara_preview=json.dumps(yara[:50], indent=2),
+        timing=_timing_rows(metrics, meta.get("stages") or {}),
+        hayabusa=hayabusa,
+        viewer=viewer,
+        sigma_preview=json.dumps(sigma_head, indent=2),
+        yara_preview=json.dumps(yara_head, indent=2),
+        sigma_evtx_preview=json.dumps(sigma_evtx_head, indent=2) if sigma_evtx_head else "",
     )
 
     out_html = os.path.join(outdir, "dfirbox_report.html")
@@ -74,8 +225,11 @@ def build(outdir, jsonl_events, sigma_path, yara_path, provenance_path, meta):
     with open(os.path.join(outdir, "dfirbox_report.json"), "w") as f:
         json.dump({
             "events": events_count,
-            "sigma_matches": len(sigma),
-            "yara_hits": len(yara),
+            "sigma_matches": sigma_count,
+            "sigma_evtx_matches": sigma_evtx_count,
+            "yara_hits": yara_count,
+            "viewer": viewer,
+            "hayabusa": {k: v for k, v in hayabusa.items() if k not in ("source_dirs", "shards")} if hayabusa else None,
             "meta": meta
         }, f, indent=2)
 
@@ -0,0 +1,342 @@
+import datetime
+import json
+import os
+import shutil
+from typing import Any, Callable, Dict, List, Optional
+
+from rich import print
+
+from src.pipeline.timeline import event_timestamp
+
+
+DATA_DIR = "report_data"
+VIEWER_NAME = "dfirbox_viewer.html"
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_FACET_VALUES = 1000
+FACETS = ("rule", "level", "host", "hour")
+COLUMNS = ("rule", "level", "host", "time", "record")
+OTHER = "(other)"
+
+# Pages are JavaScript files that hand their rows to the viewer
+# (DFIRBOX.page(kind, n, rows)): a file:// page can load <script> tags but
+# not fetch() JSON, and the viewer has to work from an unzipped output dir.
+_PAGE_CALL = "DFIRBOX.page({kind},{n},"
+_MANIFEST_CALL = "DFIRBOX.manifest("
+
+
+def _iso(ts_us: Optional[int]) -> Optional[str]:
+    if ts_us is None:
+        return None
+    try:
+        return datetime.datetime.fromtimestamp(ts_us / 1e6, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def _event_host_time(ev: Any):
+    """(host, ISO time) of a Plaso event or an EVTX {System, EventData} record."""
+    if not isinstance(ev, dict):
+        return None, None
+    system = ev.get("System")
+    if isinstance(system, dict):
+        created = system.get("TimeCreated")
+        return system.get("Computer"), created.get("SystemTime") if isinstance(created, dict) else None
+    return ev.get("hostname") or ev.get("computer_name"), _iso(event_timestamp(ev))
+
+
+def _sigma_row(rec: Dict[str, Any]):
+    host, ts = _event_host_time(rec.get("event"))
+    return rec.get("rule"), rec.get("level"), host, ts
+
+
+def _yara_row(rec: Dict[str, Any]):
+    meta = rec.get("meta") or {}
+    level = meta.get("severity") or meta.get("level") if isinstance(meta, dict) else None
+    return rec.get("rule"), level, None, None
+
+
+def _hayabusa_row(rec: Dict[str, Any]):
+    ts = rec.get("Timestamp")
+    return rec.get("RuleTitle"), rec.get("Level"), rec.get("Computer"), ts.replace(" ", "T", 1) if isinstance(ts, str) else ts
+
+
+# kind -> (title, row extractor)
+KINDS: Dict[str, Any] = {
+    "sigma": ("Sigma", _sigma_row),
+    "sigma_evtx": ("Sigma (EVTX)", _sigma_row),
+    "hayabusa": ("Hayabusa", _hayabusa_row),
+    "yara": ("YARA", _yara_row),
+    "memory_yara": ("YARA (memory)", _yara_row),
+}
+
+
+class _Kind:
+    """Page buffer and facet counts for one kind of finding."""
+
+    def __init__(self, root: str, kind: str, page_size: int, max_values: int):
+        self.kind = kind
+        self.dir = os.path.join(root, kind)
+        os.makedirs(self.dir, exist_ok=True)
+        self.page_size = page_size
+        self.max_values = max_values
+        self.rows: List[list] = []
+        self.pages = 0
+        self.count = 0
+        # facet -> value -> [count, [page numbers]]
+        self.facets: Dict[str, Dict[str, list]] = {f: {} for f in FACETS}
+
+    def add(self, row: list) -> None:
+        page = self.pages
+        hour = row[3][:13] if isinstance(row[3], str) and len(row[3]) >= 13 else None
+        for name, value in zip(FACETS, (row[0], row[1], row[2], hour)):
+            if value is None or value == "":
+                continue
+            table = self.facets[name]
+            key = str(value)
+            if key not in table and len(table) >= self.max_values:
+                key = OTHER
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = [0, []]
+            entry[0] += 1
+            if not entry[1] or entry[1][-1] != page:
+                entry[1].append(page)
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) >= self.page_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        path = os.path.join(self.dir, f"page-{self.pages:05d}.js")
+        with open(path, "w") as f:
+            f.write(_PAGE_CALL.format(kind=json.dumps(self.kind), n=self.pages))
+            json.dump(self.rows, f, separators=(",", ":"))
+            f.write(");\n")
+        self.pages += 1
+        self.rows = []
+
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            "title": KINDS[self.kind][0],
+            "count": self.count,
+            "pages": self.pages,
+            "page_size": self.page_size,
+            "facets": {name: {k: v for k, v in sorted(t.items(), key=lambda kv: (-kv[1][0], kv[0]))}
+                       for name, t in self.facets.items()},
+        }
+
+
+class Pager:
+    """
+    Streams findings into report_data/<kind>/page-NNNNN.js and a facet manifest.
+
+    Memory is one page of rows per kind plus the facet tables (at most
+    max_facet_values values each, the rest counted as "(other)"); each
+    facet value lists the pages it occurs on so the viewer only loads
+    those. Sigma findings that reference events.jsonl by offset are
+    resolved with one seek so pages are self-contained.
+    """
+
+    def __init__(self, outdir: str, cfg: Optional[Dict[str, Any]] = None, jsonl_events: Optional[str] = None):
+        cfg = cfg or {}
+        self.outdir = outdir
+        self.root = os.path.join(outdir, DATA_DIR)
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root)
+        self.page_size = max(1, int(cfg.get("page_size", DEFAULT_PAGE_SIZE)))
+        self.max_values = max(1, int(cfg.get("max_facet_values", DEFAULT_MAX_FACET_VALUES)))
+        self.kinds: Dict[str, _Kind] = {}
+        self._events = open(jsonl_events, "rb") if jsonl_events and os.path.exists(jsonl_events) else None
+
+    def sink(self, kind: str) -> Callable[[Dict[str, Any]], None]:
+        """Callable taking one finding record of `kind`."""
+        k = self.kinds.get(kind)
+        if k is None:
+            k = self.kinds[kind] = _Kind(self.root, kind, self.page_size, self.max_values)
+        extract = KINDS[kind][1]
+
+        def add(rec: Dict[str, Any]) -> None:
+            if self._events is not None and "event" not in rec and "event_offset" in rec:
+                try:
+                    self._events.seek(int(rec["event_offset"]))
+                    rec = dict(rec, event=json.loads(self._events.readline()))
+                except Exception:
+                    pass
+            k.add(list(extract(rec)) + [rec])
+        return add
+
+    def close(self) -> str:
+        """Flush the last pages and write the manifest and viewer; returns the viewer path."""
+        if self._events is not None:
+            self._events.close()
+        for k in self.kinds.values():
+            k.flush()
+        manifest = {"columns": list(COLUMNS), "facets": list(FACETS),
+                    "kinds": {name: k.manifest() for name, k in self.kinds.items()}}
+        with open(os.path.join(self.root, "manifest.js"), "w") as f:
+            f.write(_MANIFEST_CALL)
+            json.dump(manifest, f, separators=(",", ":"))
+            f.write(");\n")
+        viewer = os.path.join(self.outdir, VIEWER_NAME)
+        with open(viewer, "w") as f:
+            f.write(VIEWER)
+        total = sum(k.count for k in self.kinds.values())
+        pages = sum(k.pages for k in self.kinds.values())
+        print(f"[green]Report: {total} findings paged into {pages} pages under {self.root}[/green]")
+        return viewer
+
+
+VIEWER = """<!doctype html>
+<html><head><meta charset="utf-8"><title>DFIRBox Findings</title>
+<style>
+body{font-family:system-ui,Arial,sans-serif;margin:0;display:flex;flex-direction:column;height:100vh}
+header{padding:8px 16px;border-bottom:1px solid #ddd}
+header select,header input{margin-right:8px}
+#tabs button{margin-right:4px} #tabs button.on{font-weight:bold}
+main{flex:1;display:flex;min-height:0}
+#list{flex:3;overflow-y:auto;position:relative;border-right:1px solid #ddd}
+#spacer{position:relative}
+.row{position:absolute;left:0;right:0;height:24px;line-height:24px;white-space:nowrap;overflow:hidden;
+     font-size:13px;padding:0 8px;border-bottom:1px solid #f0f0f0;cursor:pointer}
+.row span{display:inline-block;overflow:hidden;text-overflow:ellipsis;vertical-align:top;padding-right:8px}
+.row:hover{background:#f6f8fa} .row.sel{background:#e8f0fe}
+#detail{flex:2;overflow:auto;margin:0;padding:8px;font-size:12px;background:#f6f8fa}
+#status{color:#666;font-size:12px}
+</style></head><body>
+<header>
+<div id="tabs"></div>
+<div>
+<select id="facet"></select><select id="value"><option value="">(all)</option></select>
+<input id="search" placeholder="search (loads pages as it goes)" size="40">
+<span id="status"></span>
+</div>
+</header>
+<main><div id="list"><div id="spacer"></div></div><pre id="detail"></pre></main>
+<script>
+var ROW_H = 24, MAX_PAGES = 64;
+var DFIRBOX = {
+  m: null, kind: null, cache: {}, order: [], waiting: {},
+  manifest: function (m) { this.m = m; },
+  page: function (kind, n, rows) {
+    var key = kind + "/" + n;
+    this.cache[key] = rows; this.order.push(key);
+    while (this.order.length > MAX_PAGES) { delete this.cache[this.order.shift()]; }
+    (this.waiting[key] || []).forEach(function (cb) { cb(rows); });
+    delete this.waiting[key];
+  },
+  load: function (kind, n, cb) {
+    var key = kind + "/" + n;
+    if (this.cache[key]) { cb(this.cache[key]); return; }
+    if (this.waiting[key]) { this.waiting[key].push(cb); return; }
+    this.waiting[key] = [cb];
+    var s = document.createElement("script");
+    s.src = "report_data/" + kind + "/page-" + String(n).padStart(5, "0") + ".js";
+    s.onload = function () { s.remove(); };
+    document.body.appendChild(s);
+  }
+};
+</script>
+<script src="report_data/manifest.js"></script>
+<script>
+(function () {
+  var D = DFIRBOX, $ = function (id) { return document.getElementById(id); };
+  var list = $("list"), spacer = $("spacer"), view = null, gen = 0;
+  if (!D.m) { $("status").textContent = "report_data/manifest.js not found"; return; }
+
+  function info() { return D.m.kinds[D.kind]; }
+  function cols(row) {
+    return '<span style="width:30%">' + esc(row[0]) + '</span><span style="width:8%">' + esc(row[1]) +
+      '</span><span style="width:20%">' + esc(row[2]) + '</span><span style="width:25%">' + esc(row[3]) + '</span>';
+  }
+  function esc(v) {
+    return v == null ? "" : String(v).replace(/[&<>"]/g, function (c) { return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c]; });
+  }
+
+  // A view is either every row (rows addressed by index) or the matches of
+  // a facet/search filter, collected page by page into [page, idx] refs.
+  function reset() {
+    gen++;
+    var k = info(), facet = $("facet").value, value = $("value").value, q = $("search").value.toLowerCase();
+    if (!value && !q) { view = {all: true, n: k.count}; render(); status(); return; }
+    var fi = D.m.facets.indexOf(facet), known = k.facets[facet] || {}, pages;
+    if (value) { pages = ((k.facets[facet] || {})[value] || [0, []])[1]; }
+    else { pages = []; for (var p = 0; p < k.pages; p++) pages.push(p); }
+    view = {all: false, refs: [], n: 0, scanned: 0, total: pages.length};
+    var mine = gen, i = 0, kind = D.kind;
+    (function next() {
+      if (mine !== gen || i >= pages.length) { status(); return; }
+      var p = pages[i++];
+      D.load(kind, p, function (rows) {
+        if (mine !== gen) return;
+        rows.forEach(function (row, idx) {
+          if (value) {
+            var v = fi === 3 ? (row[3] || "").slice(0, 13) : row[fi];
+            if (value === "(other)" ? (v == null || String(v) in known) : String(v) !== value) return;
+          }
+          if (q && JSON.stringify(row[4]).toLowerCase().indexOf(q) < 0) return;
+          view.refs.push([p, idx]);
+        });
+        view.n = view.refs.length; view.scanned = i;
+        render(); status(); next();
+      });
+    })();
+  }
+  function status() {
+    var k = info();
+    $("status").textContent = view.all ? k.count + " findings" :
+      view.n + " matches (" + view.scanned + "/" + view.total + " pages scanned)";
+  }
+  function ref(i) {
+    if (view.all) { var ps = info().page_size; return [Math.floor(i / ps), i % ps]; }
+    return view.refs[i];
+  }
+  function render() {
+    spacer.style.height = (view.n * ROW_H) + "px";
+    var first = Math.floor(list.scrollTop / ROW_H), last = Math.min(view.n, first + Math.ceil(list.clientHeight / ROW_H) + 5);
+    spacer.innerHTML = "";
+    for (var i = first; i < last; i++) (function (i) {
+      var r = ref(i), div = document.createElement("div");
+      div.className = "row"; div.style.top = (i * ROW_H) + "px"; div.textContent = "…";
+      spacer.appendChild(div);
+      D.load(D.kind, r[0], function (rows) {
+        var row = rows[r[1]];
+        div.innerHTML = cols(row);
+        div.onclick = function () {
+          Array.prototype.forEach.call(spacer.querySelectorAll(".sel"), function (e) { e.classList.remove("sel"); });
+          div.classList.add("sel");
+          $("detail").textContent = JSON.stringify(row[4], null, 2);
+        };
+      });
+    })(i);
+  }
+  function facetValues() {
+    var sel = $("value"), t = (info().facets[$("facet").value]) || {};
+    sel.innerHTML = '<option value="">(all)</option>';
+    Object.keys(t).forEach(function (v) {
+      var o = document.createElement("option"); o.value = v; o.textContent = v + " (" + t[v][0] + ")"; sel.appendChild(o);
+    });
+  }
+  function choose(kind) {
+    D.kind = kind;
+    Array.prototype.forEach.call($("tabs").children, function (b) { b.className = b.dataset.kind === kind ? "on" : ""; });
+    facetValues(); list.scrollTop = 0; $("detail").textContent = ""; reset();
+  }
+
+  D.m.facets.forEach(function (f) { var o = document.createElement("option"); o.value = o.textContent = f; $("facet").appendChild(o); });
+  Object.keys(D.m.kinds).forEach(function (kind) {
+    var b = document.createElement("button"); b.dataset.kind = kind;
+    b.textContent = D.m.kinds[kind].title + " (" + D.m.kinds[kind].count + ")";
+    b.onclick = function () { choose(kind); }; $("tabs").appendChild(b);
+  });
+  $("facet").onchange = function () { facetValues(); reset(); };
+  $("value").onchange = reset;
+  var timer; $("search").oninput = function () { clearTimeout(timer); timer = setTimeout(reset, 300); };
+  list.onscroll = function () { if (view) render(); };
+  var kinds = Object.keys(D.m.kinds);
+  if (kinds.length) choose(kinds[0]); else $("status").textContent = "no findings";
+})();
+</script>
+</body></html>
+"""
@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from rich import print
+
+
+class Stage:
+    """
+    A pipeline stage: fn(results) -> result, run once all deps have succeeded.
+
+    key is the stage's content address (see stagecache.stage_key); stages
+    without a key always run.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 key: Optional[str] = None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.key = key
+
+
+def _dependents(stages: Dict[str, Stage], name: str) -> List[str]:
+    """Every stage that transitively depends on `name`."""
+    out: List[str] = []
+    frontier = [name]
+    while frontier:
+        cur = frontier.pop()
+        for s in stages.values():
+            if cur in s.deps and s.name not in out:
+                out.append(s.name)
+                frontier.append(s.name)
+    return out
+
+
+def run_stages(stages: List[Stage], max_workers: int = 4, meta: Optional[Dict[str, Any]] = None,
+               cache=None, metrics=None) -> Dict[str, Any]:
+    """
+    Run stages concurrently as their dependencies complete.
+
+    At most max_workers stages run at once. A failing stage only cancels the
+    stages that depend on it; everything else still runs. Per-stage
+    start/end/duration/status are recorded in meta["stages"]. With a
+    StageCache, a keyed stage whose previous outputs are still valid is not
+    rerun (status "cached"). With a metrics.Metrics, each stage runs inside
+    its accounting context.
+    Returns {stage name: result} for the stages that succeeded.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"stage {s.name} depends on unknown stage(s) {missing}")
+
+    timings: Dict[str, Dict[str, Any]] = {}
+    if meta is not None:
+        meta["stages"] = timings
+
+    results: Dict[str, Any] = {}
+    done: set = set()
+    skipped: set = set()
+    running: Dict[Any, str] = {}
+    started: Dict[str, float] = {}
+
+    def _call(stage: Stage):
+        if metrics is None:
+            return _run_one(stage)
+        with metrics.stage(stage.name):
+            return _run_one(stage)
+
+    def _run_one(stage: Stage):
+        if cache is not None and stage.key:
+            hit, result = cache.lookup(stage.name, stage.key)
+            if hit:
+                return "cached", result
+            cache.invalidate(stage.name)
+        result = stage.fn(results)
+        if cache is not None and stage.key:
+            cache.record(stage.name, stage.key, result)
+        return "ok", result
+
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as pool:
+        while True:
+            for s in stages:
+                if s.name in done or s.name in skipped or s.name in started:
+                    continue
+                if len(running) >= max(1, int(max_workers)):
+                    break
+                if all(d in results for d in s.deps):
+                    started[s.name] = time.time()
+                    timings[s.name] = {"start": round(started[s.name], 3), "deps": list(s.deps), "status": "running"}
+                    running[pool.submit(_call, s)] = s.name
+
+            if not running:
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                end = time.time()
+                t = timings[name]
+                t["end"] = round(end, 3)
+                t["duration_s"] = round(end - started[name], 3)
+                done.add(name)
+                try:
+                    t["status"], results[name] = fut.result()
+                    if t["status"] == "cached":
+                        print(f"[cyan]Stage {name}: outputs up to date, skipped[/cyan]")
+                except Exception as e:
+                    t["status"] = "failed"
+                    t["error"] = str(e)
+                    print(f"[red]Stage {name} failed: {e}[/red]")
+                    for dep in _dependents(by_name, name):
+                        if dep not in done and dep not in skipped:
+                            skipped.add(dep)
+                            timings[dep] = {"deps": list(by_name[dep].deps), "status": "skipped",
+                                            "reason": f"dependency {name} failed"}
+                            print(f"[yellow]Stage {dep} skipped: dependency {name} failed[/yellow]")
+
+    return results
@@ -0,0 +1,609 @@
+import fnmatch
+import ipaddress
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import yaml
+from rich import print
+
+
+# Index keys: ("f", field) means "field must be present",
+# ("v", field, value) means "field must equal value" (lowercased).
+Key = Tuple[str, ...]
+Keys = Optional[FrozenSet[Key]]
+
+_SUPPORTED_MODIFIERS = {
+    "contains", "startswith", "endswith", "all", "re", "i", "m", "s",
+    "exists", "cidr", "gt", "gte", "lt", "lte",
+}
+
+
+class UnsupportedModifier(ValueError):
+    """A rule uses a value modifier the engine does not implement (windash, base64offset, ...)."""
+
+    def __init__(self, modifiers: List[str], spec: str):
+        super().__init__(f"unsupported modifier(s) {modifiers} on {spec}")
+        self.modifiers = modifiers
+
+
+def _dig(d, dotted):
+    """Resolve a Sigma field name against an event: literal key first, then dotted path."""
+    if isinstance(d, dict) and dotted in d:
+        return d[dotted]
+    cur = d
+    for part in dotted.split('.'):
+        if isinstance(cur, dict) and part in cur:
+            cur = cur[part]
+        else:
+            return None
+    return cur
+
+
+def _as_str(v: Any) -> str:
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return str(v)
+
+
+class EventView:
+    """Per-event field cache so each field is dug and lowercased at most once."""
+
+    __slots__ = ("event", "_raw", "_low", "_strings")
+
+    def __init__(self, event: dict):
+        self.event = event
+        self._raw: Dict[str, Any] = {}
+        self._low: Dict[str, Optional[Tuple[str, ...]]] = {}
+        self._strings: Optional[List[str]] = None
+
+    def raw(self, field: str) -> Any:
+        try:
+            return self._raw[field]
+        except KeyError:
+            v = self._raw[field] = _dig(self.event, field)
+            return v
+
+    def lowered(self, field: str) -> Optional[Tuple[str, ...]]:
+        try:
+            return self._low[field]
+        except KeyError:
+            pass
+        v = self.raw(field)
+        if v is None:
+            low = None
+        elif isinstance(v, list):
+            low = tuple(_as_str(x).lower() for x in v if x is not None)
+        else:
+            low = (_as_str(v).lower(),)
+        self._low[field] = low
+        return low
+
+    def strings(self) -> List[str]:
+        """All leaf string values, lowercased; used for keyword selections."""
+        if self._strings is None:
+            out: List[str] = []
+            stack = [self.event]
+            while stack:
+                cur = stack.pop()
+                if isinstance(cur, dict):
+                    stack.extend(cur.values())
+                elif isinstance(cur, list):
+                    stack.extend(cur)
+                elif isinstance(cur, str):
+                    out.append(cur.lower())
+            self._strings = out
+        return self._strings
+
+
+# ---------------------------------------------------------------------------
+# Value compilation
+# ---------------------------------------------------------------------------
+
+def _segments(value: str) -> List[Tuple[str, str]]:
+    """Split a Sigma string into ("lit", text) / ("*", "") / ("?", "") segments."""
+    segs: List[Tuple[str, str]] = []
+    buf: List[str] = []
+    i, n = 0, len(value)
+    while i < n:
+        c = value[i]
+        if c == "\\" and i + 1 < n and value[i + 1] in "*?\\":
+            buf.append(value[i + 1])
+            i += 2
+            continue
+        if c in "*?":
+            if buf:
+                segs.append(("lit", "".join(buf)))
+                buf = []
+            segs.append((c, ""))
+        else:
+            buf.append(c)
+        i += 1
+    if buf:
+        segs.append(("lit", "".join(buf)))
+    return segs
+
+
+class _StringSet:
+    """Lowercased string needles grouped by how they can be tested fastest."""
+
+    def __init__(self):
+        self.exact: set = set()
+        self.prefix: List[str] = []
+        self.suffix: List[str] = []
+        self.infix: List[str] = []
+        self.patterns: List[str] = []
+        self.anything = False
+
+    def add(self, value: str, mode: Optional[str]) -> None:
+        segs = _segments(value.lower())
+        if mode in ("contains", "endswith"):
+            segs.insert(0, ("*", ""))
+        if mode in ("contains", "startswith"):
+            segs.append(("*", ""))
+
+        lead = bool(segs) and segs[0][0] == "*"
+        trail = len(segs) > 1 and segs[-1][0] == "*"
+        core = segs[1 if lead else 0:len(segs) - (1 if trail else 0)]
+        if not core and (lead or trail):
+            self.anything = True
+            return
+        if all(k == "lit" for k, _ in core):
+            text = "".join(t for _, t in core)
+            if lead and trail:
+                self.infix.append(text)
+            elif lead:
+                self.suffix.append(text)
+            elif trail:
+                self.prefix.append(text)
+            else:
+                self.exact.add(text)
+            return
+        rx = "".join(re.escape(t) if k == "lit" else (".*" if k == "*" else ".") for k, t in segs)
+        self.patterns.append(rx)
+
+    def compile(self):
+        exact = frozenset(self.exact)
+        prefix = tuple(self.prefix)
+        suffix = tuple(self.suffix)
+        infix = tuple(self.infix)
+        rx = re.compile("(?:" + "|".join(self.patterns) + ")", re.DOTALL) if self.patterns else None
+        anything = self.anything
+
+        def test(s: str) -> bool:
+            if anything or s in exact:
+                return True
+            if prefix and s.startswith(prefix):
+                return True
+            if suffix and s.endswith(suffix):
+                return True
+            for n in infix:
+                if n in s:
+                    return True
+            return rx is not None and rx.fullmatch(s) is not None
+
+        return test
+
+
+def _legacy_value(value: Any, mode: Optional[str]) -> Tuple[Any, Optional[str]]:
+    """Honour the older in-repo "|contains needle" value convention."""
+    if isinstance(value, str) and value.startswith("|contains "):
+        return value.split(" ", 1)[1], "contains"
+    return value, mode
+
+
+def _value_test(value: Any, mode: Optional[str], mods: set):
+    """Compile a single value into a predicate over an EventView field."""
+    if "re" in mods:
+        flags = (re.IGNORECASE if "i" in mods else 0) | (re.MULTILINE if "m" in mods else 0) \
+            | (re.DOTALL if "s" in mods else 0)
+        rx = re.compile(str(value), flags)
+        return "raw", lambda s: rx.search(s) is not None
+    if "cidr" in mods:
+        net = ipaddress.ip_network(str(value), strict=False)
+
+        def in_net(s):
+            try:
+                return ipaddress.ip_address(s) in net
+            except ValueError:
+                return False
+        return "raw", in_net
+    for op in ("gt", "gte", "lt", "lte"):
+        if op in mods:
+            bound = float(value)
+            cmp = {
+                "gt": lambda x: x > bound, "gte": lambda x: x >= bound,
+                "lt": lambda x: x < bound, "lte": lambda x: x <= bound,
+            }[op]
+
+            def num(s, cmp=cmp):
+                try:
+                    return cmp(float(s))
+                except ValueError:
+                    return False
+            return "raw", num
+    value, mode = _legacy_value(value, mode)
+    ss = _StringSet()
+    ss.add(_as_str(value), mode)
+    return "low", ss.compile()
+
+
+class FieldMatcher:
+    """One `field|mod1|mod2: values` entry of a selection."""
+
+    def __init__(self, spec: str, expected: Any):
+        parts = spec.split("|")
+        self.field = parts[0]
+        mods = set(parts[1:])
+        unknown = mods - _SUPPORTED_MODIFIERS
+        if unknown:
+            raise UnsupportedModifier(sorted(unknown), spec)
+        mode = next((m for m in ("contains", "startswith", "endswith") if m in mods), None)
+        values = expected if isinstance(expected, list) else [expected]
+
+        self.keys: Keys = frozenset({("f", self.field)})
+        self.require_all = "all" in mods
+        self.exists: Optional[bool] = None
+        self.any_null = any(v is None for v in values)
+        values = [v for v in values if v is not None]
+
+        if "exists" in mods:
+            self.exists = bool(expected)
+            self.keys = self.keys if self.exists else None
+            self._tests = []
+            return
+        if self.any_null:
+            self.keys = None
+
+        if not mods - {"contains", "startswith", "endswith"}:
+            # Fast path: OR over string needles, one combined predicate.
+            ss = _StringSet()
+            for v in values:
+                v, m = _legacy_value(v, mode)
+                ss.add(_as_str(v), m)
+            self._tests = [("low", ss.compile())]
+            if values and not self.any_null and not ss.anything and ss.exact \
+                    and not (ss.prefix or ss.suffix or ss.infix or ss.patterns):
+                self.keys = frozenset(("v", self.field, e) for e in ss.exact)
+        else:
+            self._tests = [_value_test(v, mode, mods) for v in values]
+
+    def __call__(self, ev: EventView) -> bool:
+        raw = ev.raw(self.field)
+        if self.exists is not None:
+            return (raw is not None) == self.exists
+        if raw is None:
+            return self.any_null
+        if not self._tests:
+            return False
+
+        low = ev.lowered(self.field)
+        items = raw if isinstance(raw, list) else [raw]
+        raws = [_as_str(x) for x in items if x is not None]
+
+        def ok(test):
+            kind, fn = test
+            return any(fn(s) for s in (low if kind == "low" else raws))
+
+        if self.require_all:
+            return all(ok(t) for t in self._tests)
+        return any(ok(t) for t in self._tests)
+
+
+# ---------------------------------------------------------------------------
+# Condition tree
+# ---------------------------------------------------------------------------
+
+class _Node:
+    keys: Keys = None
+
+    def __call__(self, ev: EventView) -> bool:  # pragma: no cover - interface
+        raise NotImplementedError
+
+
+def _pick(options: List[Keys]) -> Keys:
+    """Choose the most selective necessary-key set among AND-ed alternatives."""
+    usable = [k for k in options if k]
+    if not usable:
+        return None
+    return min(usable, key=lambda k: (not all(key[0] == "v" for key in k), len(k)))
+
+
+def _union(options: List[Keys]) -> Keys:
+    if not options or any(k is None for k in options):
+        return None
+    out: set = set()
+    for k in options:
+        out |= k
+    return frozenset(out)
+
+
+class _AllOf(_Node):
+    def __init__(self, children: List[Any]):
+        self.children = children
+        self.keys = _pick([getattr(c, "keys", None) for c in children])
+
+    def __call__(self, ev):
+        for c in self.children:
+            if not c(ev):
+                return False
+        return True
+
+
+class _AnyOf(_Node):
+    def __init__(self, children: List[Any]):
+        self.children = children
+        self.keys = _union([getattr(c, "keys", None) for c in children])
+
+    def __call__(self, ev):
+        for c in self.children:
+            if c(ev):
+                return True
+        return False
+
+
+class _AtLeast(_Node):
+    """`N of ...`: at least n of the children match."""
+
+    def __init__(self, n: int, children: List[Any]):
+        self.n = n
+        self.children = children
+        # at least one child has to match, so any child's keys will do
+        self.keys = _union([getattr(c, "keys", None) for c in children])
+
+    def __call__(self, ev):
+        hits = 0
+        for c in self.children:
+            if c(ev):
+                hits += 1
+                if hits >= self.n:
+                    return True
+        return False
+
+
+class _Not(_Node):
+    def __init__(self, child: _Node):
+        self.child = child
+        self.keys = None
+
+    def __call__(self, ev):
+        return not self.child(ev)
+
+
+class _Keywords(_Node):
+    def __init__(self, words: List[Any]):
+        ss = _StringSet()
+        for w in words:
+            ss.add(_as_str(w), "contains")
+        self.test = ss.compile()
+        self.keys = None
+
+    def __call__(self, ev):
+        return any(self.test(s) for s in ev.strings())
+
+
+def _compile_selection(body: Any) -> _Node:
+    if isinstance(body, dict):
+        return _AllOf([FieldMatcher(k, v) for k, v in body.items()])
+    if isinstance(body, list):
+        if body and all(isinstance(x, dict) for x in body):
+            return _AnyOf([_compile_selection(x) for x in body])
+        return _Keywords(body)
+    return _Keywords([body])
+
+
+def _is_keywords(body: Any) -> bool:
+    if isinstance(body, dict):
+        return False
+    return not (isinstance(body, list) and body and all(isinstance(x, dict) for x in body))
+
+
+def _selection_fields(detection: Dict[str, Any]) -> List[str]:
+    """Field names (without modifiers) referenced by a rule's selections."""
+    fields = set()
+    for name, body in detection.items():
+        if name == "condition":
+            continue
+        for item in body if isinstance(body, list) else [body]:
+            if isinstance(item, dict):
+                fields.update(str(k).split("|")[0] for k in item)
+    return sorted(fields)
+
+
+_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+class _ConditionParser:
+    """Recursive-descent parser for Sigma conditions (and/or/not, N of, parentheses)."""
+
+    def __init__(self, text: str, selections: Dict[str, _Node]):
+        if "|" in text:
+            raise ValueError(f"aggregation conditions are not supported: {text!r}")
+        self.tokens = _TOKEN.findall(text)
+        self.pos = 0
+        self.selections = selections
+
+    def parse(self) -> _Node:
+        node = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"unexpected token {self.tokens[self.pos]!r}")
+        return node
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> str:
+        tok = self._peek()
+        if tok is None:
+            raise ValueError("unexpected end of condition")
+        self.pos += 1
+        return tok
+
+    def _or(self) -> _Node:
+        items = [self._and()]
+        while (self._peek() or "").lower() == "or":
+            self._next()
+            items.append(self._and())
+        return items[0] if len(items) == 1 else _AnyOf(items)
+
+    def _and(self) -> _Node:
+        items = [self._not()]
+        while (self._peek() or "").lower() == "and":
+            self._next()
+            items.append(self._not())
+        return items[0] if len(items) == 1 else _AllOf(items)
+
+    def _not(self) -> _Node:
+        if (self._peek() or "").lower() == "not":
+            self._next()
+            return _Not(self._not())
+        return self._atom()
+
+    def _atom(self) -> _Node:
+        tok = self._next()
+        if tok == "(":
+            node = self._or()
+            if self._next() != ")":
+                raise ValueError("missing closing parenthesis")
+            return node
+        low = tok.lower()
+        if (low in ("all", "any") or low.isdigit()) and (self._peek() or "").lower() == "of":
+            self._next()
+            target = self._next()
+            if target.lower() == "them":
+                names = [n for n in self.selections if not n.startswith("_")]
+            else:
+                names = [n for n in self.selections if fnmatch.fnmatchcase(n, target)]
+            if not names:
+                raise ValueError(f"no selections match {target!r}")
+            nodes = [self.selections[n] for n in names]
+            if low == "all":
+                return _AllOf(nodes)
+            if low in ("any", "1"):
+                return _AnyOf(nodes)
+            return _AtLeast(int(low), nodes)
+        if tok not in self.selections:
+            raise ValueError(f"unknown selection {tok!r}")
+        return self.selections[tok]
+
+
+class SigmaRule:
+    def __init__(self, data: dict, path: str, logsource_map: Optional[Dict[str, Any]] = None):
+        self.title = data.get("title", Path(path).name)
+        self.id = data.get("id")
+        self.level = data.get("level")
+        self.path = path
+        self.logsource = data.get("logsource") or {}
+
+        detection = data.get("detection") or {}
+        self.fields = _selection_fields(detection)
+        self.keywords = any(_is_keywords(v) for k, v in detection.items() if k != "condition")
+        selections = {k: _compile_selection(v) for k, v in detection.items() if k != "condition"}
+        condition = detection.get("condition")
+        if condition is None:
+            if len(selections) != 1:
+                raise ValueError("missing condition")
+            condition = next(iter(selections))
+        conds = condition if isinstance(condition, list) else [condition]
+        parsed = [_ConditionParser(str(c), selections).parse() for c in conds]
+        node = parsed[0] if len(parsed) == 1 else _AnyOf(parsed)
+
+        route = self._logsource_selection(logsource_map or {})
+        self.node: _Node = _AllOf([route, node]) if route is not None else node
+
+    def _logsource_selection(self, logsource_map: Dict[str, Any]) -> Optional[_Node]:
+        """AND the profile's field constraints for this rule's logsource onto the condition."""
+        extra = []
+        for attr in ("product", "category", "service"):
+            name = self.logsource.get(attr)
+            if name and isinstance(logsource_map.get(name), dict):
+                extra.append(_compile_selection(logsource_map[name]))
+        if not extra:
+            return None
+        return extra[0] if len(extra) == 1 else _AllOf(extra)
+
+    @property
+    def keys(self) -> Keys:
+        return self.node.keys
+
+    def matches(self, ev: EventView) -> bool:
+        return self.node(ev)
+
+
+class SigmaEngine:
+    """
+    Compiled rule set with field/value-indexed dispatch.
+
+    Each rule advertises a set of necessary keys (a field that must be present,
+    or a field that must equal a value). An event is only evaluated against
+    rules whose keys it can satisfy; rules without such keys (negations,
+    keyword searches) are always evaluated.
+    """
+
+    def __init__(self, rules: List[SigmaRule], skipped: Optional[Counter] = None, skipped_rules: int = 0):
+        self.rules = rules
+        self.skipped = skipped or Counter()  # unsupported modifier -> rules skipped for it
+        self.skipped_rules = skipped_rules
+        self.unindexed: List[int] = []
+        self.by_field: Dict[str, List[int]] = {}
+        self.by_value: Dict[str, Dict[str, List[int]]] = {}
+        for i, r in enumerate(rules):
+            keys = r.keys
+            if not keys:
+                self.unindexed.append(i)
+                continue
+            for key in keys:
+                if key[0] == "v":
+                    self.by_value.setdefault(key[1], {}).setdefault(key[2], []).append(i)
+                else:
+                    self.by_field.setdefault(key[1], []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def skip_summary(self) -> Optional[str]:
+        if not self.skipped_rules:
+            return None
+        mods = ", ".join(f"{m}: {n}" for m, n in sorted(self.skipped.items()))
+        return f"{self.skipped_rules} rule(s) skipped for unsupported modifiers ({mods})"
+
+    def candidates(self, ev: EventView) -> List[int]:
+        cands = set(self.unindexed)
+        for field, idxs in self.by_field.items():
+            if ev.raw(field) is not None:
+                cands.update(idxs)
+        for field, table in self.by_value.items():
+            low = ev.lowered(field)
+            if low:
+                for s in low:
+                    idxs = table.get(s)
+                    if idxs:
+                        cands.update(idxs)
+        return sorted(cands)
+
+    def match(self, event: dict) -> List[SigmaRule]:
+        ev = EventView(event)
+        return [self.rules[i] for i in self.candidates(ev) if self.rules[i].matches(ev)]
+
+
+def load_rules(rules_dir: str, logsource_map: Optional[Dict[str, Any]] = None,
+               quiet: bool = False) -> SigmaEngine:
+    """Parse and compile every *.yml/*.yaml rule under rules_dir, in path order."""
+    files = sorted(p for p in Path(rules_dir).rglob("*") if p.suffix.lower() in (".yml", ".yaml"))
+    rules, skipped, unsupported = [], Counter(), 0
+    for f in files:
+        try:
+            with open(f, "r") as fh:
+                data = yaml.safe_load(fh) or {}
+            if not isinstance(data, dict) or "detection" not in data:
+                continue
+            rules.append(SigmaRule(data, str(f), logsource_map))
+        except UnsupportedModifier as e:
+            # counted rather than logged one by one; see SigmaEngine.skip_summary
+            unsupported += 1
+            skipped.update(e.modifiers)
+        except Exception as e:
+            if not quiet:
+                print(f"[yellow]Sigma: skipping rule {f}: {e}[/yellow]")
+    return SigmaEngine(rules, skipped, unsupported)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.pipeline import evidence, toolversions
+
+
+STATE_NAME = ".dfirbox_stages.json"
+
+
+def stage_key(name: str, **inputs: Any) -> str:
+    """Content address of a stage: sha256 over its name and canonical JSON inputs."""
+    blob = json.dumps({"stage": name, "inputs": inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def fingerprint_paths(paths: Iterable[Optional[str]]) -> str:
+    """
+    Cheap change detector for large inputs: sha256 over (path, size, mtime_ns)
+    of every file, without reading contents.
+    """
+    m = hashlib.sha256()
+    for p in paths:
+        if not p or not os.path.exists(p):
+            m.update(f"missing {p}\n".encode())
+            continue
+        for _root, path in evidence.iter_files([p]):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            m.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return m.hexdigest()
+
+
+# path -> (fingerprint_paths stamp, digest); rule packs are re-read only when a file changes.
+_TREE_DIGESTS: Dict[str, tuple] = {}
+
+
+def tree_digest(path: str) -> Optional[str]:
+    """Content digest of a small tree such as a rule pack."""
+    if not os.path.exists(path):
+        return None
+    stamp = fingerprint_paths([path])
+    hit = _TREE_DIGESTS.get(path)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    digest = evidence.merkle(evidence.hash_tree(path), path)[0]
+    _TREE_DIGESTS[path] = (stamp, digest)
+    return digest
+
+
+def tool_fingerprint(cmd: str) -> Optional[str]:
+    """Identify an installed tool by its resolved path, size and mtime."""
+    return toolversions.fingerprint(cmd)
+
+
+def section(profile: Dict[str, Any], dotted: str, exclude: Iterable[str] = ()) -> Any:
+    """A profile subsection with performance-only keys removed."""
+    cur: Any = profile
+    for part in dotted.split("."):
+        cur = (cur or {}).get(part) if isinstance(cur, dict) else None
+    if isinstance(cur, dict):
+        cur = {k: v for k, v in cur.items() if k not in set(exclude)}
+    return cur
+
+
+def _paths_in(obj: Any) -> List[str]:
+    if isinstance(obj, str):
+        return [obj]
+    if isinstance(obj, dict):
+        return [p for v in obj.values() for p in _paths_in(v)]
+    if isinstance(obj, (list, tuple)):
+        return [p for v in obj for p in _paths_in(v)]
+    return []
+
+
+class StageCache:
+    """
+    Completed-stage records in outdir/.dfirbox_stages.json.
+
+    A record is dropped before its stage starts and written only after it
+    succeeds, so a run killed mid-stage resumes from the last completed stage
+    and never trusts half-written outputs.
+    """
+
+    def __init__(self, outdir: str):
+        self.outdir = os.path.abspath(outdir)
+        self.path = os.path.join(self.outdir, STATE_NAME)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r") as f:
+                self._state: Dict[str, Any] = json.load(f)
+        except Exception:
+            self._state = {}
+
+    def _save(self) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._state, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def lookup(self, name: str, key: str):
+        """Return (True, result) if the stage completed with this key and its outputs still exist."""
+        with self._lock:
+            rec = self._state.get(name)
+        if not rec or rec.get("key") != key:
+            return False, None
+        for p in _paths_in(rec.get("result")):
+            if os.path.isabs(p) and p.startswith(self.outdir + os.sep) and not os.path.exists(p):
+                return False, None
+        return True, rec.get("result")
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            if self._state.pop(name, None) is not None:
+                self._save()
+
+    def record(self, name: str, key: str, result: Any) -> None:
+        with self._lock:
+            self._state[name] = {"key": key, "result": result, "completed": int(time.time())}
+            self._save()
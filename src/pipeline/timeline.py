@@ -1,14 +1,183 @@
-import os, subprocess, shlex, yaml
+import json, os, platform, queue, shlex, threading, time, yaml
+from typing import Any, Dict, Iterator, List, Optional
 from rich import print
+from src.pipeline import evidence, metrics, plasostore
+
+INDEX_NAME = "timeline.index"
+INDEX_VERSION = 2
+DEFAULT_INDEX_FIELDS = ["data_type", "parser", "EventID", "event_identifier", "filename"]
+
+# date_time.__class_name__ -> (units per second, seconds from 1970 to the epoch of the class)
+_DATE_TIME_CLASSES = {
+    "PosixTime": (1, 0),
+    "PosixTimeInMilliseconds": (1000, 0),
+    "PosixTimeInMicroseconds": (1000000, 0),
+    "PosixTimeInNanoseconds": (1000000000, 0),
+    "Filetime": (10000000, -11644473600),
+}
 
 def _run(cmd, env=None, cwd=None):
     print(f"[cyan]$ {cmd}[/cyan]")
-    p = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env, cwd=cwd)
-    if p.returncode != 0:
-        raise RuntimeError(f"command failed: {cmd}\n{p.stdout}")
-    return p.stdout
+    rc, out = metrics.run_process(shlex.split(cmd), env=env, cwd=cwd)
+    if rc != 0:
+        raise RuntimeError(f"command failed: {cmd}\n{out}")
+    return out
+
+def _read_first(paths):
+    for p in paths:
+        try:
+            with open(p, "r") as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+def _detect_emulation() -> bool:
+    """True when this amd64 userland runs under qemu-user or Rosetta rather than natively."""
+    forced = os.environ.get("DFIRBOX_EMULATED")
+    if forced is not None:
+        return forced.strip().lower() in ("1", "true", "yes")
+    cpuinfo = _read_first(["/proc/cpuinfo"]) or ""
+    if "VirtualApple" in cpuinfo:
+        return True
+    # qemu-user passes the host's ARM cpuinfo through to the emulated process.
+    return platform.machine() in ("x86_64", "AMD64") and "CPU implementer" in cpuinfo
+
+def _available_cpus() -> int:
+    return evidence.available_cpus()
+
+def _available_memory() -> int:
+    limit = evidence.cgroup_limit("memory.max") or _read_first(["/sys/fs/cgroup/memory/memory.limit_in_bytes"])
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    if limit and limit.isdigit():
+        return min(int(limit), total)
+    return total
+
+def extraction_settings(tcfg: dict) -> dict:
+    """
+    Resolve log2timeline process settings from timeline.mode / timeline.workers.
+
+    mode: auto (default) picks single-process under emulation and multi-process
+    natively; workers: "auto" sizes from available cores and cgroup memory.
+    These settings change speed, not results, and are recorded in provenance.
+    """
+    mode = str(tcfg.get("mode", "auto")).lower()
+    emulated = _detect_emulation()
+    if mode == "auto":
+        mode = "single" if emulated else "multi"
+
+    settings = {"mode": mode, "emulated": emulated}
+    if mode == "single":
+        settings["workers"] = 1
+        return settings
+
+    cpus = _available_cpus()
+    memory = _available_memory()
+    per_worker = int(tcfg.get("worker_memory_limit", 2 * 1024**3))
+    workers = tcfg.get("workers", "auto")
+    if workers == "auto":
+        # leave one core for the main/foreman process; keep workers within memory
+        workers = max(1, min(cpus - 1, memory // max(1, per_worker) - 1))
+    settings.update({
+        "workers": int(workers),
+        "worker_memory_limit": per_worker,
+        "process_memory_limit": int(tcfg.get("process_memory_limit", memory)),
+        "available_cpus": cpus,
+        "available_memory": memory,
+    })
+    if tcfg.get("queue_size"):
+        settings["queue_size"] = int(tcfg["queue_size"])
+    return settings
+
+def _psort(plaso_file: str, jsonl_file: str):
+    try:
+        _run(f"psort.py --status_view=none -o json_line -w {jsonl_file} {plaso_file}")
+    except RuntimeError as e:
+        print(f"[yellow]psort failed or produced no output; continuing[/yellow]\n{e}")
+
+def _tail(path: str, done: threading.Event, poll: float = 0.2):
+    """
+    Yield (offset, line number, line) for complete lines of a file that
+    another process or thread is still writing, until `done` is set and the
+    file is drained.
+    """
+    while not os.path.exists(path):
+        if done.is_set():
+            return
+        time.sleep(poll)
+    with open(path, "rb") as f:
+        offset, lineno, partial = 0, 0, b""
+        while True:
+            finished = done.is_set()
+            line = f.readline()
+            if line.endswith(b"\n"):
+                line, partial = partial + line, b""
+                lineno += 1
+                yield offset, lineno, line
+                offset += len(line)
+            elif line:
+                partial += line
+            elif finished:
+                if partial:
+                    yield offset, lineno + 1, partial
+                return
+            else:
+                time.sleep(poll)
+
+def _export_streaming(export: str, plaso_file: str, jsonl_file: str, sink, queue_size: int):
+    """
+    Produce events.jsonl (psort or direct export) in a background thread
+    while tailing it into sink.feed() through a bounded queue.
+
+    The queue applies backpressure to the tailer, so memory stays bounded
+    however far detection falls behind; the sink sees every line in file
+    order, exactly as a later pass over the finished file would.
+    """
+    if os.path.exists(jsonl_file):
+        os.remove(jsonl_file)
+    print(f"[cyan]Timeline: streaming {export} export into detection (queue {queue_size})[/cyan]")
+
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+    done = threading.Event()
+    errors: List[BaseException] = []
+
+    def produce():
+        try:
+            if export == "direct":
+                export_jsonl(plaso_file, jsonl_file, atomic=False)
+            else:
+                _psort(plaso_file, jsonl_file)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def evaluate():
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if not errors:
+                try:
+                    sink.feed(*item)
+                except BaseException as e:
+                    errors.append(e)
+
+    producer = threading.Thread(target=metrics.wrap(produce), name="timeline-export", daemon=True)
+    evaluator = threading.Thread(target=metrics.wrap(evaluate), name="timeline-detect", daemon=True)
+    producer.start()
+    evaluator.start()
+    try:
+        for item in _tail(jsonl_file, done):
+            q.put(item)
+    finally:
+        q.put(None)
+        producer.join()
+        evaluator.join()
+    if errors:
+        raise errors[0]
 
-def make_timeline(evidence_dir: str, outdir: str, profile_path: str):
+def make_timeline(evidence_dir: str, outdir: str, profile_path: str, sink=None):
     with open(profile_path, "r") as f:
         profile = yaml.safe_load(f) or {}
 
@@ -21,23 +190,256 @@ def make_timeline(evidence_dir: str, outdir: str, profile_path: str):
     if isinstance(tcfg.get("parsers"), (str, list)):
         parsers = tcfg["parsers"] if isinstance(tcfg["parsers"], str) else ",".join(tcfg["parsers"])
 
-    # 1) log2timeline: explicit --storage_file, single worker (stable under emulation)
-    base = f"log2timeline.py --status_view=none --single_process --workers 1 --logfile {plaso_log} --storage_file {plaso_file}"
+    # 1) log2timeline: explicit --storage_file; single process under emulation
+    # (the stable choice there), multi-process extraction on native hosts.
+    settings = extraction_settings(tcfg)
+    base = f"log2timeline.py --status_view=none --logfile {plaso_log} --storage_file {plaso_file}"
+    if settings["mode"] == "single":
+        base += " --single_process --workers 1"
+    else:
+        base += f" --workers {settings['workers']} --worker_memory_limit {settings['worker_memory_limit']}"
+        base += f" --process_memory_limit {settings['process_memory_limit']}"
+        if settings.get("queue_size"):
+            base += f" --queue_size {settings['queue_size']}"
+    print(f"[cyan]Timeline: log2timeline {settings['mode']}-process, {settings['workers']} worker(s)[/cyan]")
     if parsers:
         base += f" --parsers {parsers}"
-    _run(f"{base} {evidence_dir}")
-
-    # 2) psort to JSONL; guarantee the file exists even if there are 0 events
+    export = str(tcfg.get("export", "psort")).lower()
     try:
-        _run(f"psort.py --status_view=none -o json_line -w {jsonl_file} {plaso_file}")
-    except RuntimeError as e:
-        print(f"[yellow]psort failed or produced no output; continuing[/yellow]\n{e}")
-    finally:
-        if not os.path.exists(jsonl_file):
+        _run(f"{base} {evidence_dir}")
+
+        # 2) events.jsonl: psort (default), or read straight from the Plaso
+        # storage file ("direct", no second Plaso process), or skipped ("none",
+        # for detections.sigma.source: plaso). The file always exists afterwards.
+        # With a sink (streaming Sigma), events are handed over while the file is
+        # still being written.
+        if sink is not None and export in ("psort", "direct"):
+            queue_size = int(tcfg.get("stream_queue", 10000))
+            try:
+                _export_streaming(export, plaso_file, jsonl_file, sink, queue_size)
+            except Exception as e:
+                if export != "direct":
+                    raise
+                print(f"[yellow]Timeline: direct export failed ({e}); falling back to psort[/yellow]")
+                export = "psort"
+                sink.reset()
+                _export_streaming(export, plaso_file, jsonl_file, sink, queue_size)
+        elif export == "direct":
+            print("[cyan]Timeline: exporting events.jsonl directly from the Plaso storage file[/cyan]")
+            try:
+                export_jsonl(plaso_file, jsonl_file)
+            except Exception as e:
+                print(f"[yellow]Timeline: direct export failed ({e}); falling back to psort[/yellow]")
+                export = "psort"
+        if sink is None and export == "psort":
+            _psort(plaso_file, jsonl_file)
+        elif export == "none":
             open(jsonl_file, "w").close()
+    finally:
+        # the sigma stage only hands on the sink's file, so it is closed here
+        # whatever the export did (or if log2timeline failed)
+        if sink is not None:
+            if export not in ("psort", "direct"):
+                print(f"[yellow]Timeline: detections.sigma.stream needs timeline.export psort or direct (not {export}); no events were evaluated[/yellow]")
+            sink.close()
+    if not os.path.exists(jsonl_file):
+        open(jsonl_file, "w").close()
 
-    # small index note
-    with open(os.path.join(outdir, "timeline.index"), "w") as f:
-        f.write(plaso_file + "\n" + jsonl_file + "\n")
+    # 3) sparse time/field index over events.jsonl (timeline.index: false keeps just the paths)
+    icfg = tcfg.get("index", {})
+    index_path = os.path.join(outdir, INDEX_NAME)
+    if icfg is False or export == "none":
+        with open(index_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "plaso": plaso_file, "events": jsonl_file}, f)
+    else:
+        build_index(jsonl_file, plaso_file, index_path, icfg if isinstance(icfg, dict) else {})
 
     return plaso_file, jsonl_file
+
+def export_jsonl(plaso_file: str, jsonl_file: str, atomic: bool = True) -> int:
+    """
+    Write events.jsonl in timestamp order straight from timeline.plaso; returns the event count.
+
+    atomic=False writes in place so the file can be tailed while it grows.
+    """
+    n = 0
+    tmp = f"{jsonl_file}.tmp" if atomic else jsonl_file
+    with open(tmp, "w") as f:
+        for ev in plasostore.iter_events(plaso_file, order="timestamp"):
+            f.write(json.dumps(ev) + "\n")
+            n += 1
+    if atomic:
+        os.replace(tmp, jsonl_file)
+    metrics.count("events", n)
+    return n
+
+def event_timestamp(ev: Dict[str, Any]) -> Optional[int]:
+    """Microseconds since 1970 from a Plaso json_line event, or None."""
+    ts = ev.get("timestamp")
+    if isinstance(ts, (int, float)):
+        return int(ts)
+    dt = ev.get("date_time")
+    if isinstance(dt, dict) and isinstance(dt.get("timestamp"), (int, float)):
+        units, shift = _DATE_TIME_CLASSES.get(dt.get("__class_name__"), (1000000, 0))
+        return int(dt["timestamp"] * 1000000 // units + shift * 1000000)
+    return None
+
+def _field(ev: Dict[str, Any], name: str):
+    if name in ev:
+        return ev[name]
+    cur: Any = ev
+    for part in name.split("."):
+        if not isinstance(cur, dict) or part not in cur:
+            return None
+        cur = cur[part]
+    return cur
+
+def _index_key(v: Any) -> Optional[str]:
+    if v is None or isinstance(v, (dict, list)):
+        return None
+    return str(v).lower()
+
+def build_index(jsonl_file: str, plaso_file: Optional[str], index_path: str, cfg: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Write a sparse index over events.jsonl in one pass.
+
+    Events are grouped into blocks of `stride` lines; for each block the
+    index keeps its byte offset, first line, event count and min/max
+    timestamp (microseconds). For each indexed field it keeps posting lists
+    value -> block ids (values compared case-insensitively). A field with
+    more than max_values distinct values is dropped from the postings and
+    recorded under "overflow"; queries on it scan every block instead.
+    """
+    cfg = cfg or {}
+    stride = max(1, int(cfg.get("stride", 1024)))
+    fields = list(cfg.get("fields") or DEFAULT_INDEX_FIELDS)
+    max_values = int(cfg.get("max_values", 65536))
+
+    blocks: List[List[Any]] = []
+    postings: Dict[str, Dict[str, List[int]]] = {f: {} for f in fields}
+    overflow: List[str] = []
+    offset = 0
+    with open(jsonl_file, "rb") as f:
+        for lineno, line in enumerate(f, 1):
+            pos, offset = offset, offset + len(line)
+            if (lineno - 1) % stride == 0:
+                blocks.append([pos, lineno, 0, None, None])
+            block = blocks[-1]
+            block[2] += 1
+            try:
+                ev = json.loads(line)
+            except Exception:
+                continue
+            if not isinstance(ev, dict):
+                continue
+            ts = event_timestamp(ev)
+            if ts is not None:
+                block[3] = ts if block[3] is None else min(block[3], ts)
+                block[4] = ts if block[4] is None else max(block[4], ts)
+            bid = len(blocks) - 1
+            for name in fields:
+                table = postings.get(name)
+                if table is None:
+                    continue
+                key = _index_key(_field(ev, name))
+                if key is None:
+                    continue
+                ids = table.get(key)
+                if ids is None:
+                    if len(table) >= max_values:
+                        del postings[name]
+                        overflow.append(name)
+                        continue
+                    ids = table[key] = []
+                if not ids or ids[-1] != bid:
+                    ids.append(bid)
+
+    st = os.stat(jsonl_file)
+    index = {
+        "version": INDEX_VERSION,
+        "plaso": plaso_file,
+        "events": jsonl_file,
+        "events_size": st.st_size,
+        "events_mtime_ns": st.st_mtime_ns,
+        "stride": stride,
+        "blocks": blocks,
+        "postings": postings,
+        "overflow": overflow,
+    }
+    tmp = f"{index_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp, index_path)
+    metrics.count("index_blocks", len(blocks))
+    return index_path
+
+def load_index(path: str) -> Optional[Dict[str, Any]]:
+    """Load timeline.index (a path to it or to its directory); None if missing, old or stale."""
+    if os.path.isdir(path):
+        path = os.path.join(path, INDEX_NAME)
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+        st = os.stat(index["events"])
+    except Exception:
+        return None
+    if index.get("version") != INDEX_VERSION or "blocks" not in index:
+        return None
+    if (st.st_size, st.st_mtime_ns) != (index.get("events_size"), index.get("events_mtime_ns")):
+        print(f"[yellow]Timeline: {path} is stale (events.jsonl changed); ignoring it[/yellow]")
+        return None
+    return index
+
+def _read_blocks(index: Dict[str, Any], block_ids: List[int]) -> Iterator[Dict[str, Any]]:
+    """Yield the events of the given blocks, seeking once per contiguous run."""
+    blocks = index["blocks"]
+    with open(index["events"], "rb") as f:
+        prev = None
+        for bid in sorted(set(block_ids)):
+            offset, _line, count = blocks[bid][:3]
+            if prev is None or bid != prev + 1:
+                f.seek(offset)
+            prev = bid
+            for _ in range(count):
+                line = f.readline()
+                if not line:
+                    return
+                try:
+                    ev = json.loads(line)
+                except Exception:
+                    continue
+                if isinstance(ev, dict):
+                    yield ev
+
+def events_between(index: Dict[str, Any], start: Optional[int] = None, end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Events with start <= timestamp < end (microseconds since 1970), reading only overlapping blocks."""
+    ids = [i for i, b in enumerate(index["blocks"])
+           if b[3] is not None and (end is None or b[3] < end) and (start is None or b[4] >= start)]
+    for ev in _read_blocks(index, ids):
+        ts = event_timestamp(ev)
+        if ts is not None and (start is None or ts >= start) and (end is None or ts < end):
+            yield ev
+
+def events_where(index: Dict[str, Any], field: str, value: Any, start: Optional[int] = None,
+                 end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Events whose field equals value (case-insensitive), optionally within a time range."""
+    key = _index_key(value)
+    table = index["postings"].get(field)
+    ids = table.get(key, []) if table is not None else range(len(index["blocks"]))
+    if start is not None or end is not None:
+        blocks = index["blocks"]
+        ids = [i for i in ids if blocks[i][3] is not None and (end is None or blocks[i][3] < end)
+               and (start is None or blocks[i][4] >= start)]
+    for ev in _read_blocks(index, list(ids)):
+        if _index_key(_field(ev, field)) != key:
+            continue
+        ts = event_timestamp(ev)
+        if (start is not None or end is not None) and (ts is None or (start is not None and ts < start)
+                                                        or (end is not None and ts >= end)):
+            continue
+        yield ev
+
+def events_around(index: Dict[str, Any], timestamp: int, seconds: int = 300) -> Iterator[Dict[str, Any]]:
+    """Events within +/- seconds of a timestamp (microseconds), e.g. to pivot around a finding."""
+    span = int(seconds) * 1000000
+    return events_between(index, timestamp - span, timestamp + span + 1)
@@ -0,0 +1,115 @@
+import os, json, time, shlex, shutil, platform, subprocess, importlib.util
+
+# Written at image build time (see Dockerfile) so runs do not pay for a
+# `--version` subprocess per tool; Plaso's alone costs over a second of
+# Python startup each.
+MANIFEST_ENV = "DFIRBOX_TOOL_VERSIONS"
+DEFAULT_MANIFEST = "/app/tool_versions.json"
+
+# provenance key -> (executable, version command)
+TOOLS = {
+    "plaso": ("log2timeline.py", "log2timeline.py --version"),
+    "psort": ("psort.py", "psort.py --version"),
+    "yara": ("yara", "yara --version"),
+    "syft": ("syft", "syft version"),
+}
+
+# Entries discovered at runtime (no manifest, or a tool changed since the
+# build), kept for the life of the process while their fingerprint holds.
+_DISCOVERED = {}
+
+
+def manifest_path():
+    return os.environ.get(MANIFEST_ENV, DEFAULT_MANIFEST)
+
+
+def fingerprint(cmd):
+    """Identify an installed tool by its resolved path, size and mtime."""
+    path = shutil.which(cmd)
+    if not path:
+        return None
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return f"{path}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _module_fingerprint(name):
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.origin or not os.path.exists(spec.origin):
+        return None
+    st = os.stat(spec.origin)
+    return f"{spec.origin}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _run(cmd):
+    try:
+        p = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except FileNotFoundError:
+        return None
+    if p.returncode != 0:
+        return None
+    return p.stdout.strip()
+
+
+def _discover(name):
+    """Version and fingerprint of one tool, found the slow way."""
+    if name == "python":
+        return {"version": f"Python {platform.python_version()}", "fingerprint": None}
+    if name == "yara_python":
+        fp = _module_fingerprint("yara")
+        try:
+            import yara as _y
+            version = getattr(_y, "__version__", "unknown")
+        except Exception:
+            version = None
+        return {"version": version, "fingerprint": fp}
+    exe, cmd = TOOLS[name]
+    fp = fingerprint(exe)
+    return {"version": _run(cmd) if fp else None, "fingerprint": fp}
+
+
+def _current(name):
+    if name == "python":
+        return None
+    if name == "yara_python":
+        return _module_fingerprint("yara")
+    return fingerprint(TOOLS[name][0])
+
+
+def _names():
+    return list(TOOLS) + ["python", "yara_python"]
+
+
+def write(path=None):
+    """Discover every tool version and write the manifest (run once at image build)."""
+    path = path or manifest_path()
+    tools = {name: _discover(name) for name in _names()}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"generated": int(time.time()), "tools": tools}, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+    return path
+
+
+def load(path=None):
+    try:
+        with open(path or manifest_path(), "r") as f:
+            return (json.load(f) or {}).get("tools") or {}
+    except Exception:
+        return {}
+
+
+def versions(path=None):
+    """{tool: version} from the build manifest; a tool whose path, size or mtime changed is rediscovered."""
+    recorded = load(path)
+    out = {}
+    for name in _names():
+        entry = recorded.get(name)
+        if name == "python":
+            entry = _discover(name)
+        elif not isinstance(entry, dict) or entry.get("fingerprint") != _current(name):
+            entry = _DISCOVERED.get(name)
+            if not entry or entry.get("fingerprint") != _current(name):
+                entry = _DISCOVERED[name] = _discover(name)
+        out[name] = entry.get("version")
+    return out
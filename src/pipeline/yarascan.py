@@ -0,0 +1,163 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from rich import print
+
+try:
+    import yara  # type: ignore
+except Exception:
+    yara = None  # type: ignore
+
+
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+DEFAULT_TIMEOUT = 60
+MAX_OFFSETS_PER_STRING = 32
+# libyara stops regexp matches at RE_SCAN_LIMIT bytes; also the reach assumed for open-ended hex jumps.
+RE_SCAN_LIMIT = 4096
+_TEXT_STRING = re.compile(r'\$\w*\s*=\s*"((?:\\.|[^"\\])*)"([^\n]*)')
+_HEX_STRING = re.compile(r"\$\w*\s*=\s*\{([^}]*)\}")
+
+# rules_dir -> (size/mtime stamp of the rule files, compile_rules result),
+# so one process compiles a rule pack once however many scans use it.
+_COMPILED: Dict[str, Tuple[Any, Any]] = {}
+
+
+def _rule_files(rules_dir: str) -> List[Tuple[str, str]]:
+    """Return sorted (namespace, path) pairs for every rule file under rules_dir."""
+    root = Path(rules_dir)
+    if not root.is_dir():
+        return []
+    files = [p for p in root.rglob("*") if p.is_file() and p.suffix.lower() in (".yar", ".yara")]
+    return sorted((p.relative_to(root).as_posix(), str(p)) for p in files)
+
+
+def rules_tree_sha256(rule_files: List[Tuple[str, str]]) -> str:
+    """Hash namespaces and contents of the rule set; the compiled-rules cache key."""
+    m = hashlib.sha256()
+    for namespace, path in rule_files:
+        m.update(namespace.encode() + b"\0")
+        with open(path, "rb") as f:
+            m.update(hashlib.sha256(f.read()).digest())
+    if yara is not None:
+        m.update(str(getattr(yara, "__version__", "")).encode())
+    return m.hexdigest()
+
+
+def compile_rules(rules_dir: str, cache_dir: Optional[str] = None):
+    """
+    Compile every rule under rules_dir once, one namespace per file.
+
+    When cache_dir is given the compiled rules are saved there as
+    yara-<tree sha256>.yarc and loaded directly on later calls.
+    Returns (rules, tree_sha256, rule_file_count) or (None, None, 0).
+    """
+    if yara is None:
+        print("[yellow]YARA: yara-python not available[/yellow]")
+        return None, None, 0
+
+    rule_files = _rule_files(rules_dir)
+    if not rule_files:
+        return None, None, 0
+
+    stamp = [(ns, os.stat(p).st_size, os.stat(p).st_mtime_ns) for ns, p in rule_files]
+    hit = _COMPILED.get(os.path.abspath(rules_dir))
+    if hit and hit[0] == stamp:
+        return hit[1]
+
+    tree_hash = rules_tree_sha256(rule_files)
+    cached = os.path.join(cache_dir, f"yara-{tree_hash}.yarc") if cache_dir else None
+
+    rules = None
+    if cached and os.path.exists(cached):
+        try:
+            rules = yara.load(cached)
+        except Exception as e:
+            print(f"[yellow]YARA: ignoring unreadable compiled rules {cached}: {e}[/yellow]")
+    if rules is not None:
+        _COMPILED[os.path.abspath(rules_dir)] = (stamp, (rules, tree_hash, len(rule_files)))
+        return rules, tree_hash, len(rule_files)
+
+    rules = yara.compile(filepaths=dict(rule_files))
+
+    if cached:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            rules.save(tmp)
+            os.replace(tmp, cached)
+        except Exception as e:
+            print(f"[yellow]YARA: failed caching compiled rules: {e}[/yellow]")
+
+    _COMPILED[os.path.abspath(rules_dir)] = (stamp, (rules, tree_hash, len(rule_files)))
+    return rules, tree_hash, len(rule_files)
+
+
+def string_reach(rules_dir: str) -> int:
+    """
+    Upper bound on the bytes one string match of the rule set can span.
+
+    Used as the overlap when a buffer is scanned in windows, so a match
+    cut by one window boundary is whole in the next window.
+    """
+    reach = RE_SCAN_LIMIT
+    for _ns, path in _rule_files(rules_dir):
+        try:
+            with open(path, "r", errors="replace") as f:
+                text = f.read()
+        except OSError:
+            continue
+        for literal, modifiers in _TEXT_STRING.findall(text):
+            reach = max(reach, len(literal) * (2 if "wide" in modifiers else 1))
+        for body in _HEX_STRING.findall(text):
+            jumps = 0
+            for lo, dash, hi in re.findall(r"\[\s*(\d*)\s*(-?)\s*(\d*)\s*\]", body):
+                bound = hi if dash else lo
+                jumps += int(bound) if bound else RE_SCAN_LIMIT
+            fixed = len(re.findall(r"[0-9A-Fa-f?]{2}", re.sub(r"\[[^\]]*\]", " ", body)))
+            reach = max(reach, fixed + jumps)
+    return reach
+
+
+def _serialize_match(m: Any) -> Dict[str, Any]:
+    strings = []
+    for s in m.strings:
+        offsets = [i.offset for i in s.instances[:MAX_OFFSETS_PER_STRING]]
+        strings.append({
+            "identifier": s.identifier,
+            "offsets": offsets,
+            "count": len(s.instances),
+        })
+    return {
+        "rule": m.rule,
+        "namespace": m.namespace,
+        "tags": list(m.tags),
+        "meta": dict(m.meta),
+        "strings": strings,
+    }
+
+
+def scan_data(rules, data, timeout: int = DEFAULT_TIMEOUT, label: str = "") -> List[Dict[str, Any]]:
+    """Scan an in-memory buffer (bytes or mmap) and return one structured hit per matching rule."""
+    try:
+        matches = rules.match(data=data, timeout=timeout)
+    except Exception as e:
+        print(f"[yellow]YARA: failed scanning {label}: {e}[/yellow]")
+        return []
+    return [_serialize_match(m) for m in matches]
+
+
+def file_consumer(rules, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES, timeout: int = DEFAULT_TIMEOUT):
+    """
+    Build an evidence.walk consumer that scans each file's buffer.
+
+    The buffer is the same one the walker hashes, so each file is read once;
+    the walker fills in the file's sha256 on every hit.
+    """
+    def consume(path: str, size: int, buf) -> List[Dict[str, Any]]:
+        if max_file_bytes and size > max_file_bytes:
+            return []
+        return [dict(h, file=path, size=size) for h in scan_data(rules, buf, timeout, path)]
+    return consume
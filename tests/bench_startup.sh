@@ -0,0 +1,42 @@
+#!/usr/bin/env bash
+# Startup benchmark for short subcommands: fails if `dfirbox version` /
+# `selftest` get slower than the budget or start importing pipeline
+# dependencies again. Run from the repo (or the image's /app) with the
+# runtime Python environment active.
+set -euo pipefail
+cd "$(dirname "$0")/.."
+BUDGET_MS="${DFIRBOX_STARTUP_BUDGET_MS:-300}"
+RUNS="${DFIRBOX_STARTUP_RUNS:-5}"
+
+python3 - "$BUDGET_MS" "$RUNS" <<'PY'
+import os, statistics, subprocess, sys, tempfile, time
+
+budget_ms, runs = float(sys.argv[1]), int(sys.argv[2])
+heavy = {"memprocfs", "yara", "pyarrow", "jinja2", "tqdm", "rich", "yaml"}
+out = tempfile.mkdtemp(prefix="dfirbox-bench-")
+# Like the image: versions come from a manifest written once up front.
+manifest = os.path.join(out, "tool_versions.json")
+subprocess.run([sys.executable, "-m", "src.cli", "version", "--write", manifest], check=True, stdout=subprocess.DEVNULL)
+os.environ["DFIRBOX_TOOL_VERSIONS"] = manifest
+commands = {
+    "version": [sys.executable, "-m", "src.cli", "version"],
+    "selftest": [sys.executable, "-m", "src.cli", "selftest", "-o", out],
+}
+failed = False
+for name, cmd in commands.items():
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - t0) * 1000)
+    imports = subprocess.run([sys.executable, "-X", "importtime"] + cmd[1:], check=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    loaded = sorted({line.rsplit("|", 1)[-1].strip().split(".")[0] for line in imports.splitlines()
+                     if line.startswith("import time:")} & heavy)
+    median = statistics.median(times)
+    ok = median <= budget_ms and not loaded
+    failed |= not ok
+    print(f"{'ok  ' if ok else 'FAIL'} {name:9s} median {median:6.1f} ms (budget {budget_ms:.0f} ms)"
+          + (f", imports {', '.join(loaded)}" if loaded else ""))
+sys.exit(1 if failed else 0)
+PY
@@ -0,0 +1,14 @@
+import os, sys
+
+import pytest
+
+# Tests import the pipeline as `src.pipeline`, like the CLI does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def boom():
+    """A stage function that always fails."""
+    def boom(results):
+        raise RuntimeError("boom")
+    return boom
@@ -0,0 +1,73 @@
+import os
+
+from src.pipeline import batch
+
+
+def _fake_cgroup(root, procs=""):
+    root.mkdir()
+    (root / "cgroup.controllers").write_text("cpuset cpu io memory pids\n")
+    (root / "cgroup.procs").write_text(procs)
+    (root / "cgroup.subtree_control").write_text("")
+    return str(root)
+
+
+def _job(tmp_path, name, **budget):
+    return dict({"id": name, "evidence": str(tmp_path), "out": str(tmp_path / name), "profile": str(tmp_path / "none.yml"),
+                 "cpus": None, "memory": None, "cpu_seconds": None, "timeout": None}, **budget)
+
+
+def test_parent_moves_processes_to_leaf_and_delegates(tmp_path):
+    base = _fake_cgroup(tmp_path / "cg", "1\n")
+    assert batch.cgroup_parent(base) == base
+    assert (tmp_path / "cg" / "dfirbox-worker" / "cgroup.procs").read_text() == "1"
+    assert (tmp_path / "cg" / "cgroup.subtree_control").read_text() == "+cpu +memory"
+
+
+def test_parent_without_controllers_falls_back(tmp_path):
+    base = _fake_cgroup(tmp_path / "cg")
+    (tmp_path / "cg" / "cgroup.controllers").write_text("hugetlb\n")
+    assert batch.cgroup_parent(base) is None
+    assert batch.Batch(lambda job: 0, 1, cgroup=base).cgroup is None
+
+
+def test_job_cgroup_limits(tmp_path):
+    base = _fake_cgroup(tmp_path / "cg")
+    d = batch._job_cgroup(base, _job(tmp_path, "a/b", memory=512 << 20), [0, 1])
+    assert os.path.basename(d).startswith("dfirbox-job-a_b-")
+    assert open(os.path.join(d, "memory.max")).read() == str(512 << 20)
+    assert open(os.path.join(d, "memory.oom.group")).read() == "1"
+    assert open(os.path.join(d, "cpu.max")).read() == "200000 100000"
+
+
+def test_usage_and_oom_status(tmp_path):
+    d = tmp_path / "job"
+    d.mkdir()
+    (d / "cpu.stat").write_text("usage_usec 2500000\nuser_usec 2000000\n")
+    (d / "memory.events").write_text("low 0\nhigh 0\nmax 4\noom 1\noom_kill 1\n")
+    (d / "memory.peak").write_text("1048576\n")
+    usage = batch._cgroup_usage(str(d))
+    assert usage == {"cpu_s": 2.5, "memory_peak": 1048576, "oom_kills": 1}
+    assert batch._status(-9, usage) == "memory_budget"
+    assert batch._status(1, {"oom_kills": 0}) == "failed_stages"
+
+
+def test_jobs_run_in_cgroup_or_with_rlimits(tmp_path):
+    base = _fake_cgroup(tmp_path / "cg")
+    results = batch.Batch(lambda job: 0, 2, cgroup=base).run([_job(tmp_path, "j1")])
+    assert results[0]["status"] == "ok"
+    assert results[0]["budget"]["enforced_by"] == "cgroup"
+    joined = [l for l in os.listdir(base) if l.startswith("dfirbox-job-j1-")]
+    assert open(os.path.join(base, joined[0], "cgroup.procs")).read().isdigit()
+
+    results = batch.Batch(lambda job: 1, 2, cgroup="off").run([_job(tmp_path, "j2", memory=1 << 30)])
+    assert results[0]["status"] == "failed_stages"
+    assert results[0]["budget"]["enforced_by"] == "rlimit"
+
+
+def test_crashed_job_is_an_error_not_failed_stages(tmp_path):
+    def crash(job):
+        raise ValueError("profile parse error")
+
+    results = batch.Batch(crash, 1, cgroup="off").run([_job(tmp_path, "j3")])
+    assert results[0]["status"] == "error"
+    assert "ValueError: profile parse error" in (tmp_path / "j3" / "dfirbox.log").read_text()
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from src.pipeline import detections
+
+RULE = """title: whoami
+detection:
+  sel:
+    CommandLine|contains: whoami
+  condition: sel
+"""
+
+
+@pytest.fixture
+def events(tmp_path):
+    path = tmp_path / "events.jsonl"
+    with open(path, "w") as f:
+        for i in range(500):
+            cmd = "whoami /all" if i % 7 == 0 else "x" * (i % 50)
+            f.write(json.dumps({"timestamp": i, "CommandLine": cmd}) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 16, 499, 10000])
+def test_shard_ranges_cover_file_on_line_boundaries(events, count):
+    data = events.read_bytes()
+    ranges = detections._shard_ranges(str(events), count)
+    assert 1 <= len(ranges) <= count
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[start - 1:start] == b"\n"
+    assert sum(data[s:e].count(b"\n") for s, e in ranges) == 500
+
+
+def test_shard_ranges_empty_file(tmp_path):
+    (tmp_path / "e.jsonl").write_bytes(b"")
+    assert detections._shard_ranges(str(tmp_path / "e.jsonl"), 4) == []
+
+
+def test_append_shard_rebases_lines(tmp_path):
+    shard = tmp_path / "shard"
+    shard.write_text(json.dumps({"rule": "r", "event_line": 3}) + "\n")
+    out = tmp_path / "out.jsonl"
+    with open(out, "w") as f:
+        detections._append_shard(f, str(shard), "line", 100)
+    assert json.loads(out.read_text()) == {"rule": "r", "event_line": 103}
+    assert not shard.exists()
+
+
+@pytest.mark.parametrize("event_ref", ["event", "offset", "line"])
+def test_sharded_sigma_matches_single_process(tmp_path, events, event_ref):
+    rules = tmp_path / "rules"
+    rules.mkdir()
+    (rules / "whoami.yml").write_text(RULE)
+    outputs = []
+    for workers in (1, 4):
+        out = tmp_path / f"out{workers}"
+        out.mkdir()
+        profile = tmp_path / f"p{workers}.yml"
+        profile.write_text(json.dumps({"detections": {"sigma": {
+            "rules_dir": str(rules), "workers": workers, "shard_bytes": 1024, "event_ref": event_ref}}}))
+        outputs.append((out / "sigma_findings.jsonl").read_text() if detections.run_sigma(str(events), str(profile), str(out)) else None)
+    assert outputs[0] == outputs[1]
+    findings = [json.loads(l) for l in outputs[0].splitlines()]
+    assert len(findings) == len(range(0, 500, 7))
+    assert all(detections.load_event(str(events), f)["CommandLine"] == "whoami /all" for f in findings)
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from src.pipeline import eventstore
+
+pytestmark = pytest.mark.skipif(not eventstore.available(), reason="pyarrow not installed")
+
+DAY_US = 86400 * 1000000
+
+
+def _events(path, n, days):
+    with open(path, "w") as f:
+        for i in range(n):
+            # interleave days so every partition stays active
+            f.write(json.dumps({"timestamp": (i % days) * DAY_US + i, "data_type": "t", "parser": "p", "i": i}) + "\n")
+
+
+def test_limits_hold_across_many_days(tmp_path, monkeypatch):
+    src = tmp_path / "events.jsonl"
+    _events(src, 3000, 200)
+    seen = {"open": 0, "buffered": 0}
+    orig_add = eventstore._PartitionWriter.add
+
+    def add(self, day, row):
+        orig_add(self, day, row)
+        seen["open"] = max(seen["open"], len(self.writers))
+        seen["buffered"] = max(seen["buffered"], self.buffered)
+
+    monkeypatch.setattr(eventstore._PartitionWriter, "add", add)
+    store = eventstore.build(str(src), str(tmp_path), {"batch_rows": 10, "max_buffered_rows": 100, "max_open_files": 8})
+
+    assert seen["open"] <= 8
+    assert seen["buffered"] < 100
+    assert eventstore.count(store) == 3000
+    rows = sorted(eventstore.scan(store, ["line", "timestamp"]), key=lambda r: r["line"])
+    assert [r["line"] for r in rows] == list(range(1, 3001))
+    # a closed day continues in further part files of the same partition
+    assert len([f for f in eventstore.fragments(store) if "date=1970-01-01" in f]) > 1
+
+
+def test_time_range_scan_prunes_days(tmp_path):
+    src = tmp_path / "events.jsonl"
+    _events(src, 400, 40)
+    store = eventstore.build(str(src), str(tmp_path), {"max_open_files": 4})
+    assert eventstore.count(store, start=10 * DAY_US, end=12 * DAY_US) == 20
@@ -0,0 +1,147 @@
+import struct
+
+from src.pipeline import evtx
+
+
+class _Fragment:
+    """Minimal Binary XML writer: elements with inline names, attributes and string text."""
+
+    def __init__(self, base):
+        self.base = base  # chunk offset of the first byte written
+        self.buf = bytearray(b"\x0f\x01\x01\x00")
+
+    def _name(self, name):
+        off = self.base + len(self.buf) + 4
+        self.buf += struct.pack("<I", off)
+        self.buf += struct.pack("<IHH", 0, 0, len(name)) + name.encode("utf-16-le") + b"\x00\x00"
+
+    def _text(self, text):
+        self.buf += struct.pack("<BBH", 0x05, 0x01, len(text)) + text.encode("utf-16-le")
+
+    def element(self, name, attrs=None, text=None, children=()):
+        self.buf += struct.pack("<BHI", 0x41 if attrs else 0x01, 0, 0)
+        self._name(name)
+        if attrs:
+            self.buf += struct.pack("<I", 0)
+            for k, v in attrs.items():
+                self.buf += b"\x06"
+                self._name(k)
+                self._text(v)
+        if text is None and not children:
+            self.buf += b"\x03"
+            return
+        self.buf += b"\x02"
+        if text is not None:
+            self._text(text)
+        for child in children:
+            child(self)
+        self.buf += b"\x04"
+
+    def end(self):
+        return bytes(self.buf + b"\x00")
+
+
+def _el(name, attrs=None, text=None, children=()):
+    return lambda f: f.element(name, attrs, text, children)
+
+
+def _record(pos, record_id, event_id, image):
+    frag = _Fragment(pos + 24)
+    _el("Event", children=[
+        _el("System", children=[
+            _el("Provider", {"Name": "Microsoft-Windows-Security-Auditing"}),
+            _el("EventID", text=str(event_id)),
+            _el("Computer", text="HOST1"),
+        ]),
+        _el("EventData", children=[_el("Data", {"Name": "Image"}, text=image)]),
+    ])(frag)
+    body = frag.end()
+    size = 24 + len(body) + 4
+    return struct.pack("<4sIQQ", evtx.RECORD_MAGIC, size, record_id, 0) + body + struct.pack("<I", size)
+
+
+def _chunk(events):
+    data = bytearray(evtx.CHUNK_HEADER_SIZE)
+    data[:8] = evtx.CHUNK_MAGIC
+    for record_id, event_id, image in events:
+        data += _record(len(data), record_id, event_id, image)
+    ids = [e[0] for e in events] or [0]
+    # first/last record number and id, as a writer fills them in
+    struct.pack_into("<4Q", data, 8, min(ids), max(ids), min(ids), max(ids))
+    struct.pack_into("<I", data, 48, len(data))
+    return bytes(data) + bytes(evtx.CHUNK_SIZE - len(data))
+
+
+def _write(path, header, chunks):
+    with open(path, "wb") as f:
+        f.write(header)
+        for c in chunks:
+            f.write(c)
+
+
+def test_iter_chunk_decodes_records():
+    recs = list(evtx.iter_chunk(_chunk([(1, 4688, "C:\\Windows\\cmd.exe"), (2, 4624, "C:\\x.exe")])))
+    assert [r[0] for r in recs] == [1, 2]
+    rec = recs[0][1]
+    assert rec["System"]["EventID"] == "4688"
+    assert rec["System"]["Provider"] == {"Name": "Microsoft-Windows-Security-Auditing"}
+    assert rec["EventData"] == {"Image": "C:\\Windows\\cmd.exe"}
+
+
+def test_zeroed_file_header_keeps_chunks(tmp_path):
+    # memory-carved logs: header page not resident, chunks intact
+    path = tmp_path / "carved.evtx"
+    _write(path, bytes(evtx.FILE_HEADER_SIZE), [_chunk([(1, 4688, "a.exe")]), _chunk([(2, 4688, "b.exe")])])
+    assert evtx.chunk_count(str(path)) == 2
+    images = [r["EventData"]["Image"] for r in evtx.iter_records(str(path))]
+    assert images == ["a.exe", "b.exe"]
+
+
+def test_zeroed_chunk_slot_is_skipped(tmp_path):
+    path = tmp_path / "holes.evtx"
+    header = evtx.FILE_MAGIC + bytes(evtx.FILE_HEADER_SIZE - len(evtx.FILE_MAGIC))
+    _write(path, header, [_chunk([(1, 1, "a.exe")]), bytes(evtx.CHUNK_SIZE), _chunk([(3, 1, "c.exe")])])
+    assert [r["EventData"]["Image"] for r in evtx.iter_records(str(path))] == ["a.exe", "c.exe"]
+    assert [r["EventData"]["Image"] for r in evtx.iter_records(str(path), 2, 3)] == ["c.exe"]
+
+
+def test_resyncs_after_zero_filled_hole():
+    data = bytearray(_chunk([(1, 1, "a.exe"), (2, 1, "b.exe"), (3, 1, "c.exe")]))
+    first = evtx._record_at(bytes(data), evtx.CHUNK_HEADER_SIZE, len(data))
+    second = evtx._record_at(bytes(data), evtx.CHUNK_HEADER_SIZE + first, len(data))
+    start = evtx.CHUNK_HEADER_SIZE + first
+    data[start:start + second] = bytes(second)
+    assert [r[0] for r in evtx.iter_chunk(bytes(data))] == [1, 3]
+
+
+def test_chunk_shared_by_two_logs_read_once(tmp_path):
+    header = evtx.FILE_MAGIC + bytes(evtx.FILE_HEADER_SIZE - len(evtx.FILE_MAGIC))
+    shared = _chunk([(10, 4688, "shared.exe"), (11, 4688, "shared2.exe")])
+    holed = bytearray(shared)
+    holed[evtx.CHUNK_HEADER_SIZE:evtx.CHUNK_HEADER_SIZE + 64] = bytes(64)  # first record not resident
+    _write(tmp_path / "a.evtx", header, [_chunk([(1, 1, "a.exe")]), bytes(holed)])
+    _write(tmp_path / "b.evtx", bytes(evtx.FILE_HEADER_SIZE), [shared, _chunk([(20, 1, "b.exe")])])
+    files = evtx.find_files([str(tmp_path)])
+
+    chunks = evtx.unique_chunks(files)
+    # the complete copy in b.evtx wins over the holed one in a.evtx
+    assert chunks == [(str(tmp_path / "a.evtx"), [0]), (str(tmp_path / "b.evtx"), [0, 1])]
+    images = [r["EventData"]["Image"] for path, idx in chunks for r in evtx.iter_records(path, chunks=idx)]
+    assert images == ["a.exe", "shared.exe", "shared2.exe", "b.exe"]
+
+
+def test_sigma_evtx_reports_shared_chunk_once(tmp_path):
+    from src.pipeline import detections
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    shared = _chunk([(10, 4688, "evil.exe")])
+    _write(logs / "Security.evtx", bytes(evtx.FILE_HEADER_SIZE), [shared])
+    _write(logs / "carved.evtx", bytes(evtx.FILE_HEADER_SIZE), [_chunk([(1, 1, "a.exe")]), shared])
+    rules = tmp_path / "rules"
+    rules.mkdir()
+    (rules / "evil.yml").write_text("title: evil\ndetection:\n  sel:\n    EventData.Image: evil.exe\n  condition: sel\n")
+    profile = tmp_path / "p.yml"
+    profile.write_text(f"detections:\n  sigma:\n    rules_dir: {rules}\n    workers: 2\n"
+                       f"    evtx:\n      enabled: true\n      chunks_per_shard: 1\n      dirs: [{logs}]\n")
+    out = detections.run_sigma_evtx(str(tmp_path), str(profile), str(tmp_path))
+    assert len(open(out).read().splitlines()) == 1
@@ -0,0 +1,24 @@
+from src.pipeline import evidence, integrity, provenance
+
+
+def test_verify_hashes_rules_once_for_provenance(tmp_path, monkeypatch):
+    monkeypatch.setattr(integrity, "_tool_paths", lambda: [])
+    rules = tmp_path / "rules"
+    (rules / "sigma").mkdir(parents=True)
+    (rules / "sigma" / "a.yml").write_text("a")
+    (rules / "yara.yar").write_text("b")
+    manifest = integrity.write(str(tmp_path / "m.json"), roots=[str(rules)])
+    (rules / "sigma" / "new.yml").write_text("added after the build")
+    (rules / "yara.yar").write_text("changed")
+
+    hashed = []
+    orig = evidence.read_once
+    monkeypatch.setattr(evidence, "read_once", lambda root, path, *a: hashed.append(path) or orig(root, path, *a))
+    result = integrity.verify(manifest, roots=[str(rules)])
+
+    assert result["status"] == "mismatch"
+    assert result["changed"] == [str(rules / "yara.yar")]
+    assert sorted(hashed) == sorted({str(p) for p in rules.rglob("*") if p.is_file()})
+    digest, _dirs, count = evidence.merkle(result["entries"], str(rules))
+    assert (digest, count) == provenance._hash_tree(str(rules))[:2]
+    assert "entries" not in integrity.verify(manifest)
@@ -0,0 +1,121 @@
+import json
+import types
+
+import pytest
+
+from src.pipeline import memory, yarascan
+
+pytestmark = pytest.mark.skipif(yarascan.yara is None, reason="yara-python not installed")
+
+RULE = 'rule Marker { strings: $m = "EVIL-MARKER-STRING" condition: $m }'
+
+
+class _Memory:
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    def read(self, addr, size, flags=0):
+        self.reads.append(size)
+        return self.data[addr - 0x10000:addr - 0x10000 + size]
+
+
+class _Process:
+    def __init__(self, pid, data, image=None):
+        self.pid = pid
+        self.name = f"p{pid}.exe"
+        self.memory = _Memory(data)
+        vad = {"start": 0x10000, "end": 0x10000 + len(data) - 1, "commit": True}
+        if image:
+            vad.update(type="Image", image=True, text=image)
+        self.maps = types.SimpleNamespace(vad=lambda: [vad], handle=lambda: [{"type": "File"}], thread=lambda: [{"tid": 7}],
+                                          unloaded_module=lambda: [])
+
+    def module_list(self):
+        return []
+
+
+class _Vmm:
+    closed = 0
+
+    def __init__(self, processes):
+        self.processes = processes
+
+    def process_list(self):
+        return self.processes
+
+    def process(self, pid):
+        return next(p for p in self.processes if p.pid == pid)
+
+    def close(self):
+        _Vmm.closed += 1
+
+
+@pytest.fixture
+def rules(tmp_path):
+    d = tmp_path / "rules"
+    d.mkdir()
+    (d / "marker.yar").write_text(RULE)
+    return str(d), yarascan.compile_rules(str(d))[0]
+
+
+def test_match_across_window_boundary_reported_once(rules):
+    rules_dir, compiled = rules
+    data = bytearray(64 * 1024)
+    marker = b"EVIL-MARKER-STRING"
+    data[4090:4090 + len(marker)] = marker  # straddles the first 4 KiB window
+    data[20000:20000 + len(marker)] = marker
+    proc = _Process(1, bytes(data))
+    hits, read = memory._scan_region(proc, compiled, 0x10000, len(data), 8192, 4096, 0, 60, "t")
+    assert len(hits) == 1
+    assert hits[0]["strings"][0]["offsets"] == [4090, 20000]
+    assert hits[0]["strings"][0]["count"] == 2
+    assert max(proc.memory.reads) == 8192
+    assert read >= len(data)
+
+
+def test_known_backing_hash_skipped_and_owned_handle_closed(rules, tmp_path, monkeypatch):
+    rules_dir, _compiled = rules
+    out = tmp_path / "out"
+    out.mkdir()
+    sha = "ab" * 32
+    with open(out / "evidence_manifest.jsonl", "w") as f:
+        f.write(json.dumps({"path": "/evidence/C/Windows/System32/good.dll", "size": 10, "sha256": sha}) + "\n")
+    profile = tmp_path / "p.yml"
+    profile.write_text(f"memory:\n  memprocfs:\n    enabled: true\n    yara:\n      enabled: true\n      rules_dir: {rules_dir}\n")
+    payload = b"\0" * 100 + b"EVIL-MARKER-STRING" + b"\0" * 100
+    vmm = _Vmm([_Process(1, payload, image=r"\Device\HarddiskVolume2\Windows\System32\good.dll"),
+                _Process(2, payload, image=r"\Device\HarddiskVolume2\Windows\System32\other.dll")])
+    monkeypatch.setattr(memory, "_open_vmm", lambda ev, cfg: (vmm, "/evidence/mem.raw"))
+    monkeypatch.setattr(memory, "memprocfs", types.SimpleNamespace())
+    _Vmm.closed = 0
+
+    result = memory.run_memory_yara(str(tmp_path), str(profile), str(out))
+
+    assert result["stats"]["skipped_known"] == 1
+    hits = [json.loads(l) for l in open(out / "memprocfs_yara_hits.jsonl")]
+    assert [h["pid"] for h in hits] == [2]
+    assert _Vmm.closed == 1
+
+
+def test_hit_context_queries_skipped_sections_from_kept_handle(tmp_path, monkeypatch):
+    profile = tmp_path / "p.yml"
+    profile.write_text("memory:\n  memprocfs:\n    enabled: true\n    processes:\n      include_threads: false\n")
+    hits = tmp_path / "memprocfs_yara_hits.jsonl"
+    hits.write_text("".join(json.dumps({"rule": "Marker", "pid": pid}) + "\n" for pid in (2, 2, 1)))
+    vmm = _Vmm([_Process(1, b"x"), _Process(2, b"x")])
+    monkeypatch.setattr(memory, "_open_vmm", lambda ev, cfg: (vmm, "/evidence/mem.raw"))
+    monkeypatch.setitem(memory._handles, "/evidence/mem.raw", vmm)
+    _Vmm.closed = 0
+    meta = {"memprocfs": {"collection_plan": {"needs": ["modules", "processes"], "reasons": {}}},
+            "memory_yara": {"hits_jsonl": str(hits)}}
+
+    path = memory.hit_context(str(tmp_path), str(profile), str(tmp_path), meta)
+
+    context = json.load(open(path))
+    assert list(context) == ["2", "1"]
+    assert context["2"]["handles"] == [{"type": "File"}] and context["2"]["unloaded_modules"] == []
+    assert "modules" not in context["2"] and "threads" not in context["2"]
+    assert _Vmm.closed == 0
+    meta["memprocfs"] = {}
+    assert memory.hit_context(str(tmp_path), str(profile), str(tmp_path), meta) is None
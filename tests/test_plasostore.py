@@ -0,0 +1,94 @@
+import json, sqlite3, zlib
+
+import pytest
+
+from src.pipeline import plasostore
+
+PATH_SPEC = {"__type__": "PathSpec", "type_indicator": "OS", "location": "/evidence/Windows/System32/winevt/Logs/Security.evtx"}
+SHA256 = "9f" * 32
+DATE_TIME = {"__class_name__": "Filetime", "__type__": "DateTimeValues", "timestamp": 132456789012345678}
+
+# `psort -o json_line` output for the same two events, minus the fields only
+# psort's formatters produce (message, __type__, _event_values_hash, tag, ...)
+PSORT = [
+    {"__container_type__": "event", "data_type": "windows:evtx:record", "date_time": DATE_TIME,
+     "display_name": "OS:/evidence/Windows/System32/winevt/Logs/Security.evtx", "event_identifier": 4624,
+     "filename": "/evidence/Windows/System32/winevt/Logs/Security.evtx", "parser": "winevtx", "pathspec": PATH_SPEC,
+     "sha256_hash": SHA256, "source_name": "Microsoft-Windows-Security-Auditing", "timestamp": 1602205301234567,
+     "timestamp_desc": "Creation Time"},
+    {"__container_type__": "event", "data_type": "windows:evtx:record", "date_time": DATE_TIME,
+     "display_name": "OS:/evidence/Windows/System32/winevt/Logs/Security.evtx", "event_identifier": 4688,
+     "filename": "/evidence/Windows/System32/winevt/Logs/Security.evtx", "parser": "winevtx", "pathspec": PATH_SPEC,
+     "sha256_hash": SHA256, "source_name": "Microsoft-Windows-Security-Auditing", "timestamp": 1602205302234567,
+     "timestamp_desc": "Creation Time"},
+]
+STREAM = {"path_spec": PATH_SPEC, "sha256_hash": SHA256}
+EVENT_DATA = [{"data_type": "windows:evtx:record", "_parser_chain": "winevtx", "event_identifier": eid,
+               "source_name": "Microsoft-Windows-Security-Auditing", "_event_data_stream_identifier": "event_data_stream.1"}
+              for eid in (4624, 4688)]
+EVENTS = [{"timestamp": ts, "timestamp_desc": "Creation Time", "date_time": DATE_TIME, "_event_data_identifier": f"event_data.{i + 1}"}
+          for i, ts in enumerate((1602205301234567, 1602205302234567))]
+
+
+def _blob_layout(path):
+    # format 20190309 style: one zlib-compressed JSON blob per container
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE metadata (key TEXT, value TEXT)")
+    conn.execute("INSERT INTO metadata VALUES ('compression_format', 'zlib')")
+    for table, rows in (("event_data_stream", [STREAM]), ("event_data", EVENT_DATA), ("event", EVENTS)):
+        extra = ", _timestamp BIGINT" if table == "event" else ""
+        conn.execute(f"CREATE TABLE {table} (_identifier INTEGER PRIMARY KEY AUTOINCREMENT, _data BLOB{extra})")
+        for row in rows:
+            blob = zlib.compress(json.dumps(dict(row, __container_type__=table, __type__="AttributeContainer")).encode())
+            if table == "event":
+                conn.execute("INSERT INTO event (_data, _timestamp) VALUES (?, ?)", (blob, row["timestamp"]))
+            else:
+                conn.execute(f"INSERT INTO {table} (_data) VALUES (?)", (blob,))
+    conn.commit()
+    conn.close()
+
+
+def _column_layout(path):
+    # acstore column layout: one column per attribute, compound values as JSON text,
+    # references as *_row_identifier integers
+    def columns(row):
+        out = {}
+        for k, v in row.items():
+            if k.startswith("_") and k.endswith("_identifier"):
+                k, v = k.replace("_identifier", "_row_identifier"), int(v.rsplit(".", 1)[1])
+            out[k] = json.dumps(v) if isinstance(v, dict) else v
+        return out
+
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE metadata (key TEXT, value TEXT)")
+    for table, rows in (("event_data_stream", [STREAM]), ("event_data", EVENT_DATA), ("event", EVENTS)):
+        rows = [columns(r) for r in rows]
+        conn.execute(f"CREATE TABLE {table} ({', '.join(rows[0])})")
+        for r in rows:
+            conn.execute(f"INSERT INTO {table} VALUES ({', '.join('?' * len(r))})", list(r.values()))
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("layout", [_blob_layout, _column_layout])
+def test_events_match_psort_json_line(tmp_path, layout):
+    path = str(tmp_path / "timeline.plaso")
+    layout(path)
+    events = list(plasostore.iter_events(path, order="timestamp"))
+    assert events == PSORT
+    assert list(plasostore.iter_events(path, start=2)) == PSORT[1:]
+
+
+def test_parent_location_and_missing_stream(tmp_path):
+    gz = {"type_indicator": "GZIP", "parent": {"type_indicator": "OS", "location": "/evidence/var/log/syslog.1.gz"}}
+    assert plasostore._path_fields(gz)["display_name"] == "GZIP:/evidence/var/log/syslog.1.gz"
+    path = str(tmp_path / "t.plaso")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE event_data (data_type, _parser_chain)")
+    conn.execute("INSERT INTO event_data VALUES ('syslog:line', 'text/syslog')")
+    conn.execute("CREATE TABLE event (timestamp, _event_data_row_identifier)")
+    conn.execute("INSERT INTO event VALUES (1, 1)")
+    conn.commit()
+    conn.close()
+    assert list(plasostore.iter_events(path)) == [
+        {"data_type": "syslog:line", "parser": "text/syslog", "timestamp": 1, "__container_type__": "event"}]
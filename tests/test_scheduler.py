@@ -0,0 +1,33 @@
+import threading
+
+import pytest
+
+from src.pipeline import scheduler
+from src.pipeline.scheduler import Stage
+
+
+def test_failure_skips_only_dependents(boom):
+    meta = {}
+    stages = [
+        Stage("collect", lambda r: 1),
+        Stage("timeline", boom, deps=["collect"]),
+        Stage("sigma", lambda r: r["timeline"], deps=["timeline"]),
+        Stage("report", lambda r: 0, deps=["sigma"]),
+        Stage("yara", lambda r: r["collect"] + 1, deps=["collect"]),
+    ]
+    results = scheduler.run_stages(stages, max_workers=2, meta=meta)
+    assert results == {"collect": 1, "yara": 2}
+    status = {k: v["status"] for k, v in meta["stages"].items()}
+    assert status == {"collect": "ok", "timeline": "failed", "sigma": "skipped", "report": "skipped", "yara": "ok"}
+    assert meta["stages"]["report"]["reason"] == "dependency timeline failed"
+
+
+def test_independent_stages_overlap():
+    barrier = threading.Barrier(2, timeout=5)
+    stages = [Stage("a", lambda r: barrier.wait()), Stage("b", lambda r: barrier.wait())]
+    assert set(scheduler.run_stages(stages, max_workers=2)) == {"a", "b"}
+
+
+def test_unknown_dependency_rejected():
+    with pytest.raises(ValueError):
+        scheduler.run_stages([Stage("a", lambda r: 1, deps=["nope"])])
@@ -0,0 +1,84 @@
+import yaml
+
+from src.pipeline import sigmaengine
+
+
+def _rule(detection, title="t", logsource=None):
+    return sigmaengine.SigmaRule({"title": title, "detection": detection, "logsource": logsource or {}}, f"{title}.yml")
+
+
+def _engine(*rules):
+    return sigmaengine.SigmaEngine([_rule(d, f"r{i}") for i, d in enumerate(rules)])
+
+
+PROC = {"EventID": 4688, "Image": "C:\\Windows\\System32\\cmd.exe", "CommandLine": "cmd /c whoami /all", "User": "ACME\\bob"}
+
+
+def test_and_or_not():
+    rule = _rule({
+        "sel": {"EventID": 4688},
+        "cmd": {"Image|endswith": "\\cmd.exe"},
+        "ps": {"Image|endswith": "\\powershell.exe"},
+        "admin": {"User|startswith": "NT AUTHORITY"},
+        "condition": "sel and (cmd or ps) and not admin",
+    })
+    ev = sigmaengine.EventView(PROC)
+    assert rule.matches(ev)
+    assert not rule.matches(sigmaengine.EventView(dict(PROC, User="NT AUTHORITY\\SYSTEM")))
+    assert not rule.matches(sigmaengine.EventView(dict(PROC, Image="C:\\x\\notepad.exe")))
+
+
+def test_one_of_all_of_and_threshold():
+    det = {
+        "sel_a": {"CommandLine|contains": "whoami"},
+        "sel_b": {"CommandLine|contains": "/all"},
+        "sel_c": {"CommandLine|contains": "net user"},
+    }
+    ev = sigmaengine.EventView(PROC)
+    assert _rule(dict(det, condition="1 of sel_*")).matches(ev)
+    assert not _rule(dict(det, condition="all of sel_*")).matches(ev)
+    assert _rule(dict(det, condition="all of sel_a")).matches(ev)
+    assert _rule(dict(det, condition="2 of sel_*")).matches(ev)
+    assert not _rule(dict(det, condition="3 of them")).matches(ev)
+    # any child's keys are enough to reach an `N of` rule
+    assert _rule(dict(det, condition="2 of sel_*")).keys == frozenset({("f", "CommandLine")})
+
+
+def test_contains_all_and_wildcards():
+    rule = _rule({"sel": {"CommandLine|contains|all": ["whoami", "/ALL"]}, "condition": "sel"})
+    assert rule.matches(sigmaengine.EventView(PROC))
+    assert not rule.matches(sigmaengine.EventView(dict(PROC, CommandLine="whoami")))
+    rule = _rule({"sel": {"Image": "*\\system32\\c?d.exe"}, "condition": "sel"})
+    assert rule.matches(sigmaengine.EventView(PROC))
+
+
+def test_keywords_search_every_string():
+    rule = _rule({"keywords": ["mimikatz", "sekurlsa"], "condition": "keywords"})
+    assert rule.keywords and rule.keys is None
+    assert rule.matches(sigmaengine.EventView({"a": {"b": ["x", "run SEKURLSA::logonpasswords"]}}))
+    assert not rule.matches(sigmaengine.EventView(PROC))
+
+
+def test_value_index_dispatch():
+    engine = _engine(
+        {"sel": {"EventID": 4688}, "condition": "sel"},
+        {"sel": {"EventID": [4624, 4625]}, "condition": "sel"},
+        {"sel": {"Image|endswith": "\\cmd.exe"}, "condition": "sel"},
+        {"sel": {"EventID": 1}, "condition": "not sel"},
+    )
+    assert engine.by_value["EventID"] == {"4688": [0], "4624": [1], "4625": [1]}
+    assert engine.by_field == {"Image": [2]}
+    assert engine.unindexed == [3]
+    ev = sigmaengine.EventView(PROC)
+    assert engine.candidates(ev) == [0, 2, 3]
+    assert [r.title for r in engine.match(PROC)] == ["r0", "r2", "r3"]
+
+
+def test_unsupported_modifiers_counted(tmp_path):
+    for name, field in (("a", "CommandLine|windash|contains"), ("b", "CommandLine|base64offset|contains"),
+                        ("c", "CommandLine|contains"), ("d", "CommandLine|windash")):
+        (tmp_path / f"{name}.yml").write_text(yaml.safe_dump({"title": name, "detection": {"sel": {field: "x"}, "condition": "sel"}}))
+    engine = sigmaengine.load_rules(str(tmp_path), quiet=True)
+    assert [r.title for r in engine.rules] == ["c"]
+    assert engine.skipped_rules == 3
+    assert engine.skip_summary() == "3 rule(s) skipped for unsupported modifiers (base64offset: 1, windash: 2)"
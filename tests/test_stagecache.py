@@ -0,0 +1,46 @@
+from src.pipeline import scheduler, stagecache
+from src.pipeline.scheduler import Stage
+
+
+def test_cached_stage_not_rerun_until_key_or_output_changes(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    calls = []
+
+    def make(results):
+        calls.append(1)
+        path = out / "timeline.plaso"
+        path.write_text("x")
+        return {"plaso": str(path)}
+
+    def run(key):
+        meta = {}
+        scheduler.run_stages([Stage("timeline", make, key=key)], meta=meta, cache=stagecache.StageCache(str(out)))
+        return meta["stages"]["timeline"]["status"]
+
+    key = stagecache.stage_key("timeline", evidence="e1", profile={"a": 1})
+    assert run(key) == "ok"
+    assert run(stagecache.stage_key("timeline", profile={"a": 1}, evidence="e1")) == "cached"
+    assert run(stagecache.stage_key("timeline", evidence="e1", profile={"a": 2})) == "ok"
+    (out / "timeline.plaso").unlink()
+    assert run(stagecache.stage_key("timeline", evidence="e1", profile={"a": 2})) == "ok"
+    assert len(calls) == 3
+
+
+def test_failed_stage_leaves_no_record(tmp_path, boom):
+    cache = stagecache.StageCache(str(tmp_path))
+    cache.record("sigma", "k1", {"findings": 1})
+    scheduler.run_stages([Stage("sigma", boom, key="k2")], cache=cache)
+    assert stagecache.StageCache(str(tmp_path)).lookup("sigma", "k1") == (False, None)
+
+
+def test_fingerprint_and_tree_digest_follow_changes(tmp_path):
+    rules = tmp_path / "rules"
+    rules.mkdir()
+    (rules / "a.yml").write_text("one")
+    fp, digest = stagecache.fingerprint_paths([str(rules)]), stagecache.tree_digest(str(rules))
+    assert stagecache.tree_digest(str(rules)) == digest
+    (rules / "b.yml").write_text("two")
+    assert stagecache.fingerprint_paths([str(rules)]) != fp
+    assert stagecache.tree_digest(str(rules)) != digest
+    assert stagecache.tree_digest(str(tmp_path / "missing")) is None
@@ -0,0 +1,66 @@
+import json, os
+
+from src.pipeline import timeline
+
+
+def _events(path, n=1000):
+    evs = []
+    for i in range(n):
+        ev = {"timestamp": (i * 37 % n) * 1000000, "data_type": ["fs:stat", "windows:evtx:record"][i % 2],
+              "parser": "winevtx" if i % 2 else "filestat", "EventID": 4624 + i % 3, "filename": f"/f{i}"}
+        evs.append(ev)
+    with open(path, "w") as f:
+        for ev in evs:
+            f.write(json.dumps(ev) + "\n")
+        f.write("not json\n")
+    return evs
+
+
+def _index(tmp_path, **cfg):
+    jsonl = str(tmp_path / "events.jsonl")
+    evs = _events(jsonl)
+    path = timeline.build_index(jsonl, None, str(tmp_path / timeline.INDEX_NAME), dict({"stride": 64}, **cfg))
+    return evs, timeline.load_index(str(tmp_path))
+
+
+def test_time_range_matches_full_scan(tmp_path):
+    evs, index = _index(tmp_path)
+    assert len(index["blocks"]) == -(-1001 // 64)
+    got = list(timeline.events_between(index, 100 * 1000000, 200 * 1000000))
+    assert sorted(e["filename"] for e in got) == sorted(e["filename"] for e in evs if 100 <= e["timestamp"] // 1000000 < 200)
+    around = list(timeline.events_around(index, 500 * 1000000, seconds=2))
+    assert sorted(e["timestamp"] // 1000000 for e in around) == [498, 499, 500, 501, 502]
+
+
+def test_field_lookup_uses_postings_and_is_case_insensitive(tmp_path):
+    evs, index = _index(tmp_path)
+    assert index["postings"]["parser"]["winevtx"] == list(range(len(index["blocks"])))
+    got = list(timeline.events_where(index, "data_type", "WINDOWS:EVTX:RECORD", start=0, end=300 * 1000000))
+    want = [e for e in evs if e["data_type"] == "windows:evtx:record" and e["timestamp"] < 300 * 1000000]
+    assert [e["filename"] for e in got] == [e["filename"] for e in want]
+    assert [e["filename"] for e in timeline.events_where(index, "filename", "/F999")] == ["/f999"]
+    assert index["postings"]["filename"]["/f999"] == [999 // 64]
+
+
+def test_overflowing_field_falls_back_to_scan(tmp_path):
+    evs, index = _index(tmp_path, max_values=10)
+    assert "filename" in index["overflow"] and "filename" not in index["postings"]
+    assert [e["filename"] for e in timeline.events_where(index, "filename", "/f3")] == ["/f3"]
+    assert len(list(timeline.events_where(index, "EventID", 4625))) == len([e for e in evs if e["EventID"] == 4625])
+
+
+def test_stale_index_is_ignored(tmp_path):
+    _evs, index = _index(tmp_path)
+    assert index is not None
+    with open(tmp_path / "events.jsonl", "a") as f:
+        f.write("{}\n")
+    os.utime(tmp_path / "events.jsonl", ns=(0, 0))
+    assert timeline.load_index(str(tmp_path)) is None
+
+
+def test_event_timestamp_from_date_time():
+    assert timeline.event_timestamp({"timestamp": 5}) == 5
+    filetime = {"__class_name__": "Filetime", "timestamp": 116444736000000000 + 10}
+    assert timeline.event_timestamp({"date_time": filetime}) == 1
+    assert timeline.event_timestamp({"date_time": {"__class_name__": "PosixTime", "timestamp": 2}}) == 2000000
+    assert timeline.event_timestamp({}) is None
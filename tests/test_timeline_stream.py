@@ -0,0 +1,67 @@
+import pytest
+
+from src.pipeline import timeline
+
+
+class _Sink:
+    def __init__(self):
+        self.lines = []
+        self.closed = 0
+
+    def feed(self, offset, lineno, line):
+        self.lines.append(lineno)
+
+    def reset(self):
+        self.lines = []
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    def run(export, fail=False):
+        def log2timeline(cmd, env=None, cwd=None):
+            if fail:
+                raise RuntimeError("log2timeline failed")
+        monkeypatch.setattr(timeline, "_run", log2timeline)
+        profile = tmp_path / "p.yml"
+        profile.write_text(f"timeline:\n  export: {export}\n")
+        sink = _Sink()
+        try:
+            timeline.make_timeline(str(tmp_path), str(tmp_path), str(profile), sink=sink)
+        except RuntimeError:
+            pass
+        return sink
+    return run
+
+
+def test_sink_closed_without_export(run, tmp_path):
+    sink = run("none")
+    assert sink.closed == 1 and sink.lines == []
+    assert (tmp_path / "events.jsonl").exists()
+
+
+def test_sink_closed_when_log2timeline_fails(run):
+    assert run("psort", fail=True).closed == 1
+
+
+def test_streaming_direct_export_falls_back_to_psort(tmp_path, monkeypatch):
+    def export_jsonl(plaso_file, jsonl_file, atomic=True):
+        with open(jsonl_file, "w") as f:
+            f.write('{"n": 1}\n')
+        raise ValueError("unsupported storage format")
+
+    def psort(plaso_file, jsonl_file):
+        with open(jsonl_file, "w") as f:
+            f.write('{"n": 1}\n{"n": 2}\n')
+
+    monkeypatch.setattr(timeline, "_run", lambda cmd, env=None, cwd=None: None)
+    monkeypatch.setattr(timeline, "export_jsonl", export_jsonl)
+    monkeypatch.setattr(timeline, "_psort", psort)
+    monkeypatch.setattr(timeline, "build_index", lambda *a: None)
+    profile = tmp_path / "p.yml"
+    profile.write_text("timeline:\n  export: direct\n")
+    sink = _Sink()
+    timeline.make_timeline(str(tmp_path), str(tmp_path), str(profile), sink=sink)
+    assert sink.lines == [1, 2] and sink.closed == 1